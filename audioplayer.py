@@ -1,80 +1,5759 @@
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
-import pygame
+import time
+STARTUP_STARTED = time.perf_counter()  # --startup-profile measures from here
+
 import os
 import threading
-from PIL import Image, ImageDraw
-import pystray
-from pystray import MenuItem as item
+import queue
+import math
+import multiprocessing
+import sqlite3
+import json
+import socket
+import asyncio
+import argparse
+import io
+import base64
+import mmap
+import struct
+import hashlib
+import heapq
+import bisect
+import urllib.parse
+import importlib
+import importlib.util
+import re
+import random
+from array import array
+from collections import OrderedDict, deque
+from itertools import compress, islice
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
 import sys
 
-# For getting audio duration
-from mutagen.mp3 import MP3
-from mutagen.oggvorbis import OggVorbis
-from mutagen.flac import FLAC
-from mutagen.wave import WAVE
-from mutagen import File as MutagenFile
+IMPORTS_FINISHED = time.perf_counter()
+
+
+class StartupProfile:
+    """How long each import and init phase took, shown with --startup-profile
+    
+    Phases are recorded whether or not the profile is shown, so the ones
+    that ran before the command line was parsed can still be reported.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.phases = [("core imports (stdlib)", STARTUP_STARTED, IMPORTS_FINISHED)]
+        
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started, time.perf_counter())
+            
+    def mark(self, name):
+        """Record a point in time, e.g. the first frame"""
+        now = time.perf_counter()
+        self.record(name, now, now)
+        
+    def record(self, name, started, finished):
+        with self.lock:
+            self.phases.append((name, started, finished))
+            if self.enabled:
+                self.print_phase(name, started, finished)
+                
+    def enable(self):
+        """Print the phases so far, and every later one as it finishes"""
+        with self.lock:
+            self.enabled = True
+            print("   at (ms)  took (ms)  phase")
+            for phase in self.phases:
+                self.print_phase(*phase)
+                
+    def print_phase(self, name, started, finished):
+        at = (finished - STARTUP_STARTED) * 1000
+        print(f"{at:10.1f} {(finished - started) * 1000:10.1f}  {name}", flush=True)
+
+
+STARTUP = StartupProfile()
+
+
+def lazy_import(name):
+    """Import a module on first use, timing the import for the startup profile"""
+    # import_module also waits for an import still running on another thread
+    if name in sys.modules:
+        return importlib.import_module(name)
+    with STARTUP.phase(f"import {name}"):
+        return importlib.import_module(name)
+
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access"""
+    
+    def __init__(self, module_name):
+        self.module_name = module_name
+        
+    def __getattr__(self, attr):
+        return getattr(lazy_import(self.module_name), attr)
+
+
+# Heavy modules load when first used, not before the window appears, and
+# not at all when a second launch only hands its files to the running player
+tk = LazyModule('tkinter')
+ttk = LazyModule('tkinter.ttk')
+tkfont = LazyModule('tkinter.font')
+filedialog = LazyModule('tkinter.filedialog')
+messagebox = LazyModule('tkinter.messagebox')
+simpledialog = LazyModule('tkinter.simpledialog')
+pygame = LazyModule('pygame')
+Image = LazyModule('PIL.Image')
+ImageDraw = LazyModule('PIL.ImageDraw')
+pystray = LazyModule('pystray')
+http_client = LazyModule('http.client')
+traceback = LazyModule('traceback')
+
+# NumPy is optional: without it the waveform shows progress only
+np = LazyModule('numpy') if importlib.util.find_spec('numpy') else None
+
+# Mutagen parser per extension, only the needed format module is imported
+MUTAGEN_PARSERS = {
+    '.mp3': ('mutagen.mp3', 'MP3'),
+    '.ogg': ('mutagen.oggvorbis', 'OggVorbis'),
+    '.flac': ('mutagen.flac', 'FLAC'),
+    '.wav': ('mutagen.wave', 'WAVE'),
+}
+
+# Tag keys for title/artist/album: Vorbis comments, ID3 frames, MP4 atoms
+TEXT_TAG_KEYS = {
+    'title': ('title', 'TIT2', '\xa9nam'),
+    'artist': ('artist', 'TPE1', '\xa9ART'),
+    'album': ('album', 'TALB', '\xa9alb'),
+}
+
+# Background metadata probing
+PROBE_WORKERS = min(8, (os.cpu_count() or 2) + 2)
+PROBE_CHUNK_SIZE = 64  # files handled per worker task
+PROBE_BATCH_INTERVAL = 100  # ms between UI updates with probe results
+PROBE_BATCH_BUDGET = 0.03  # max seconds spent applying results per UI update
+PLACEHOLDER_TIME = "--:--"
+
+# Settings and caches live here
+APP_DIR = os.path.join(os.path.expanduser("~"), ".audioplayer")
+
+# Persistent metadata cache
+METADATA_CACHE_FILE = "metadata.sqlite3"
+METADATA_CACHE_VERSION = 4  # bump when the stored columns change
+METADATA_CACHE_MAX_ENTRIES = 200000
+METADATA_CACHE_FLUSH_SIZE = 256  # buffered writes before a commit
+
+# Play history and statistics
+PLAY_STATS_FILE = "history.sqlite3"
+PLAY_STATS_FLUSH_MS = 5000  # buffered listens are written this long after the first
+PLAYED_FRACTION = 0.5  # a listen counts as a play past this share of the track...
+PLAYED_SECONDS = 240  # ...or this many seconds, otherwise as a skip
+SMART_PLAYLIST_SIZE = 100  # tracks in "most played" and "recently played"
+SMART_PLAYLISTS = (
+    ("Add most played", 'most_played'),
+    ("Add recently played", 'recently_played'),
+    ("Keep only never played", 'never_played'),
+)
+
+# Duplicate detection
+DUPLICATE_SYNC_LIMIT = 1000  # adds up to this many files are checked for duplicates at once
+DUPLICATE_PARTIAL_BYTES = 64 << 10  # hashed from the start and from the end of a file
+DUPLICATE_DURATION_STEP = 0.1  # seconds; audio hashes are compared within equal durations
+HASH_CHUNK = 1 << 20
+
+# Folder import
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.ogg', '.flac')
+FOLDER_INDEX_FILE = "folders.json"
+SCAN_CHUNK_SIZE = 256  # files handed to the UI at a time
+
+# Playlist files and session restore
+PLAYLIST_EXTENSIONS = ('.m3u', '.m3u8', '.pls')
+PLAYLIST_FILETYPES = [
+    ("M3U playlists", "*.m3u8 *.m3u"),
+    ("PLS playlists", "*.pls"),
+    ("All files", "*.*")
+]
+SESSION_FILE = "session.dat"
+SESSION_VERSION = 1
+SESSION_SAVE_DELAY_MS = 5000  # autosave this long after the last change
+
+# Playlist search
+SEARCH_WORD = re.compile(r'\w+')
+SEARCH_SHORT_PREFIX = 2  # prefixes up to this length get their own postings
+SEARCH_MERGE_SIZE = 1024  # new words collected before sorting them into the vocabulary
+
+# Playback scheduling
+FRAME_MS = 16  # fastest progress tick, about one display frame at 60 Hz
+MAX_TICK_MS = 1000  # slowest progress tick while visible
+END_CHECK_MAX_MS = 1000  # longest wait between track-end checks
+END_RECHECK_MS = 20  # retry delay when a track runs past its expected end
+
+# Gapless playback and crossfade
+PREFETCH_BYTES = 1 << 20  # read ahead of the next track to warm the OS cache
+CROSSFADE_CHOICES = (0, 2, 4, 6, 8, 10)  # seconds, 0 = off
+FADE_STEP_MS = 50  # volume update interval while fading
+
+# Play order
+REPEAT_MODES = (("Off", 'off'), ("All", 'all'), ("One", 'one'))
+HISTORY_LENGTH = 1000  # tracks Previous can go back through
+
+# Seek indexes
+SEEK_STEP = 5  # seconds for rewind / forward
+SEEK_INDEX_DIR = "seekindex"
+SEEK_INDEX_MEMORY = 8  # indexes kept in memory
+SEEK_INDEX_MAGIC = b'MPIX'
+
+# Network streams and remote files
+STREAM_SCHEMES = ('http://', 'https://')
+STREAM_READAHEAD = 4 << 20  # bytes buffered ahead of the decoder
+STREAM_KEEP_BEHIND = 64 << 10  # bytes kept behind it for the decoder's short rewinds
+STREAM_PREFILL = 64 << 10  # bytes buffered before a stream starts playing, about 4 s of radio
+STREAM_PROBE_READAHEAD = 64 << 10  # smaller buffer while reading tags
+STREAM_TAIL_BYTES = 64 << 10  # end of a remote file, where decoders look for tags, fetched up front
+STREAM_CHUNK = 64 << 10  # largest socket read
+STREAM_SKIP_AHEAD = 1 << 20  # shorter jumps ahead wait for the fetch instead of a new request
+STREAM_TIMEOUT = 10  # seconds without data before a connection is given up
+STREAM_REDIRECTS = 5
+STREAM_IDLE_CONNECTIONS = 2  # kept open per host for the next request
+STREAM_VIRTUAL_LENGTH = 1 << 40  # size reported for live streams, whose end is never read
+STREAM_HEADERS = {'User-Agent': 'audio-player', 'Icy-MetaData': '1'}
+STREAM_CONTENT_TYPES = {
+    'audio/mpeg': 'mp3',
+    'audio/mp3': 'mp3',
+    'audio/ogg': 'ogg',
+    'application/ogg': 'ogg',
+    'audio/vorbis': 'ogg',
+    'audio/flac': 'flac',
+    'audio/x-flac': 'flac',
+    'audio/wav': 'wav',
+    'audio/wave': 'wav',
+    'audio/x-wav': 'wav',
+}
+ICY_TITLE = re.compile(rb"StreamTitle='(.*?)';", re.DOTALL)
+
+# Waveform overview
+PEAK_DIR = "peaks"
+PEAK_MAGIC = b'PEAK'
+PEAK_BLOCK = 256  # samples per level-0 peak
+PEAK_FACTOR = 4  # blocks merged per level
+PEAK_MIN_COUNT = 512  # stop adding levels below this many peaks
+PEAK_CHUNK_BLOCKS = 4096  # level-0 peaks computed between progress updates
+PCM_DECODE_MAX_SECONDS = 30 * 60  # longer tracks aren't decoded whole, about 300 MB of PCM
+WAVEFORM_WIDTH = 400
+WAVEFORM_HEIGHT = 48
+
+# Spectrum visualizer
+SPECTRUM_BARS = 32
+SPECTRUM_FFT = 2048  # frames per analysis window
+SPECTRUM_HEIGHT = 40
+SPECTRUM_FRAME_MS = 33  # about 30 frames per second at most
+SPECTRUM_BUDGET = 4  # a frame waits at least this many times its own cost
+SPECTRUM_MIN_HZ = 40
+SPECTRUM_MAX_HZ = 16000
+SPECTRUM_FLOOR_DB = -60  # level shown as an empty bar
+SPECTRUM_FALL = 0.08  # of the full height a bar may drop per frame
+
+# Cover art
+THUMBNAIL_DIR = "thumbnails"
+THUMBNAIL_SIZE = 64  # px, covers are scaled to fit a square this big
+THUMBNAIL_MEMORY_BYTES = 4 << 20  # PNG bytes kept in the in-memory LRU
+THUMBNAIL_DISK_BYTES = 64 << 20  # on-disk cache is pruned past this
+FRONT_COVER = 3  # ID3/FLAC picture type of the front cover
+
+# Equalizer, on the optional DSP playback path
+EQ_BANDS = (31, 62, 125, 250, 500, 1000, 2000, 4000, 8000, 16000)  # Hz, band centers
+EQ_Q = 1.41  # about one octave per band
+EQ_MAX_DB = 12
+EQ_FIR_LENGTH = 4096  # taps of the equalizer's impulse response
+DSP_BLOCK = 4096  # frames processed and queued at a time
+DSP_BUFFERS = 3  # output Sounds: playing, queued and being filled
+DSP_POLL = 0.02  # seconds between checks for a free queue slot
+LIMITER_THRESHOLD = 0.98  # of full scale
+LIMITER_WINDOW = 64  # frames per limiter gain step, divides DSP_BLOCK
+LIMITER_RELEASE = 0.1  # seconds for the gain to recover by 1/e
+
+# Loudness normalization (ReplayGain 2.0 / EBU R128)
+RG_REFERENCE_LUFS = -18.0
+LOUDNESS_SUBBLOCK = 0.1  # seconds; gating blocks are 4 of these (400 ms, 75 % overlap)
+LOUDNESS_CHUNK = 600  # sub-blocks transformed at once
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+ANALYSIS_SAMPLE_RATE = 48000
+GAIN_MODES = (("Off", 'off'), ("Track gain", 'track'), ("Album gain", 'album'))
+
+# MPEG audio frame header tables, indexed by version bits then layer bits
+MPEG_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+MPEG_BITRATES = {
+    (3, 3): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (3, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (3, 1): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 3): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 1): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+# Instrumentation
+PERF_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+LAG_PROBE_MS = 100  # lag monitor heartbeat while instrumentation is on
+LATE_MS = 50  # a callback or tick this late counts as late
+DEBUG_REFRESH_MS = 1000
+
+# Single instance
+INSTANCE_LOCK_FILE = "instance.lock"
+INSTANCE_SOCKET_FILE = "instance.sock"  # Unix domain socket
+INSTANCE_PORT_FILE = "instance.port"  # loopback TCP port where Unix sockets are missing
+INSTANCE_TIMEOUT = 2.0  # seconds a later launch waits for the running player
+
+# Local control API
+CONTROL_SOCKET_FILE = "control.sock"
+CONTROL_PORT_FILE = "control.port"
+CONTROL_BATCH_MS = 20  # commands arriving within this window run as one batch
+CONTROL_LINE_LIMIT = 16 << 20  # longest request line, e.g. a large enqueue
+CONTROL_PAGE_SIZE = 100  # default playlist page
+CONTROL_MAX_PAGE = 1000
+CONTROL_MAX_BUFFER = 1 << 20  # events are dropped for clients that read slower
+VOLUME_STEP = 0.1  # tray and control API volume up / down
+
+
+def get_app_dir():
+    """Return the settings/cache directory, creating it if needed"""
+    os.makedirs(APP_DIR, exist_ok=True)
+    return APP_DIR
+
+
+def probe_audio_info(file_path, stream=None):
+    """Parse an audio file, or an HttpStream of it, with mutagen and return its stream info"""
+    # Try to detect file type and use the matching parser, else generic mutagen
+    ext = '.' + stream.namehint if stream is not None else os.path.splitext(file_path)[1].lower()
+    module_name, parser_name = MUTAGEN_PARSERS.get(ext, ('mutagen', 'File'))
+    audio = getattr(lazy_import(module_name), parser_name)(stream or file_path)
+    
+    info = getattr(audio, 'info', None)
+    return {
+        'duration': getattr(info, 'length', 0) or 0,
+        'sample_rate': getattr(info, 'sample_rate', 0) or 0,
+        'channels': getattr(info, 'channels', 0) or 0,
+        'bitrate': getattr(info, 'bitrate', 0) or 0,
+        **read_text_tags(audio),
+        'replaygain': read_replaygain_tags(audio),
+    }
+
+
+def read_text_tags(audio):
+    """Return title, artist and album from a mutagen file's tags, None if missing"""
+    values = dict.fromkeys(TEXT_TAG_KEYS)
+    tags = getattr(audio, 'tags', None)
+    if not tags:
+        return values
+        
+    for name, keys in TEXT_TAG_KEYS.items():
+        for key in keys:
+            try:
+                value = tags[key]
+            except (KeyError, ValueError, TypeError):
+                continue
+            text = value.text[0] if hasattr(value, 'text') else value
+            if isinstance(text, list):
+                text = text[0] if text else ''
+            text = str(text).strip()
+            if text:
+                values[name] = text
+                break
+    return values
+
+
+def read_cover_art(file_path):
+    """Return the embedded cover image of an audio file as bytes, or None
+    
+    Looks at FLAC pictures, ID3 APIC frames and Vorbis
+    METADATA_BLOCK_PICTURE comments, preferring the front cover.
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    module_name, parser_name = MUTAGEN_PARSERS.get(ext, ('mutagen', 'File'))
+    audio = getattr(lazy_import(module_name), parser_name)(file_path)
+    
+    pictures = list(getattr(audio, 'pictures', None) or [])
+    tags = getattr(audio, 'tags', None)
+    if tags is not None:
+        if hasattr(tags, 'getall'):
+            pictures.extend(tags.getall('APIC'))
+        else:
+            for value in tags.get('metadata_block_picture', []):
+                try:
+                    pictures.append(lazy_import('mutagen.flac').Picture(base64.b64decode(value)))
+                except Exception:
+                    continue  # a broken picture block doesn't count
+                    
+    if not pictures:
+        return None
+    pictures.sort(key=lambda picture: picture.type != FRONT_COVER)
+    return pictures[0].data
+
+
+def make_thumbnail(data, size=THUMBNAIL_SIZE):
+    """Decode an image and scale it to fit size x size, returned as PNG bytes"""
+    image = Image.open(io.BytesIO(data))
+    # JPEGs decode straight to a fraction of their size, the big win for large covers
+    image.draft('RGB', (size, size))
+    image = image.convert('RGB')
+    image.thumbnail((size, size), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, 'PNG')
+    return output.getvalue()
+
+
+def read_replaygain_tags(audio):
+    """Return ReplayGain values found in a mutagen file's tags, or None"""
+    tags = getattr(audio, 'tags', None)
+    if not tags:
+        return None
+        
+    values = {}
+    for key, value in tags.items():
+        # Vorbis comments use plain keys, ID3 uses TXXX:<name> frames
+        name = key.split(':', 1)[-1].lower()
+        if not name.startswith('replaygain_'):
+            continue
+        text = value.text[0] if hasattr(value, 'text') else value
+        if isinstance(text, list):
+            text = text[0] if text else ''
+        try:
+            values[name[len('replaygain_'):]] = float(str(text).lower().replace('db', '').strip())
+        except ValueError:
+            continue
+            
+    if 'track_gain' not in values:
+        return None
+    return {
+        'track_gain': values['track_gain'],
+        'track_peak': values.get('track_peak'),
+        'album_gain': values.get('album_gain'),
+        'album_peak': values.get('album_peak'),
+        'loudness': None,
+    }
+
+
+class MetadataCache:
+    """SQLite cache of stream info keyed on (path, size, mtime)
+    
+    Lookups are safe from any thread. Writes and LRU touches are buffered
+    and committed in batches; the least recently used rows are evicted
+    once the cache grows past max_entries.
+    """
+    
+    COLUMNS = ('duration', 'sample_rate', 'channels', 'bitrate', 'title', 'artist', 'album')
+    LOUDNESS_COLUMNS = ('track_gain', 'track_peak', 'album_gain', 'album_peak', 'loudness')
+    FINGERPRINT_COLUMNS = ('partial', 'payload')
+    
+    def __init__(self, db_path, max_entries=METADATA_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.pending = {}  # path -> (size, mtime_ns, info) not yet committed
+        self.touched = set()  # paths hit since the last commit
+        
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        
+        # It's only a cache: rebuild it when the layout changes
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version != METADATA_CACHE_VERSION:
+            self.db.execute("DROP TABLE IF EXISTS metadata")
+            self.db.execute("DROP TABLE IF EXISTS loudness")
+            self.db.execute("DROP TABLE IF EXISTS fingerprints")
+            self.db.execute(f"PRAGMA user_version={METADATA_CACHE_VERSION}")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+            "duration REAL, sample_rate INTEGER, channels INTEGER, "
+            "bitrate INTEGER, title TEXT, artist TEXT, album TEXT, last_used INTEGER)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS metadata_last_used ON metadata(last_used)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS loudness ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+            "track_gain REAL, track_peak REAL, album_gain REAL, "
+            "album_peak REAL, loudness REAL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+            "partial TEXT, payload TEXT)"
+        )
+        self.db.commit()
+        
+    def lookup(self, file_path, size, mtime_ns):
+        """Return cached info for an unchanged file, or None"""
+        with self.lock:
+            entry = self.pending.get(file_path)
+            if entry is not None:
+                if entry[0] == size and entry[1] == mtime_ns:
+                    return entry[2]
+                return None
+                
+            row = self.db.execute(
+                "SELECT duration, sample_rate, channels, bitrate, title, artist, album "
+                "FROM metadata "
+                "WHERE path=? AND size=? AND mtime_ns=?",
+                (file_path, size, mtime_ns)
+            ).fetchone()
+            if row is None:
+                return None
+                
+            self.touched.add(file_path)
+            if len(self.touched) >= METADATA_CACHE_FLUSH_SIZE:
+                self._commit()
+            return dict(zip(self.COLUMNS, row))
+            
+    def store(self, file_path, size, mtime_ns, info):
+        """Remember info for a file; committed with the next batch"""
+        with self.lock:
+            self.pending[file_path] = (size, mtime_ns, info)
+            if len(self.pending) >= METADATA_CACHE_FLUSH_SIZE:
+                self._commit()
+                
+    def lookup_loudness(self, file_path, size, mtime_ns):
+        """Return cached ReplayGain values for an unchanged file, or None"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT track_gain, track_peak, album_gain, album_peak, loudness "
+                "FROM loudness WHERE path=? AND size=? AND mtime_ns=?",
+                (file_path, size, mtime_ns)
+            ).fetchone()
+        return None if row is None else dict(zip(self.LOUDNESS_COLUMNS, row))
+        
+    def store_loudness(self, file_path, size, mtime_ns, values):
+        """Remember ReplayGain values for a file"""
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO loudness VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (file_path, size, mtime_ns) + tuple(values[c] for c in self.LOUDNESS_COLUMNS)
+            )
+            
+    def lookup_fingerprint(self, file_path, size, mtime_ns, column):
+        """Return the cached 'partial' or 'payload' hash of an unchanged file, or None"""
+        assert column in self.FINGERPRINT_COLUMNS
+        with self.lock:
+            row = self.db.execute(
+                f"SELECT {column} FROM fingerprints WHERE path=? AND size=? AND mtime_ns=?",
+                (file_path, size, mtime_ns)
+            ).fetchone()
+        return None if row is None else row[0]
+        
+    def store_fingerprints(self, column, rows):
+        """Remember (path, size, mtime_ns, hash) rows for a 'partial' or 'payload' hash"""
+        assert column in self.FINGERPRINT_COLUMNS
+        with self.lock, self.db:
+            # A changed file loses the hashes of its old contents
+            self.db.executemany(
+                "DELETE FROM fingerprints WHERE path=? AND (size!=? OR mtime_ns!=?)",
+                [row[:3] for row in rows]
+            )
+            self.db.executemany(
+                "INSERT OR IGNORE INTO fingerprints (path, size, mtime_ns) VALUES (?, ?, ?)",
+                [row[:3] for row in rows]
+            )
+            self.db.executemany(
+                f"UPDATE fingerprints SET {column}=? WHERE path=?",
+                [(digest, path) for path, _, _, digest in rows]
+            )
+            
+    def flush(self):
+        """Commit buffered writes"""
+        with self.lock:
+            self._commit()
+            
+    def close(self):
+        """Commit buffered writes and close the database"""
+        with self.lock:
+            self._commit()
+            self.db.close()
+            
+    def _commit(self):
+        if not self.pending and not self.touched:
+            return
+        now = int(time.time())
+        
+        with self.db:
+            if self.pending:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (path, size, mtime_ns) + tuple(info[c] for c in self.COLUMNS) + (now,)
+                        for path, (size, mtime_ns, info) in self.pending.items()
+                    ]
+                )
+            if self.touched:
+                self.db.executemany(
+                    "UPDATE metadata SET last_used=? WHERE path=?",
+                    [(now, path) for path in self.touched]
+                )
+                
+            # Evict least recently used rows past the size cap
+            if self.pending:
+                count = self.db.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+                excess = count - self.max_entries
+                if excess > 0:
+                    self.db.execute(
+                        "DELETE FROM metadata WHERE path IN "
+                        "(SELECT path FROM metadata ORDER BY last_used LIMIT ?)",
+                        (excess,)
+                    )
+                    self.db.execute(
+                        "DELETE FROM loudness WHERE path NOT IN (SELECT path FROM metadata)"
+                    )
+                    self.db.execute(
+                        "DELETE FROM fingerprints WHERE path NOT IN (SELECT path FROM metadata)"
+                    )
+                    
+        self.pending.clear()
+        self.touched.clear()
+
+
+class PlayStats:
+    """SQLite store of play counts, skip counts, last play and listened time
+    
+    Listens are recorded from the timer thread into an in-memory buffer,
+    merged per path, and written in one transaction by flush(), which is
+    meant to run on a worker thread. Queries flush first, so they always
+    include the latest listens. db_lock serializes every use of the
+    connection; lock only guards the buffer, so recording never waits for
+    the disk.
+    """
+    
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        self.pending = {}  # path -> [plays, skips, last played or None, listened seconds]
+        
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS plays ("
+            "path TEXT PRIMARY KEY, play_count INTEGER, skip_count INTEGER, "
+            "last_played INTEGER, listened REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS plays_play_count ON plays(play_count)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS plays_last_played ON plays(last_played)")
+        self.db.commit()
+        
+    def record(self, file_path, listened, played):
+        """Buffer one listen; return True if the buffer was empty before"""
+        with self.lock:
+            first = not self.pending
+            entry = self.pending.setdefault(file_path, [0, 0, None, 0.0])
+            if played:
+                entry[0] += 1
+                entry[2] = int(time.time())
+            else:
+                entry[1] += 1
+            entry[3] += listened
+        return first
+        
+    def flush(self):
+        """Write buffered listens in one transaction"""
+        with self.db_lock:
+            self._write()
+            
+    def most_played(self, limit):
+        """Paths played most often, most played first"""
+        with self.db_lock:
+            self._write()
+            rows = self.db.execute(
+                "SELECT path FROM plays WHERE play_count>0 "
+                "ORDER BY play_count DESC, last_played DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [row[0] for row in rows]
+        
+    def recently_played(self, limit):
+        """Paths played last, most recent first"""
+        with self.db_lock:
+            self._write()
+            rows = self.db.execute(
+                "SELECT path FROM plays WHERE last_played IS NOT NULL "
+                "ORDER BY last_played DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [row[0] for row in rows]
+        
+    def played_paths(self):
+        """Set of every path played at least once"""
+        with self.db_lock:
+            self._write()
+            rows = self.db.execute("SELECT path FROM plays WHERE play_count>0").fetchall()
+        return {row[0] for row in rows}
+        
+    def close(self):
+        """Write buffered listens and close the database"""
+        with self.db_lock:
+            self._write()
+            self.db.close()
+            
+    def _write(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        started = time.perf_counter()
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO plays VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET "
+                "play_count=play_count+excluded.play_count, "
+                "skip_count=skip_count+excluded.skip_count, "
+                "last_played=COALESCE(excluded.last_played, last_played), "
+                "listened=listened+excluded.listened",
+                [(path,) + tuple(entry) for path, entry in pending.items()]
+            )
+        PERF.record('play stats flush', started)
+
+
+class ThumbnailCache:
+    """Cover thumbnails as PNG bytes: an LRU in memory over files on disk
+    
+    Entries are keyed by file_cache_key(), so an edited file gets a new
+    thumbnail. An empty entry records that a file has no cover art, so it
+    isn't parsed again. The disk cache drops its least recently used files
+    once it grows past max_disk_bytes. Safe to use from any thread.
+    """
+    
+    def __init__(self, cache_dir, max_bytes=THUMBNAIL_MEMORY_BYTES,
+                 max_disk_bytes=THUMBNAIL_DISK_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()  # key -> PNG bytes, most recent last
+        self.size = 0
+        self.disk_size = None  # measured on the first write
+        self.lock = threading.Lock()
+        
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".png")
+        
+    def get(self, key, load=True):
+        """Return the thumbnail (b'' for no art), or None if it isn't cached
+        
+        Without load only the memory cache is consulted.
+        """
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                return data
+        if not load:
+            return None
+            
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # mark as recently used for pruning
+        except OSError:
+            return None
+        self.remember(key, data)
+        return data
+        
+    def put(self, key, data):
+        """Store a thumbnail in memory and on disk"""
+        self.remember(key, data)
+        path = self.path(key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(path + ".tmp", 'wb') as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Error saving thumbnail: {e}")
+            return
+        with self.lock:
+            if self.disk_size is None:
+                self.disk_size = sum(size for _, _, size in self.disk_entries())
+            else:
+                self.disk_size += len(data)
+            if self.disk_size > self.max_disk_bytes:
+                self.prune()
+                
+    def remember(self, key, data):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                
+    def disk_entries(self):
+        """(mtime, path, size) of every cached file"""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".png"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+        
+    def prune(self):
+        """Delete the least recently used files down to 3/4 of the disk budget"""
+        entries = sorted(self.disk_entries())
+        self.disk_size = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self.disk_size <= self.max_disk_bytes * 3 // 4:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.disk_size -= size
+
+
+def list_audio_dir(dir_path):
+    """Return sorted (audio file names, subdirectory names) of one directory"""
+    files = []
+    subdirs = []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    subdirs.append(entry.name)
+                elif os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS:
+                    files.append(entry.name)
+            except OSError:
+                continue
+    files.sort()
+    subdirs.sort()
+    return files, subdirs
+
+
+class FolderIndex:
+    """Saved snapshot of scanned folder trees for incremental rescans
+    
+    For every directory the snapshot keeps its mtime and the audio files
+    and subdirectories it contained. A directory whose mtime hasn't changed
+    is not listed again, only stat'ed on the way down to its children.
+    """
+    
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.lock = threading.Lock()
+        self.roots = None  # root folder -> {dir path: [mtime_ns, files, subdirs]}
+        
+    def load(self):
+        """Read the snapshot on first use, with the lock held"""
+        if self.roots is not None:
+            return
+        self.roots = {}
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                self.roots = json.load(f)
+        except (OSError, ValueError):
+            pass
+            
+    def folders(self):
+        with self.lock:
+            self.load()
+            return list(self.roots)
+            
+    def scan(self, root, only_new=False, removed=None):
+        """Yield audio files under root as they are found
+        
+        With only_new, files already seen in the snapshot are skipped.
+        Paths that disappeared since the last scan are appended to removed.
+        """
+        root = os.path.abspath(root)
+        with self.lock:
+            self.load()
+            old = self.roots.get(root, {})
+        new = {}
+        visited = set()  # (device, inode) of directories, guards symlink loops
+        stack = [root]
+        
+        while stack:
+            dir_path = stack.pop()
+            try:
+                stat = os.stat(dir_path)
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino) in visited:
+                continue
+            visited.add((stat.st_dev, stat.st_ino))
+            
+            entry = old.get(dir_path)
+            if entry is not None and entry[0] == stat.st_mtime_ns:
+                files, subdirs = entry[1], entry[2]
+                new_files = () if only_new else files
+            else:
+                try:
+                    files, subdirs = list_audio_dir(dir_path)
+                except OSError:
+                    continue
+                known = set(entry[1]) if entry is not None else set()
+                new_files = [name for name in files if name not in known] if only_new else files
+                if removed is not None and known:
+                    removed.extend(
+                        os.path.join(dir_path, name) for name in known.difference(files)
+                    )
+                    
+            new[dir_path] = [stat.st_mtime_ns, files, subdirs]
+            for name in new_files:
+                yield os.path.join(dir_path, name)
+            stack.extend(os.path.join(dir_path, name) for name in reversed(subdirs))
+            
+        # Directories that vanished take their files with them
+        if removed is not None:
+            for dir_path in old.keys() - new.keys():
+                removed.extend(os.path.join(dir_path, name) for name in old[dir_path][1])
+                
+        with self.lock:
+            self.roots[root] = new
+            
+    def save(self):
+        """Write the snapshot atomically"""
+        with self.lock:
+            data = json.dumps(self.roots, separators=(',', ':'))
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, self.index_path)
+
+
+def is_stream_url(path):
+    """True for playlist entries played over HTTP(S) rather than from disk"""
+    return path.lower().startswith(STREAM_SCHEMES)
+
+
+def resolve_playlist_entry(location, base_dir):
+    """Absolute path or HTTP(S) URL of a playlist entry, or None for other URLs"""
+    if location.startswith('file://'):
+        from urllib.request import url2pathname  # pulls in http and email, so not at startup
+        return url2pathname(urllib.parse.urlparse(location).path)
+    if is_stream_url(location):
+        return location
+    if '://' in location:
+        return None
+    return os.path.normpath(os.path.join(base_dir, location))
+
+
+def read_playlist_file(playlist_path):
+    """Yield (path, duration or None) for each entry of an M3U, M3U8 or PLS file"""
+    base_dir = os.path.dirname(os.path.abspath(playlist_path))
+    is_pls = playlist_path.lower().endswith('.pls')
+    with open(playlist_path, encoding='utf-8-sig', errors='replace') as f:
+        if is_pls:
+            yield from read_pls(f, base_dir)
+        else:
+            yield from read_m3u(f, base_dir)
+
+
+def parse_length(text):
+    """Seconds from an #EXTINF or LengthN value, None if unknown"""
+    try:
+        seconds = float(text.split()[0])
+    except (ValueError, IndexError):
+        return None
+    return seconds if seconds >= 0 else None
+
+
+def read_m3u(lines, base_dir):
+    duration = None
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#'):
+            # #EXTINF:<seconds> [attributes],<title> describes the next entry
+            if line.startswith('#EXTINF:'):
+                duration = parse_length(line[8:].split(',', 1)[0])
+            continue
+        file_path = resolve_playlist_entry(line, base_dir)
+        if file_path is not None:
+            yield file_path, duration
+        duration = None
+
+
+def read_pls(lines, base_dir):
+    # Entries are numbered and may come in any order
+    files = {}
+    lengths = {}
+    for line in lines:
+        key, sep, value = line.strip().partition('=')
+        key = key.lower()
+        if not sep:
+            continue
+        if key.startswith('file') and key[4:].isdigit():
+            files[int(key[4:])] = value
+        elif key.startswith('length') and key[6:].isdigit():
+            lengths[int(key[6:])] = parse_length(value)
+            
+    for number in sorted(files):
+        file_path = resolve_playlist_entry(files[number], base_dir)
+        if file_path is not None:
+            yield file_path, lengths.get(number)
+
+
+def write_playlist_file(playlist_path, entries):
+    """Write (path, duration or None) entries as PLS, or as extended M3U otherwise"""
+    with open(playlist_path, 'w', encoding='utf-8') as f:
+        if playlist_path.lower().endswith('.pls'):
+            f.write("[playlist]\n")
+            count = 0
+            for count, (file_path, duration) in enumerate(entries, 1):
+                title = os.path.splitext(os.path.basename(file_path))[0]
+                length = round(duration) if duration is not None else -1
+                f.write(f"File{count}={file_path}\nTitle{count}={title}\nLength{count}={length}\n")
+            f.write(f"NumberOfEntries={count}\nVersion=2\n")
+        else:
+            f.write("#EXTM3U\n")
+            for file_path, duration in entries:
+                title = os.path.splitext(os.path.basename(file_path))[0]
+                length = round(duration) if duration is not None else -1
+                f.write(f"#EXTINF:{length},{title}\n{file_path}\n")
+
+
+def write_session(session_path, header, entries):
+    """Save the playlist compactly: a JSON header line, then front-coded paths
+    
+    Each entry is "<chars shared with the previous path>\0<rest>\0<duration>\0",
+    so a library in a few folders costs little more than its file names.
+    """
+    parts = [json.dumps(header), '\n']
+    previous = ''
+    for file_path, duration in entries:
+        shared = 0
+        limit = min(len(previous), len(file_path))
+        while shared < limit and previous[shared] == file_path[shared]:
+            shared += 1
+        parts.append(f"{shared}\0{file_path[shared:]}\0{'' if duration is None else duration}\0")
+        previous = file_path
+        
+    tmp_path = session_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8', errors='surrogateescape', newline='') as f:
+        f.write(''.join(parts))
+    os.replace(tmp_path, session_path)
+
+
+def read_session(session_path):
+    """Return (header, paths, durations) saved by write_session"""
+    with open(session_path, encoding='utf-8', errors='surrogateescape', newline='') as f:
+        header_line, _, body = f.read().partition('\n')
+    header = json.loads(header_line)
+    if header.get('version') != SESSION_VERSION:
+        raise ValueError("unknown session version")
+        
+    fields = body.split('\0')
+    paths = []
+    durations = []
+    previous = ''
+    for i in range(0, len(fields) - 2, 3):
+        previous = previous[:int(fields[i])] + fields[i + 1]
+        paths.append(previous)
+        durations.append(float(fields[i + 2]) if fields[i + 2] else None)
+    return header, paths, durations
+
+
+def file_cache_key(file_path):
+    """Stable cache key for the current contents of a file"""
+    stat = os.stat(file_path)
+    key = f"{file_path}\0{stat.st_size}\0{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+
+
+def partial_hash(file_path, size):
+    """Hash of the first and last DUPLICATE_PARTIAL_BYTES of a file"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(DUPLICATE_PARTIAL_BYTES))
+        if size > DUPLICATE_PARTIAL_BYTES:
+            f.seek(max(DUPLICATE_PARTIAL_BYTES, size - DUPLICATE_PARTIAL_BYTES))
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def audio_payload_spans(f, extension, size):
+    """(offset, length) of the audio data in an open file, leaving out the tags"""
+    if extension == '.flac':
+        # Metadata blocks follow the marker, the last one is flagged
+        if f.read(4) != b'fLaC':
+            return [(0, size)]
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                return []
+            f.seek(int.from_bytes(header[1:4], 'big'), io.SEEK_CUR)
+            if header[0] & 0x80:
+                return [(f.tell(), size - f.tell())]
+                
+    if extension == '.wav':
+        if f.read(12)[8:12] != b'WAVE':
+            return [(0, size)]
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return []
+            length = struct.unpack('<I', header[4:])[0]
+            if header[:4] == b'data':
+                return [(f.tell(), min(length, size - f.tell()))]
+            f.seek(length + (length & 1), io.SEEK_CUR)
+            
+    if extension == '.ogg':
+        # Header packets (comments included) sit on pages with granule position 0
+        spans = []
+        while True:
+            header = f.read(27)
+            if len(header) < 27 or header[:4] != b'OggS':
+                return spans
+            granule = struct.unpack('<q', header[6:14])[0]
+            length = sum(f.read(header[26]))
+            if granule != 0:
+                spans.append((f.tell(), length))
+            f.seek(length, io.SEEK_CUR)
+            
+    if extension == '.mp3':
+        start, end = 0, size
+        header = f.read(10)
+        if header[:3] == b'ID3' and len(header) == 10:
+            tag_size = 0
+            for byte in header[6:10]:
+                tag_size = (tag_size << 7) | (byte & 0x7F)
+            start = 10 + tag_size + (10 if header[5] & 0x10 else 0)
+        if end - start >= 128:
+            f.seek(end - 128)
+            if f.read(3) == b'TAG':
+                end -= 128
+        if end - start >= 32:
+            f.seek(end - 32)
+            footer = f.read(32)
+            if footer[:8] == b'APETAGEX':
+                length, flags = struct.unpack('<I4xI', footer[12:24])
+                end -= length + (32 if flags & 0x80000000 else 0)
+        return [(start, max(0, end - start))]
+        
+    return [(0, size)]
+
+
+def audio_payload_hash(file_path):
+    """Process pool task: hash of the audio data without tags, so retagged copies match"""
+    try:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            spans = audio_payload_spans(f, os.path.splitext(file_path)[1].lower(), size)
+            for offset, length in spans:
+                f.seek(offset)
+                while length > 0:
+                    chunk = f.read(min(length, HASH_CHUNK))
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    length -= len(chunk)
+        return file_path, digest.hexdigest()
+    except (OSError, struct.error) as e:
+        print(f"Error hashing audio: {e}")
+        return file_path, None
+
+
+def parse_mpeg_header(header):
+    """Return (frame length, samples per frame, sample rate) or None"""
+    if header >> 21 != 0x7FF:
+        return None
+    version = (header >> 19) & 3
+    layer = (header >> 17) & 3
+    bitrate_index = (header >> 12) & 15
+    rate_index = (header >> 10) & 3
+    if version == 1 or layer == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+        
+    sample_rate = MPEG_SAMPLE_RATES[version][rate_index]
+    bitrate = MPEG_BITRATES[(3 if version == 3 else 2, layer)][bitrate_index] * 1000
+    padding = (header >> 9) & 1
+    
+    if layer == 3:  # Layer I
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate
+    if layer == 1 and version != 3:  # Layer III, MPEG 2 / 2.5
+        return 72 * bitrate // sample_rate + padding, 576, sample_rate
+    return 144 * bitrate // sample_rate + padding, 1152, sample_rate
+
+
+class Mp3SeekIndex:
+    """Byte offset of every MPEG audio frame, for O(1) frame-accurate seeks
+    
+    pygame seeks MP3s by decoding from the start or by guessing from the
+    bitrate. With the offset of each frame, a seek is an array lookup and
+    playback restarts exactly on a frame boundary.
+    """
+    
+    def __init__(self, sample_rate, samples_per_frame, offsets):
+        self.sample_rate = sample_rate
+        self.samples_per_frame = samples_per_frame
+        self.offsets = offsets  # array('I')
+        
+    def frame_duration(self):
+        return self.samples_per_frame / self.sample_rate
+        
+    def locate(self, seconds):
+        """Return (byte offset, exact start time) of the frame holding seconds"""
+        frame = int(seconds / self.frame_duration())
+        frame = max(0, min(frame, len(self.offsets) - 1))
+        return self.offsets[frame], frame * self.frame_duration()
+        
+    @classmethod
+    def build(cls, file_path):
+        """Scan the frame headers of an MP3 file"""
+        with open(file_path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            size = len(data)
+            if size >= 1 << 32:
+                return None
+                
+            # Skip an ID3v2 tag (size is syncsafe)
+            pos = 0
+            if data[:3] == b'ID3' and size >= 10:
+                tag_size = 0
+                for byte in data[6:10]:
+                    tag_size = (tag_size << 7) | (byte & 0x7F)
+                pos = 10 + tag_size + (10 if data[5] & 0x10 else 0)
+                
+            offsets = array('I')
+            sample_rate = samples_per_frame = None
+            unpack = struct.Struct('>I').unpack_from
+            
+            while pos + 4 <= size:
+                frame = parse_mpeg_header(unpack(data, pos)[0])
+                if frame is None or frame[0] <= 4:
+                    # Lost sync, e.g. junk or a trailing tag: look for the next frame
+                    pos = data.find(b'\xff', pos + 1)
+                    if pos < 0:
+                        break
+                    continue
+                    
+                length, spf, rate = frame
+                if sample_rate is None:
+                    sample_rate, samples_per_frame = rate, spf
+                    # A Xing/Info/VBRI header frame carries no audio
+                    side_info = (32 if data[pos + 3] >> 6 != 3 else 17) if spf == 1152 \
+                        else (17 if data[pos + 3] >> 6 != 3 else 9)
+                    marker = data[pos + 4 + side_info:pos + 8 + side_info]
+                    if marker in (b'Xing', b'Info') or data[pos + 36:pos + 40] == b'VBRI':
+                        pos += length
+                        continue
+                elif rate != sample_rate:
+                    pos = data.find(b'\xff', pos + 1)
+                    if pos < 0:
+                        break
+                    continue
+                    
+                offsets.append(pos)
+                pos += length
+                
+        if not offsets:
+            return None
+        return cls(sample_rate, samples_per_frame, offsets)
+        
+    @classmethod
+    def load(cls, index_path):
+        """Read a saved index, None if it isn't one; a truncated file raises EOFError"""
+        with open(index_path, 'rb') as f:
+            magic, sample_rate, samples_per_frame, count = struct.unpack('<4sIII', f.read(16))
+            if magic != SEEK_INDEX_MAGIC or not count:
+                return None
+            offsets = array('I')
+            offsets.fromfile(f, count)
+        return cls(sample_rate, samples_per_frame, offsets)
+        
+    def save(self, index_path):
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(struct.pack(
+                '<4sIII', SEEK_INDEX_MAGIC, self.sample_rate,
+                self.samples_per_frame, len(self.offsets)
+            ))
+            self.offsets.tofile(f)
+        os.replace(tmp_path, index_path)
+
+
+class FileSlice(io.RawIOBase):
+    """Read-only view of a file starting at a byte offset
+    
+    pygame can load music from a file object; handing it a view that starts
+    on a frame boundary makes the decoder begin right there.
+    """
+    
+    def __init__(self, file_path, offset):
+        super().__init__()
+        self.file = open(file_path, 'rb')
+        self.offset = offset
+        self.file.seek(offset)
+        
+    def readable(self):
+        return True
+        
+    def seekable(self):
+        return True
+        
+    def readinto(self, buffer):
+        return self.file.readinto(buffer)
+        
+    def seek(self, position, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position += self.offset
+        return self.file.seek(position, whence) - self.offset
+        
+    def tell(self):
+        return self.file.tell() - self.offset
+        
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+class ConnectionPool:
+    """Idle HTTP(S) connections per host, handed to the next request there
+    
+    A connection only comes back once its response was read to the end, so
+    the tail and body requests of a remote file, and consecutive tracks
+    from one server, share a connection instead of repeating the TCP and
+    TLS handshakes.
+    """
+    
+    def __init__(self, per_host=STREAM_IDLE_CONNECTIONS):
+        self.per_host = per_host
+        self.lock = threading.Lock()
+        self.idle = {}  # (scheme, host, port) -> connections, most recent last
+        self.opened = 0  # connections made so far
+        
+    def get(self, url, headers):
+        """Send a GET for url, following redirects, and return (connection, response)"""
+        for _ in range(STREAM_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            key = (parts.scheme.lower(), parts.hostname, parts.port)
+            target = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+            connection, response = self.send(key, target, headers)
+            location = response.getheader('Location')
+            if response.status in (301, 302, 303, 307, 308) and location:
+                response.read()
+                self.release(connection, response)
+                url = urllib.parse.urljoin(url, location)
+                continue
+            if response.status not in (200, 206):
+                connection.close()
+                raise OSError(f"HTTP {response.status} {response.reason}: {url}")
+            return connection, response
+        raise OSError(f"Too many redirects: {url}")
+        
+    def send(self, key, target, headers):
+        with self.lock:
+            idle = self.idle.get(key)
+            connection = idle.pop() if idle else None
+        if connection is not None:
+            try:
+                connection.request('GET', target, headers=headers)
+                return connection, connection.getresponse()
+            except (OSError, http_client.HTTPException):
+                # The server closed it while it sat idle
+                connection.close()
+                
+        scheme, host, port = key
+        factory = http_client.HTTPSConnection if scheme == 'https' else http_client.HTTPConnection
+        connection = factory(host, port, timeout=STREAM_TIMEOUT)
+        connection.pool_key = key
+        with self.lock:
+            self.opened += 1
+        try:
+            connection.request('GET', target, headers=headers)
+            return connection, connection.getresponse()
+        except Exception:
+            connection.close()
+            raise
+            
+    def release(self, connection, response):
+        """Keep a connection whose response was read to the end for the next request"""
+        if response.will_close or not response.isclosed():
+            connection.close()
+            return
+        with self.lock:
+            idle = self.idle.setdefault(connection.pool_key, [])
+            if len(idle) < self.per_host:
+                idle.append(connection)
+                return
+        connection.close()
+        
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+class HttpStream(io.RawIOBase):
+    """Read-only file object over an HTTP(S) URL, fetched ahead in the background
+    
+    pygame reads music sources on the audio thread, so a fetcher thread
+    keeps up to readahead bytes ahead of the decoder in a ring buffer. If
+    the server answers range requests, a jump out of the buffered window
+    restarts the fetch there, and the last STREAM_TAIL_BYTES, where
+    decoders look for tags, are fetched up front. Live streams have no
+    length: they report STREAM_VIRTUAL_LENGTH and read as silence near that
+    end, and titles from their ICY metadata go to on_title. Like FileSlice,
+    positions count from offset. Reads that have to wait for the network
+    once data has arrived are counted as underruns. With block set, ranges
+    are asked for that many bytes at a time, so a stream closed early still
+    leaves its connection reusable.
+    """
+    
+    def __init__(self, url, pool, offset=0, readahead=STREAM_READAHEAD, on_title=None, block=None):
+        super().__init__()
+        self.url = url
+        self.pool = pool
+        self.offset = offset
+        self.block = block
+        self.on_title = on_title
+        self.condition = threading.Condition()
+        self.ring = bytearray(readahead)
+        self.start = self.end = offset  # the ring holds these file positions
+        self.position = offset  # next byte the decoder reads
+        self.read_from = offset  # last position read from the ring; the fetch keeps what follows
+        self.generation = 0  # bumped when the fetch restarts elsewhere
+        self.eof = False
+        self.error = None
+        self.aborted = False
+        self.primed = False  # data arrived since the fetch (re)started
+        self.stalled = False  # a read is waiting for the network
+        self.underruns = 0
+        self.title = None
+        
+        # Ask for the tail first: the answer also tells the length and whether ranges work
+        headers = {'Range': f'bytes=-{STREAM_TAIL_BYTES}', **STREAM_HEADERS}
+        connection, response = pool.get(url, headers)
+        content_type = (response.getheader('Content-Type') or '').split(';')[0].strip().lower()
+        extension = os.path.splitext(urllib.parse.urlsplit(url).path)[1].lower()
+        self.namehint = extension[1:] if extension in AUDIO_EXTENSIONS else STREAM_CONTENT_TYPES.get(content_type, '')
+        self.station = response.getheader('icy-name')
+        self.metaint = 0
+        if response.status == 206:
+            total = (response.getheader('Content-Range') or '').rpartition('/')[2]
+            if not total.isdigit():
+                connection.close()
+                raise OSError(f"Unknown length: {url}")
+            self.length = int(total)
+            self.tail = response.read()
+            pool.release(connection, response)
+            self.ranges = True
+            connection = response = None  # the fetch asks for the body
+        else:
+            # No ranges: this is the body, from the start
+            if offset > 0:
+                connection.close()
+                raise OSError(f"The server can't start in the middle: {url}")
+            self.metaint = int(response.getheader('icy-metaint') or 0)
+            length = response.getheader('Content-Length')
+            self.length = int(length) if length and not self.metaint else None
+            self.tail = b''
+            self.ranges = False
+        self.tail_start = self.length - len(self.tail) if self.length is not None else None
+        threading.Thread(target=self.fetch, args=(0, connection, response), daemon=True).start()
+        
+    def readable(self):
+        return True
+        
+    def seekable(self):
+        return True
+        
+    def stale(self, generation):
+        return generation != self.generation or self.aborted
+        
+    def fetch(self, generation, connection=None, response=None):
+        """Fill the ring buffer from its end on, in the fetcher thread"""
+        try:
+            meta_left = self.metaint
+            while True:
+                with self.condition:
+                    while True:
+                        if self.stale(generation):
+                            return
+                        room = len(self.ring) - (self.end - max(self.start, self.read_from - STREAM_KEEP_BEHIND))
+                        if room > 0:
+                            break
+                        self.condition.wait()
+                    start = self.end
+                if response is None:
+                    last = '' if self.block is None else min(start + self.block, self.length) - 1
+                    connection, response = self.pool.get(self.url, {'Range': f'bytes={start}-{last}', **STREAM_HEADERS})
+                    if response.status != 206:
+                        raise OSError(f"The server ignored a range request: {self.url}")
+                size = min(room, STREAM_CHUNK)
+                if self.metaint:
+                    if meta_left == 0:
+                        self.read_metadata(response)
+                        meta_left = self.metaint
+                    size = min(size, meta_left)
+                data = response.read1(size)
+                meta_left -= len(data)
+                if not data or response.isclosed():
+                    response.read()  # marks the response finished, so the connection can be reused
+                    self.pool.release(connection, response)
+                    connection = response = None
+                with self.condition:
+                    if self.stale(generation):
+                        return
+                    if data:
+                        self.write(data)
+                        self.condition.notify_all()
+                    if response is None and (self.block is None or self.end >= self.length):
+                        self.eof = True
+                        self.condition.notify_all()
+                        return
+        except (OSError, http_client.HTTPException) as e:
+            with self.condition:
+                if not self.stale(generation):
+                    self.error = e
+                    self.condition.notify_all()
+        finally:
+            if connection is not None:
+                connection.close()
+                
+    def read_metadata(self, response):
+        """Take an ICY metadata block out of the data and pass on a new title"""
+        length = response.read(1)
+        if not length:
+            return
+        match = ICY_TITLE.search(response.read(length[0] * 16))
+        if match is None:
+            return
+        title = match.group(1).decode('utf-8', 'replace').strip()
+        if title != self.title:
+            self.title = title
+            if self.on_title is not None:
+                self.on_title(title)
+                
+    def write(self, data):
+        size = len(self.ring)
+        at = self.end % size
+        first = min(len(data), size - at)
+        self.ring[at:at + first] = data[:first]
+        self.ring[:len(data) - first] = data[first:]
+        self.end += len(data)
+        self.start = max(self.start, self.end - size)
+        self.primed = True
+        
+    def restart(self, position):
+        """Drop the buffer and fetch from position with a range request"""
+        self.generation += 1
+        self.start = self.end = self.read_from = position
+        self.eof = False
+        self.error = None
+        self.primed = False
+        self.condition.notify_all()
+        threading.Thread(target=self.fetch, args=(self.generation,), daemon=True).start()
+        
+    def readinto(self, buffer):
+        with self.condition:
+            position = self.position
+            wanted = len(buffer)
+            if self.aborted or (self.length is not None and position >= self.length):
+                return 0
+            if not self.start <= position < self.end:
+                if self.tail and position >= self.tail_start:
+                    data = self.tail[position - self.tail_start:position - self.tail_start + wanted]
+                    buffer[:len(data)] = data
+                    self.position += len(data)
+                    return len(data)
+                if self.length is None and position >= STREAM_VIRTUAL_LENGTH - STREAM_TAIL_BYTES:
+                    count = min(wanted, STREAM_VIRTUAL_LENGTH - position)
+                    buffer[:count] = bytes(count)
+                    self.position += count
+                    return count
+                if self.start <= position <= self.end + STREAM_SKIP_AHEAD:
+                    self.read_from = position
+                elif self.ranges:
+                    self.restart(position)
+                else:
+                    raise OSError(f"Can't seek in this stream: {self.url}")
+                    
+            waited = None
+            while self.end <= position and not (self.eof or self.error or self.aborted):
+                if waited is None:
+                    waited = time.perf_counter()
+                    if self.primed:
+                        self.underruns += 1
+                        PERF.count('stream underruns')
+                    self.stalled = True
+                self.condition.wait()
+            self.stalled = False
+            if waited is not None:
+                PERF.record('stream wait', waited)
+            if self.aborted:
+                return 0
+            if self.end <= position:
+                if self.error is not None:
+                    raise OSError(f"Error reading stream: {self.error}")
+                return 0
+                
+            count = min(wanted, self.end - position)
+            size = len(self.ring)
+            at = position % size
+            first = min(count, size - at)
+            buffer[:first] = self.ring[at:at + first]
+            buffer[first:count] = self.ring[:count - first]
+            self.position = self.read_from = position + count
+            self.condition.notify_all()
+            return count
+            
+    def seek(self, position, whence=io.SEEK_SET):
+        with self.condition:
+            if whence == io.SEEK_SET:
+                position += self.offset
+            elif whence == io.SEEK_CUR:
+                position += self.position
+            else:
+                position += STREAM_VIRTUAL_LENGTH if self.length is None else self.length
+            self.position = max(position, self.offset)
+            return self.position - self.offset
+            
+    def tell(self):
+        return self.position - self.offset
+        
+    def size(self):
+        """Bytes from offset to the end, None for live streams"""
+        return None if self.length is None else self.length - self.offset
+        
+    def wait_buffered(self, amount):
+        """Block until amount bytes past the position are buffered or the data ends"""
+        with self.condition:
+            while self.end - self.position < amount and not (self.eof or self.error or self.aborted):
+                self.condition.wait()
+            if self.error is not None:
+                raise OSError(f"Error reading stream: {self.error}")
+                
+    def abort(self):
+        """Stop fetching and make reads return nothing, so a waiting one gives up"""
+        with self.condition:
+            self.aborted = True
+            self.condition.notify_all()
+            
+    def close(self):
+        self.abort()
+        super().close()
+
+
+class PlaybackClock:
+    """Playback position built on pygame's get_pos()
+    
+    get_pos() counts the milliseconds of audio mixed since the last play()
+    call, so paused time is already left out. It knows nothing about the
+    start offset of a seek, though, and restarts from zero when a queued
+    track takes over. The clock adds the offset and notices the restart.
+    """
+    
+    def __init__(self, get_pos=None):
+        self.get_pos = get_pos or (lambda: pygame.mixer.music.get_pos())
+        self.offset = 0.0
+        self.last_raw = 0
+        self.wrapped = False  # get_pos() restarted without a play() call
+        
+    def restart(self, offset=0.0):
+        """Call right after play() / play(start=offset)"""
+        self.offset = offset
+        self.last_raw = 0
+        self.wrapped = False
+        
+    def position(self):
+        """Seconds into the current track"""
+        raw = self.get_pos()
+        if raw < 0:
+            # Nothing playing, keep the last known position
+            return self.offset + self.last_raw / 1000
+        if raw < self.last_raw:
+            # A queued track took over and started from zero
+            self.offset = 0.0
+            self.wrapped = True
+        self.last_raw = raw
+        return self.offset + raw / 1000
+
+
+def wav_pcm_layout(file_path):
+    """(data offset, frames, channels, sample rate) of a 16-bit PCM WAV file, else None"""
+    if os.path.splitext(file_path)[1].lower() != '.wav':
+        return None
+    with open(file_path, 'rb') as f:
+        try:
+            riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+            if riff != b'RIFF' or wave_id != b'WAVE':
+                return None
+            fmt = None
+            while True:
+                chunk_id, size = struct.unpack('<4sI', f.read(8))
+                if chunk_id == b'fmt ':
+                    data = f.read(size + size % 2)
+                    tag, channels, sample_rate = struct.unpack('<HHI', data[:8])
+                    bits = struct.unpack('<H', data[14:16])[0]
+                    if tag == 0xFFFE:
+                        # WAVE_FORMAT_EXTENSIBLE: the sub-format GUID starts with the real tag
+                        tag = struct.unpack('<H', data[24:26])[0]
+                    fmt = (tag, channels, sample_rate, bits)
+                elif chunk_id == b'data':
+                    if fmt is None or fmt[0] != 1 or fmt[3] != 16 or fmt[1] not in (1, 2):
+                        return None
+                    offset = f.tell()
+                    # Streaming writers leave the size at its maximum
+                    size = min(size, os.fstat(f.fileno()).st_size - offset)
+                    frames = size // (2 * fmt[1])
+                    return (offset, frames, fmt[1], fmt[2]) if frames else None
+                else:
+                    f.seek(size + size % 2, io.SEEK_CUR)
+        except struct.error:
+            return None
+
+
+def decode_pcm(file_path):
+    """Return a file's (frames, channels) int16 samples and their sample rate
+    
+    16-bit PCM WAV files are memory-mapped, so tracks of any length are
+    read in place, page by page, as the samples are reduced. Anything else
+    pygame decodes whole, as it can't decode in pieces; tracks longer than
+    PCM_DECODE_MAX_SECONDS raise ValueError instead of taking gigabytes.
+    The decoded array is a view of the Sound rather than a copy, and the
+    view's buffer keeps the Sound alive for as long as the samples are used.
+    """
+    layout = wav_pcm_layout(file_path)
+    if layout is not None:
+        offset, frames, channels, sample_rate = layout
+        samples = np.memmap(file_path, dtype='<i2', mode='r', offset=offset, shape=(frames, channels))
+        return samples, sample_rate
+        
+    try:
+        duration = probe_audio_info(file_path)['duration']
+    except Exception:
+        duration = 0  # unknown, let pygame try
+    if duration > PCM_DECODE_MAX_SECONDS:
+        raise ValueError(f"{duration / 60:.0f} minutes is too long to decode whole")
+        
+    import pygame.sndarray
+    sound = pygame.mixer.Sound(file_path)
+    samples = pygame.sndarray.samples(sound)
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    return samples, pygame.mixer.get_init()[0]
+
+
+def block_peaks(samples, block):
+    """Min/max of every block of samples across all channels"""
+    count = -(-len(samples) // block)
+    full = len(samples) // block
+    mins = np.empty(count, dtype=np.int16)
+    maxs = np.empty(count, dtype=np.int16)
+    
+    blocks = samples[:full * block].reshape(full, -1)
+    np.min(blocks, axis=1, out=mins[:full])
+    np.max(blocks, axis=1, out=maxs[:full])
+    if count > full:
+        tail = samples[full * block:]
+        mins[full] = tail.min()
+        maxs[full] = tail.max()
+    return mins, maxs
+
+
+class PeakFile:
+    """Multi-resolution min/max peaks of a track
+    
+    Level 0 holds one min/max pair per PEAK_BLOCK samples and every further
+    level merges PEAK_FACTOR pairs of the previous one. On disk the levels
+    are stored back to back as int16 and memory-mapped when read again.
+    """
+    
+    HEADER = struct.Struct('<4sIIII')  # magic, sample rate, block, factor, levels
+    
+    def __init__(self, sample_rate, levels):
+        self.sample_rate = sample_rate
+        self.levels = levels  # [(mins, maxs)], finest first
+        
+    @classmethod
+    def from_level0(cls, sample_rate, mins, maxs):
+        levels = [(mins, maxs)]
+        while len(mins) > PEAK_MIN_COUNT:
+            pad = -len(mins) % PEAK_FACTOR
+            mins = np.pad(mins, (0, pad), mode='edge').reshape(-1, PEAK_FACTOR).min(axis=1)
+            maxs = np.pad(maxs, (0, pad), mode='edge').reshape(-1, PEAK_FACTOR).max(axis=1)
+            levels.append((mins, maxs))
+        return cls(sample_rate, levels)
+        
+    @classmethod
+    def load(cls, peak_path):
+        with open(peak_path, 'rb') as f:
+            magic, sample_rate, block, factor, count = cls.HEADER.unpack(f.read(cls.HEADER.size))
+            if magic != PEAK_MAGIC or block != PEAK_BLOCK or factor != PEAK_FACTOR:
+                return None
+            sizes = struct.unpack(f'<{count}I', f.read(4 * count))
+            
+        data = np.memmap(
+            peak_path, dtype='<i2', mode='r',
+            offset=cls.HEADER.size + 4 * count
+        )
+        levels = []
+        start = 0
+        for size in sizes:
+            levels.append((data[start:start + size], data[start + size:start + 2 * size]))
+            start += 2 * size
+        return cls(sample_rate, levels)
+        
+    def save(self, peak_path):
+        tmp_path = peak_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self.HEADER.pack(
+                PEAK_MAGIC, self.sample_rate, PEAK_BLOCK, PEAK_FACTOR, len(self.levels)
+            ))
+            f.write(struct.pack(f'<{len(self.levels)}I', *(len(m) for m, _ in self.levels)))
+            for mins, maxs in self.levels:
+                f.write(mins.astype('<i2').tobytes())
+                f.write(maxs.astype('<i2').tobytes())
+        os.replace(tmp_path, peak_path)
+        
+    def columns(self, width):
+        """Reduce to width columns, picking the coarsest level that is detailed enough"""
+        mins, maxs = self.levels[0]
+        for level_mins, level_maxs in self.levels:
+            if len(level_mins) < width:
+                break
+            mins, maxs = level_mins, level_maxs
+        return reduce_columns(mins, maxs, width, len(mins))
+
+
+def reduce_columns(mins, maxs, width, total, filled=None):
+    """Reduce peaks to at most width columns, only those fully covered by filled peaks"""
+    if total == 0:
+        return np.zeros(0), np.zeros(0)
+    filled = total if filled is None else filled
+    if total < width:
+        # Fewer peaks than pixels: stretch
+        index = (np.arange(width) * total) // width
+        index = index[index < filled]
+        return mins[index] / 32768, maxs[index] / 32768
+        
+    edges = (np.arange(width + 1) * total) // width
+    columns = int(np.searchsorted(edges, filled, side='right')) - 1
+    if columns <= 0:
+        return np.zeros(0), np.zeros(0)
+    starts = edges[:columns]
+    return (np.minimum.reduceat(mins[:edges[columns]], starts) / 32768,
+            np.maximum.reduceat(maxs[:edges[columns]], starts) / 32768)
+
+
+class WaveformView:
+    """Clickable waveform overview that doubles as the progress bar
+    
+    One vertical line per pixel column is created up front. New peaks only
+    move existing lines and progress only recolours the columns that crossed
+    the playhead.
+    """
+    
+    def __init__(self, parent, on_seek, width=WAVEFORM_WIDTH, height=WAVEFORM_HEIGHT,
+                 bg='#16213e', fg='#53537a', played='#e94560'):
+        self.on_seek = on_seek
+        self.width = width
+        self.height = height
+        self.fg = fg
+        self.played = played
+        self.played_columns = 0
+        
+        self.canvas = tk.Canvas(
+            parent,
+            width=width,
+            height=height,
+            bg=bg,
+            highlightthickness=0,
+            cursor='hand2'
+        )
+        mid = height / 2
+        self.lines = [
+            self.canvas.create_line(x, mid - 1, x, mid + 1, fill=fg)
+            for x in range(width)
+        ]
+        self.canvas.bind('<Button-1>', self.on_click)
+        
+    def pack(self, **kwargs):
+        self.canvas.pack(**kwargs)
+        
+    def winfo_width(self):
+        return self.width
+        
+    def clear(self):
+        """Flat line until peaks arrive"""
+        mid = self.height / 2
+        for x, line in enumerate(self.lines):
+            self.canvas.coords(line, x, mid - 1, x, mid + 1)
+            
+    def set_peaks(self, mins, maxs):
+        """Draw the first len(mins) columns from peaks in -1..1"""
+        mid = self.height / 2
+        half = mid - 1
+        tops = (mid - np.asarray(maxs) * half).tolist()
+        bottoms = (mid - np.asarray(mins) * half + 1).tolist()
+        for x, (top, bottom) in enumerate(zip(tops, bottoms)):
+            self.canvas.coords(self.lines[x], x, top, x, bottom)
+            
+    def set_progress(self, fraction):
+        """Colour columns left of the playhead"""
+        played = int(round(max(0.0, min(fraction, 1.0)) * self.width))
+        if played == self.played_columns:
+            return
+        low, high = sorted((played, self.played_columns))
+        fill = self.played if played > self.played_columns else self.fg
+        for x in range(low, high):
+            self.canvas.itemconfigure(self.lines[x], fill=fill)
+        self.played_columns = played
+        
+    def on_click(self, event):
+        self.on_seek(max(0.0, min(event.x / self.width, 1.0)))
+
+
+class SpectrumAnalyzer:
+    """Log-spaced band levels and per-channel VU levels of int16 PCM, from 0 to 1"""
+    
+    def __init__(self, sample_rate, bars=SPECTRUM_BARS, size=SPECTRUM_FFT):
+        self.sample_rate = sample_rate
+        self.size = size
+        self.window = np.hanning(size).astype(np.float32)
+        # A full-scale sine peaks at 0 dB
+        self.scale = 2 / (32768 * float(self.window.sum()))
+        
+        edges = np.geomspace(SPECTRUM_MIN_HZ, min(SPECTRUM_MAX_HZ, sample_rate / 2), bars + 1)
+        bins = (edges * size / sample_rate).astype(int).tolist()
+        # Low bars are narrower than a bin, so give each at least one of its own
+        starts = [max(bins[0], 1)]
+        for start in bins[1:-1]:
+            starts.append(max(start, starts[-1] + 1))
+        self.starts = np.array(starts)
+        self.end = max(bins[-1], starts[-1] + 1)
+        
+    def levels(self, samples, position):
+        """Bars and VU levels of the window of samples (frames, channels) at frame position"""
+        start = max(0, min(position - self.size // 2, len(samples) - self.size))
+        block = samples[start:start + self.size]
+        if len(block) < self.size:
+            return np.zeros(len(self.starts)), np.zeros(samples.shape[1])
+            
+        block = block.astype(np.float32)
+        mono = block.mean(axis=1)
+        mono *= self.window
+        magnitudes = np.abs(np.fft.rfft(mono)[:self.end])
+        bars = np.maximum.reduceat(magnitudes, self.starts) * self.scale
+        rms = np.sqrt(np.mean(block * block, axis=0)) * (math.sqrt(2) / 32768)
+        return self.to_height(bars), self.to_height(rms)
+        
+    @staticmethod
+    def to_height(amplitudes):
+        db = 20 * np.log10(np.maximum(amplitudes, 1e-9))
+        return np.clip(1 - db / SPECTRUM_FLOOR_DB, 0, 1)
+
+
+class SpectrumView:
+    """Spectrum bars with a VU meter per channel on the right
+    
+    Like WaveformView, every rectangle is created up front; a frame only
+    moves the tops of the ones whose height changed.
+    """
+    
+    def __init__(self, parent, bars=SPECTRUM_BARS, channels=2, width=WAVEFORM_WIDTH,
+                 height=SPECTRUM_HEIGHT, bg='#16213e', fg='#53537a', meter='#e94560'):
+        self.height = height
+        self.canvas = tk.Canvas(parent, width=width, height=height, bg=bg, highlightthickness=0)
+        
+        meter_width = 6
+        bars_width = width - channels * (meter_width + 2) - 4
+        step = bars_width / bars
+        self.items = []
+        self.spans = []
+        for i in range(bars):
+            left = int(i * step)
+            self.spans.append((left, int((i + 1) * step) - 1))
+        for i in range(channels):
+            left = bars_width + 4 + i * (meter_width + 2)
+            self.spans.append((left, left + meter_width))
+        for i, (left, right) in enumerate(self.spans):
+            fill = fg if i < bars else meter
+            self.items.append(self.canvas.create_rectangle(left, height, right, height, fill=fill, width=0))
+        self.bars = bars
+        self.shown = np.zeros(len(self.items))
+        self.tops = [height] * len(self.items)
+        
+    def pack(self, **kwargs):
+        self.canvas.pack(**kwargs)
+        
+    def pack_forget(self):
+        self.canvas.pack_forget()
+        
+    def set_levels(self, bars, meters):
+        """Show levels from 0 to 1; bars rise at once and fall slowly"""
+        levels = np.concatenate((bars, meters[:len(self.items) - self.bars]))
+        levels = np.pad(levels, (0, len(self.items) - len(levels)))
+        np.maximum(levels, self.shown - SPECTRUM_FALL, out=self.shown)
+        tops = (self.height - self.shown * self.height).astype(int).tolist()
+        for i, top in enumerate(tops):
+            if top != self.tops[i]:
+                left, right = self.spans[i]
+                self.canvas.coords(self.items[i], left, top, right, self.height)
+                self.tops[i] = top
+                
+    def clear(self):
+        self.shown.fill(0)
+        self.set_levels(self.shown[:self.bars], self.shown[self.bars:])
+
+
+def biquad_response(b, a, w):
+    """Complex response of a biquad at angular frequencies w (radians/sample)"""
+    z1 = np.exp(-1j * w)
+    z2 = z1 * z1
+    return (b[0] + b[1] * z1 + b[2] * z2) / (a[0] + a[1] * z1 + a[2] * z2)
+
+
+def high_shelf_coefficients(freq, gain_db, q, sample_rate):
+    """RBJ high shelf biquad (b, a)"""
+    A = 10 ** (gain_db / 40)
+    w0 = 2 * math.pi * freq / sample_rate
+    alpha = math.sin(w0) / (2 * q)
+    cos_w0 = math.cos(w0)
+    sqrt_a = 2 * math.sqrt(A) * alpha
+    b = (A * ((A + 1) + (A - 1) * cos_w0 + sqrt_a),
+         -2 * A * ((A - 1) + (A + 1) * cos_w0),
+         A * ((A + 1) + (A - 1) * cos_w0 - sqrt_a))
+    a = ((A + 1) - (A - 1) * cos_w0 + sqrt_a,
+         2 * ((A - 1) - (A + 1) * cos_w0),
+         (A + 1) - (A - 1) * cos_w0 - sqrt_a)
+    return b, a
+
+
+def high_pass_coefficients(freq, q, sample_rate):
+    """RBJ second-order high pass biquad (b, a)"""
+    w0 = 2 * math.pi * freq / sample_rate
+    alpha = math.sin(w0) / (2 * q)
+    cos_w0 = math.cos(w0)
+    b = ((1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2)
+    a = (1 + alpha, -2 * cos_w0, 1 - alpha)
+    return b, a
+
+
+def peaking_coefficients(freq, gain_db, q, sample_rate):
+    """RBJ peaking EQ biquad (b, a)"""
+    A = 10 ** (gain_db / 40)
+    w0 = 2 * math.pi * freq / sample_rate
+    alpha = math.sin(w0) / (2 * q)
+    cos_w0 = math.cos(w0)
+    b = (1 + alpha * A, -2 * cos_w0, 1 - alpha * A)
+    a = (1 + alpha / A, -2 * cos_w0, 1 - alpha / A)
+    return b, a
+
+
+def k_weighting_power(sample_rate, n_fft):
+    """|H|^2 of the BS.1770 K-weighting filter at the rfft bins of n_fft"""
+    w = 2 * math.pi * np.fft.rfftfreq(n_fft)
+    shelf = biquad_response(*high_shelf_coefficients(1500.0, 4.0, 1 / math.sqrt(2), sample_rate), w)
+    high_pass = biquad_response(*high_pass_coefficients(38.0, 0.5, sample_rate), w)
+    return np.abs(shelf * high_pass) ** 2
+
+
+def measure_loudness(samples, sample_rate):
+    """Integrated loudness in LUFS of int16 (frames, channels) PCM, or None
+    
+    K-weighting is applied in the frequency domain: the mean square of each
+    100 ms sub-block comes from its weighted power spectrum (Parseval), and
+    each 400 ms gating block is the mean of four consecutive sub-blocks.
+    """
+    n = int(sample_rate * LOUDNESS_SUBBLOCK)
+    count = len(samples) // n
+    if count < 4:
+        return None
+        
+    # Parseval weights for a one-sided spectrum, folded into the filter
+    weights = np.full(n // 2 + 1, 2.0)
+    weights[0] = 1.0
+    if n % 2 == 0:
+        weights[-1] = 1.0
+    weights *= k_weighting_power(sample_rate, n) / (n * n * 32768.0 * 32768.0)
+    
+    powers = np.empty(count)
+    for start in range(0, count, LOUDNESS_CHUNK):
+        stop = min(start + LOUDNESS_CHUNK, count)
+        blocks = samples[start * n:stop * n].reshape(stop - start, n, -1).astype(np.float32)
+        spectrum = np.fft.rfft(blocks, axis=1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        # Sum over channels (all weighted 1.0 for mono/stereo) and bins
+        powers[start:stop] = np.einsum('kbc,b->k', power, weights)
+        
+    # Gating blocks: 400 ms windows with 100 ms hop
+    cumulative = np.concatenate(([0.0], np.cumsum(powers)))
+    gated = (cumulative[4:] - cumulative[:-4]) / 4
+    block_loudness = -0.691 + 10 * np.log10(np.maximum(gated, 1e-20))
+    
+    gated = gated[block_loudness > ABSOLUTE_GATE_LUFS]
+    if not len(gated):
+        return None
+    relative_gate = -0.691 + 10 * math.log10(gated.mean()) + RELATIVE_GATE_LU
+    gated = gated[-0.691 + 10 * np.log10(gated) > relative_gate]
+    return -0.691 + 10 * math.log10(gated.mean())
+
+
+def init_analysis_worker():
+    """Process pool initializer: silent mixer used only for decoding"""
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    pygame.mixer.init(frequency=ANALYSIS_SAMPLE_RATE)
+
+
+def analyze_loudness(file_path):
+    """Process pool task: decode a track and return its ReplayGain values"""
+    try:
+        samples, sample_rate = decode_pcm(file_path)
+        loudness = measure_loudness(samples, sample_rate)
+        if loudness is None:
+            return file_path, None
+        peak = max(int(samples.max()), -int(samples.min())) / 32768 if len(samples) else 0.0
+        return file_path, {
+            'track_gain': RG_REFERENCE_LUFS - loudness,
+            'track_peak': peak,
+            'album_gain': None,
+            'album_peak': None,
+            'loudness': loudness,
+        }
+    except Exception as e:
+        print(f"Error analyzing loudness: {e}")
+        return file_path, None
+
+
+class DspChain:
+    """Preamp, 10-band equalizer and limiter for blocks of int16 PCM
+    
+    The equalizer is a cascade of peaking biquads, one per EQ_BANDS entry.
+    NumPy can't run a recursive filter without a Python loop per sample,
+    so the cascade's impulse response is applied by FFT overlap-save
+    convolution instead. New settings crossfade from the old response to
+    the new one over a block and the preamp ramps, so changes don't click.
+    The limiter finds one gain per LIMITER_WINDOW frames, looking a window
+    ahead, with instant attack and exponential release, and interpolates
+    it per sample. All work buffers are allocated once.
+    
+    set_gains() may be called from any thread, the rest from one.
+    """
+    
+    def __init__(self, sample_rate, channels, block=DSP_BLOCK):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block = block
+        self.fft_size = block + EQ_FIR_LENGTH
+        self.lock = threading.Lock()
+        self.pending = None  # (response, preamp) taking effect with the next block
+        self.response = None  # rfft of the impulse response, None while flat
+        self.preamp = 1.0
+        self.limiter_gain = 1.0
+        self.release = math.exp(-LIMITER_WINDOW / (LIMITER_RELEASE * sample_rate))
+        
+        # Channels first, so every transform runs over contiguous samples
+        self.window = np.zeros((channels, self.fft_size), dtype=np.float32)  # history, then the block
+        self.output = np.empty((channels, block), dtype=np.float32)
+        self.ramp = np.linspace(0, 1, block, endpoint=False, dtype=np.float32)
+        self.frame_index = np.arange(block)
+        self.window_ends = np.arange(0, block + 1, LIMITER_WINDOW) - 1  # -1: end of the previous block
+        
+    def set_gains(self, band_gains_db, preamp_db=0.0):
+        """Set band gains and preamp in dB, from the next block on"""
+        response = None
+        if any(band_gains_db):
+            w = 2 * math.pi * np.fft.rfftfreq(2 * EQ_FIR_LENGTH)
+            total = np.ones(len(w), dtype=complex)
+            for freq, gain_db in zip(EQ_BANDS, band_gains_db):
+                if gain_db and freq < self.sample_rate / 2:
+                    b, a = peaking_coefficients(freq, gain_db, EQ_Q, self.sample_rate)
+                    total *= biquad_response(b, a, w)
+            impulse = np.fft.irfft(total)[:EQ_FIR_LENGTH]
+            # Fade out what is left of the tail instead of cutting it off
+            taper = EQ_FIR_LENGTH // 8
+            impulse[-taper:] *= np.hanning(2 * taper)[taper:]
+            response = np.fft.rfft(impulse, self.fft_size).astype(np.complex64)
+        with self.lock:
+            self.pending = (response, 10 ** (preamp_db / 20))
+            
+    def reset(self):
+        """Forget the signal history, e.g. after a seek"""
+        self.window.fill(0)
+        self.limiter_gain = 1.0
+        
+    def equalize(self, response):
+        """The current block filtered by response, as a writable array"""
+        if response is None:
+            np.copyto(self.output, self.window[:, -self.block:])
+            return self.output
+        spectrum = np.fft.rfft(self.window, axis=1)
+        spectrum *= response
+        return np.fft.irfft(spectrum, self.fft_size, axis=1)[:, -self.block:]
+        
+    def process(self, samples, out):
+        """Run int16 samples of shape (frames, channels) into the int16 array out"""
+        frames = len(samples)
+        block = self.block
+        window = self.window
+        window[:, :-block] = window[:, block:]
+        np.multiply(samples.T, 1 / 32768, out=window[:, -block:][:, :frames], casting='unsafe')
+        if frames < block:
+            window[:, frames - block:] = 0
+        
+        with self.lock:
+            pending, self.pending = self.pending, None
+        old_response, old_preamp = self.response, self.preamp
+        if pending is not None:
+            self.response, self.preamp = pending
+            
+        y = self.equalize(self.response)
+        if self.response is not old_response:
+            previous = self.equalize(old_response) if old_response is not None else window[:, -block:]
+            y -= previous
+            y *= self.ramp
+            y += previous
+        if self.preamp != old_preamp:
+            y *= old_preamp + (self.preamp - old_preamp) * self.ramp
+        elif self.preamp != 1.0:
+            y *= self.preamp
+        self.limit(y)
+        
+        y = y[:, :frames]
+        y *= 32768
+        np.clip(y, -32768, 32767, out=y)
+        np.copyto(out.T, y, casting='unsafe')
+        
+    def limit(self, y):
+        """Scale y in place so no sample exceeds LIMITER_THRESHOLD"""
+        peaks = np.abs(y).max(axis=0).reshape(-1, LIMITER_WINDOW).max(axis=1)
+        if self.limiter_gain == 1.0 and peaks.max() <= LIMITER_THRESHOLD:
+            return
+        targets = np.minimum(1.0, LIMITER_THRESHOLD / np.maximum(peaks, 1e-9))
+        targets[:-1] = np.minimum(targets[:-1], targets[1:])
+        
+        # The block's first window had no look-ahead in the last block
+        gain = min(self.limiter_gain, float(targets[0]))
+        gains = [gain]
+        release = self.release
+        for target in targets.tolist():
+            gain = min(target, 1.0 - (1.0 - gain) * release)
+            gains.append(gain)
+        self.limiter_gain = gain
+        y *= np.interp(self.frame_index, self.window_ends, gains).astype(np.float32)
+
+
+class PcmSource:
+    """A track decoded to the mixer's format in a background thread"""
+    
+    def __init__(self, source):
+        self.ready = threading.Event()
+        self.sound = None  # owns the samples
+        self.samples = None  # (frames, channels) int16 view, no copy
+        self.position = 0  # next frame to read
+        threading.Thread(target=self.decode, args=(source,), daemon=True).start()
+        
+    def decode(self, source):
+        try:
+            import pygame.sndarray
+            self.sound = pygame.mixer.Sound(source) if isinstance(source, str) else pygame.mixer.Sound(file=source)
+            samples = pygame.sndarray.samples(self.sound)
+            self.samples = samples if samples.ndim == 2 else samples[:, None]
+        except Exception as e:
+            print(f"Error decoding audio: {e}")
+        finally:
+            self.ready.set()
+            
+    def read(self, frames):
+        """Up to frames samples from the current position, empty at the end"""
+        self.ready.wait()
+        if self.samples is None:
+            return None
+        start = min(self.position, len(self.samples))
+        self.position = min(start + frames, len(self.samples))
+        return self.samples[start:self.position]
+
+
+class DspPlayer:
+    """Stand-in for pygame.mixer.music that plays through a DspChain
+    
+    Tracks are decoded to PCM in the background. A feeder thread runs
+    DSP_BLOCK frames at a time through the chain, straight into one of
+    DSP_BUFFERS Sounds allocated up front, and keeps the next one queued
+    on a reserved Channel, so the only copy per block is the chain's own
+    output. Only the methods the engine uses are provided, and they behave
+    like pygame's: get_pos() restarts from zero when a queued track takes
+    over and get_busy() is False while paused.
+    """
+    
+    def __init__(self, chain):
+        import pygame.sndarray
+        self.chain = chain
+        self.rate, _, channels = pygame.mixer.get_init()
+        pygame.mixer.set_reserved(1)
+        self.channel = pygame.mixer.Channel(0)
+        self.buffers = []
+        for _ in range(DSP_BUFFERS):
+            sound = pygame.mixer.Sound(buffer=bytes(DSP_BLOCK * channels * 2))
+            samples = pygame.sndarray.samples(sound)
+            self.buffers.append((sound, samples if samples.ndim == 2 else samples[:, None]))
+        self.next_buffer = 0
+        
+        self.condition = threading.Condition()
+        self.current = None  # PcmSource being read
+        self.queued = None  # PcmSource to continue with
+        self.state = 'stopped'  # 'playing', 'paused', 'stopped' or 'closed'
+        self.generation = 0  # bumped whenever the feeder has to start over
+        self.finished = False  # the last block has been handed to the channel
+        self.started = None  # perf_counter() when the audio of play() began, minus pauses
+        self.paused_at = None
+        self.written = 0  # frames processed since play()
+        self.sent = 0  # frames handed to the channel since play()
+        self.track_starts = [0]  # frames since play() where each track began
+        threading.Thread(target=self.feed, daemon=True).start()
+        
+    def load(self, source, namehint=""):
+        with self.condition:
+            self.stop_locked()
+            self.current = PcmSource(source)
+            self.queued = None
+            
+    def queue(self, source):
+        with self.condition:
+            self.queued = PcmSource(source)
+            if self.finished and self.state == 'playing':
+                # The last block is already out, carry on right behind it
+                self.finished = False
+                self.condition.notify()
+            
+    def play(self, loops=0, start=0.0):
+        with self.condition:
+            self.stop_locked()
+            self.current.position = int(start * self.rate)
+            self.state = 'playing'
+            self.condition.notify()
+            
+    def pause(self):
+        with self.condition:
+            if self.state == 'playing':
+                self.channel.pause()
+                self.state = 'paused'
+                self.paused_at = time.perf_counter()
+                
+    def unpause(self):
+        with self.condition:
+            if self.state == 'paused':
+                self.channel.unpause()
+                if self.started is not None:
+                    self.started += time.perf_counter() - self.paused_at
+                self.state = 'playing'
+                self.condition.notify()
+                
+    def stop(self):
+        with self.condition:
+            self.stop_locked()
+            self.queued = None
+            
+    def stop_locked(self):
+        self.channel.stop()
+        self.generation += 1
+        self.state = 'stopped'
+        self.finished = False
+        self.started = None
+        self.written = 0
+        self.sent = 0
+        self.track_starts = [0]
+        
+    def current_pcm(self):
+        """Decoded samples of the track being read, or None while decoding"""
+        source = self.current
+        if source is None or not source.ready.is_set() or source.samples is None:
+            return None
+        return source.samples
+        
+    def close(self):
+        with self.condition:
+            self.stop_locked()
+            self.state = 'closed'
+            self.condition.notify()
+        pygame.mixer.set_reserved(0)
+        
+    def set_volume(self, volume):
+        self.channel.set_volume(volume)
+        
+    def get_busy(self):
+        with self.condition:
+            return self.state == 'playing' and (not self.finished or self.channel.get_busy())
+            
+    def get_pos(self):
+        """Milliseconds played of the current track, -1 when stopped"""
+        with self.condition:
+            if self.state in ('stopped', 'closed'):
+                return -1
+            if self.started is None:
+                return 0
+            now = self.paused_at if self.state == 'paused' else time.perf_counter()
+            played = min((now - self.started) * self.rate, self.sent)
+            track_start = 0
+            for start in self.track_starts:
+                if start <= played:
+                    track_start = start
+            return int((played - track_start) * 1000 / self.rate)
+            
+    def fill(self, generation):
+        """Process the next block into a free buffer, return (Sound, frames)"""
+        block = DSP_BLOCK
+        samples = self.current.read(block)
+        if samples is None:
+            samples = self.buffers[0][1][:0]
+        if len(samples) < block and self.queued is not None:
+            # Continue with the queued track in the same block, without a gap
+            with self.condition:
+                if generation != self.generation:
+                    return None, 0
+                self.current, self.queued = self.queued, None
+                self.track_starts.append(self.written + len(samples))
+            rest = self.current.read(block - len(samples))
+            if rest is not None and len(rest):
+                samples = np.concatenate((samples, rest))
+                
+        frames = len(samples)
+        self.written += frames
+        sound, buffer = self.buffers[self.next_buffer]
+        self.next_buffer = (self.next_buffer + 1) % DSP_BUFFERS
+        if frames == block:
+            self.chain.process(samples, buffer)
+            return sound, frames
+        if frames == 0:
+            return None, 0
+        # The last, short block gets a Sound of its own
+        self.chain.process(samples, buffer[:frames])
+        return pygame.mixer.Sound(buffer=buffer[:frames].tobytes()), frames
+        
+    def feed(self):
+        """Feeder thread: keep one processed block queued behind the playing one"""
+        generation = None
+        ready = None
+        while True:
+            with self.condition:
+                while self.state not in ('playing', 'closed') or (self.finished and self.state == 'playing'):
+                    self.condition.wait()
+                if self.state == 'closed':
+                    return
+                if generation != self.generation:
+                    generation = self.generation
+                    ready = None
+                    self.chain.reset()
+                    
+            if ready is None:
+                ready = self.fill(generation)
+                
+            with self.condition:
+                if generation != self.generation or self.state != 'playing':
+                    continue
+                sound, frames = ready
+                if sound is None:
+                    self.finished = True
+                    ready = None
+                    continue
+                if self.channel.get_queue() is None:
+                    if not self.channel.get_busy():
+                        # First block, or the feeder fell behind: start over from here
+                        self.channel.play(sound)
+                        self.started = time.perf_counter() - self.sent / self.rate
+                    else:
+                        self.channel.queue(sound)
+                    self.sent += frames
+                    self.finished = frames < DSP_BLOCK
+                    ready = None
+                    continue
+            time.sleep(DSP_POLL)
+
+
+class Track:
+    """One playlist entry"""
+    
+    __slots__ = ('path', 'duration', 'title', 'artist', 'album', 'missing', 'loudness')
+    
+    def __init__(self, path, duration=None):
+        self.path = path
+        self.duration = duration  # None until probed
+        self.title = None  # tags, None until probed or missing
+        self.artist = None
+        self.album = None
+        self.missing = False  # the file wasn't there when checked, e.g. an unmounted drive
+        self.loudness = None  # ReplayGain values once looked up off the timer thread, False if none
+        
+    def set_tags(self, info):
+        """Take title/artist/album from probe info, return True if any is set"""
+        self.title = info.get('title')
+        self.artist = info.get('artist')
+        self.album = info.get('album')
+        return bool(self.title or self.artist or self.album)
+        
+    def tag_text(self):
+        return " ".join(filter(None, (self.title, self.artist, self.album)))
+
+
+class Playlist:
+    """Ordered track list with O(1) membership and path -> index lookup
+    
+    Removing or moving tracks only marks positions from the first changed
+    index as stale; they are renumbered lazily on the next lookup, so bulk
+    edits cost one list operation instead of one fix-up per track.
+    """
+    
+    def __init__(self):
+        self.tracks = []
+        self.by_path = {}  # path -> Track
+        self.positions = {}  # path -> index, valid below self.valid_upto
+        self.valid_upto = 0
+        
+    def __len__(self):
+        return len(self.tracks)
+        
+    def __iter__(self):
+        return iter(self.tracks)
+        
+    def __getitem__(self, index):
+        return self.tracks[index]
+        
+    def __contains__(self, file_path):
+        return file_path in self.by_path
+        
+    def get(self, file_path):
+        """Return the track for a path, or None"""
+        return self.by_path.get(file_path)
+        
+    def holds(self, track):
+        """True if track is still in the playlist (re-adding a path makes a new Track)"""
+        return self.by_path.get(track.path) is track
+        
+    def index_of(self, file_path):
+        """Return the position of a path, or None if it isn't in the playlist"""
+        if file_path not in self.by_path:
+            return None
+        index = self.positions.get(file_path)
+        if index is not None and index < self.valid_upto:
+            return index
+            
+        # Renumber everything past the last edit
+        positions = self.positions
+        for index in range(self.valid_upto, len(self.tracks)):
+            positions[self.tracks[index].path] = index
+        self.valid_upto = len(self.tracks)
+        return positions[file_path]
+        
+    def extend(self, file_paths):
+        """Append paths that aren't already present, return the new tracks"""
+        added = []
+        by_path = self.by_path
+        for file_path in file_paths:
+            if file_path not in by_path:
+                track = Track(file_path)
+                by_path[file_path] = track
+                added.append(track)
+                
+        # Appending keeps existing positions valid
+        start = len(self.tracks)
+        if self.valid_upto == start:
+            for offset, track in enumerate(added):
+                self.positions[track.path] = start + offset
+            self.valid_upto = start + len(added)
+        self.tracks.extend(added)
+        return added
+        
+    def remove_range(self, start, stop):
+        """Remove tracks in [start, stop) and return them"""
+        removed = self.tracks[start:stop]
+        del self.tracks[start:stop]
+        for track in removed:
+            del self.by_path[track.path]
+            self.positions.pop(track.path, None)
+        self.valid_upto = min(self.valid_upto, start)
+        return removed
+        
+    def remove(self, index):
+        """Remove one track and return it"""
+        return self.remove_range(index, index + 1)[0]
+        
+    def remove_paths(self, file_paths):
+        """Remove the tracks of paths in one pass over the list and return them"""
+        present = [file_path for file_path in set(file_paths) if file_path in self.by_path]
+        if not present:
+            return []
+        first = min(map(self.index_of, present))
+        removed = []
+        for file_path in present:
+            removed.append(self.by_path.pop(file_path))
+            self.positions.pop(file_path, None)
+        by_path = self.by_path
+        self.tracks[first:] = [track for track in self.tracks[first:] if by_path.get(track.path) is track]
+        self.valid_upto = min(self.valid_upto, first)
+        return removed
+        
+    def move(self, start, stop, dest):
+        """Move tracks [start, stop) so the block begins at dest afterwards"""
+        block = self.tracks[start:stop]
+        del self.tracks[start:stop]
+        self.tracks[dest:dest] = block
+        self.valid_upto = min(self.valid_upto, start, dest)
+        
+    def clear(self):
+        self.tracks.clear()
+        self.by_path.clear()
+        self.positions.clear()
+        self.valid_upto = 0
+
+
+class ShuffleOrder:
+    """Random permutation of playlist positions, drawn one at a time
+    
+    A sparse Fisher-Yates shuffle: only positions that were swapped are
+    stored, so drawing k of n positions costs O(k) time and memory, never
+    O(n). Positions appended to the playlist join the undrawn part.
+    """
+    
+    def __init__(self, size, rng=random):
+        self.size = size
+        self.drawn = 0
+        self.swapped = {}  # position -> value moved there by a swap
+        self.rng = rng
+        
+    def remaining(self):
+        return self.size - self.drawn
+        
+    def grow(self, size):
+        """Include positions up to size, e.g. after tracks were appended"""
+        self.size = max(self.size, size)
+        
+    def draw(self):
+        """Next position of the permutation"""
+        i = self.drawn
+        j = self.rng.randrange(i, self.size)
+        value = self.swapped.pop(j, j)
+        if j != i:
+            self.swapped[j] = self.swapped.pop(i, i)
+        else:
+            self.swapped.pop(i, None)
+        self.drawn += 1
+        return value
+
+
+class SearchIndex:
+    """Word-prefix index over file names, folder names and tags
+    
+    A query matches the tracks that have, for every query word, some word
+    starting with it. Words map to the tracks containing them, and so do
+    their first SEARCH_SHORT_PREFIX characters: short prefixes, which match
+    the most words, are one lookup. Longer ones are a bisect range of the
+    sorted vocabulary; new words wait in a short unsorted list until the
+    next search merges them in. Removed tracks stay in the postings, are
+    skipped by queries, and are compacted once they outnumber the rest.
+    
+    Not thread safe: the engine only touches it from its search thread.
+    """
+    
+    def __init__(self):
+        self.postings = {}  # word -> [Track]
+        self.prefixes = {}  # short prefix -> [Track]
+        self.vocabulary = []  # sorted words
+        self.new_words = []  # words not merged into the vocabulary yet
+        self.tracks = []  # live tracks in playlist order
+        self.order = {}  # Track -> playlist position
+        self.dead = 0
+        
+    def add_text(self, track, text):
+        """Index the words of text for track"""
+        postings = self.postings
+        words = set(SEARCH_WORD.findall(text.lower()))
+        for word in words:
+            entries = postings.get(word)
+            if entries is None:
+                postings[word] = [track]
+                self.new_words.append(word)
+            else:
+                entries.append(track)
+                
+        prefixes = self.prefixes
+        for prefix in {word[:length] for word in words for length in range(1, SEARCH_SHORT_PREFIX + 1)}:
+            entries = prefixes.get(prefix)
+            if entries is None:
+                prefixes[prefix] = [track]
+            else:
+                entries.append(track)
+                
+    def add(self, tracks):
+        """Index tracks appended to the playlist, by folder, file name and tags"""
+        order = self.order
+        for track in tracks:
+            order[track] = len(self.tracks)
+            self.tracks.append(track)
+            folder, name = os.path.split(track.path)
+            self.add_text(track, f"{os.path.basename(folder)} {os.path.splitext(name)[0]} {track.tag_text()}")
+            
+    def renumber(self, tracks, removed=0):
+        """Take the playlist order after tracks were moved or removed"""
+        self.tracks = tracks
+        self.order = order = {track: index for index, track in enumerate(tracks)}
+        self.dead += removed
+        if self.dead <= len(order):
+            return
+            
+        # Compact once most entries belong to removed tracks
+        for index in (self.postings, self.prefixes):
+            for key, entries in list(index.items()):
+                entries = [track for track in entries if track in order]
+                if entries:
+                    index[key] = entries
+                else:
+                    del index[key]
+        self.vocabulary = sorted(self.postings)
+        self.new_words.clear()
+        self.dead = 0
+        
+    def clear(self):
+        self.postings.clear()
+        self.prefixes.clear()
+        self.vocabulary.clear()
+        self.new_words.clear()
+        self.tracks = []
+        self.order.clear()
+        self.dead = 0
+        
+    def lookup(self, prefix):
+        """Return the tracks having a word that starts with prefix"""
+        if len(prefix) <= SEARCH_SHORT_PREFIX:
+            return self.prefixes.get(prefix, ())
+            
+        if len(self.new_words) > SEARCH_MERGE_SIZE:
+            # Two sorted runs: the sort merges them in linear time
+            self.new_words.sort()
+            self.vocabulary.extend(self.new_words)
+            self.vocabulary.sort()
+            self.new_words.clear()
+            
+        hits = set()
+        postings = self.postings
+        vocabulary = self.vocabulary
+        start = bisect.bisect_left(vocabulary, prefix)
+        stop = bisect.bisect_left(vocabulary, prefix + '\U0010ffff', start)
+        for word in islice(vocabulary, start, stop):
+            hits.update(postings[word])
+        for word in self.new_words:
+            if word.startswith(prefix):
+                hits.update(postings[word])
+        return hits
+        
+    def search(self, query):
+        """Return the tracks matching query in playlist order, None for an empty query"""
+        words = set(SEARCH_WORD.findall(query.lower()))
+        if not words:
+            return None
+            
+        # Start from the fewest candidates and narrow them down
+        found = sorted((self.lookup(word) for word in words), key=len)
+        hits = set(found[0])
+        for entries in found[1:]:
+            if not hits:
+                break
+            hits.intersection_update(entries)
+            
+        # Walking the playlist beats sorting when most of it matches
+        if len(hits) * 4 > len(self.tracks):
+            return list(compress(self.tracks, map(hits.__contains__, self.tracks)))
+        order = self.order
+        return sorted(filter(order.__contains__, hits), key=order.__getitem__)
+
+
+class PlaylistView:
+    """Virtualized playlist: a Canvas with a fixed pool of reused rows
+    
+    Only the rows that fit in the window exist as canvas items. Scrolling
+    just changes which tracks they show, so memory and redraw cost don't
+    depend on the playlist length.
+    """
+    
+    def __init__(self, parent, model, row_text, on_activate, font=("Arial", 9),
+                 bg='#16213e', fg='white', select_bg='#e94560',
+                 current_fg='#00d25b', height=6, is_dimmed=None, dimmed_fg='#6c757d'):
+        self.model = model  # anything with len() and [index]
+        self.row_text = row_text
+        self.is_dimmed = is_dimmed  # item -> True to draw its row in dimmed_fg
+        self.on_activate = on_activate
+        self.bg = bg
+        self.fg = fg
+        self.select_bg = select_bg
+        self.current_fg = current_fg
+        self.dimmed_fg = dimmed_fg
+        
+        self.font = tkfont.Font(font=font)
+        self.row_height = self.font.metrics('linespace') + 2
+        
+        self.top = 0  # first visible row
+        self.selected = None
+        self.current = None
+        self.pool = []  # (rect_id, text_id) per visible slot
+        self.shown = []  # last (text, fill, text_fill) drawn per slot
+        
+        self.scrollbar = ttk.Scrollbar(parent, command=self.yview)
+        self.scrollbar.pack(side='right', fill='y')
+        
+        self.canvas = tk.Canvas(
+            parent,
+            bg=bg,
+            height=height * self.row_height,
+            highlightthickness=0,
+            takefocus=1
+        )
+        self.canvas.pack(fill='both', expand=True)
+        
+        self.canvas.bind('<Configure>', self.on_resize)
+        self.canvas.bind('<Button-1>', self.on_click)
+        self.canvas.bind('<Double-1>', self.on_double_click)
+        self.canvas.bind('<MouseWheel>', self.on_wheel)
+        self.canvas.bind('<Button-4>', lambda event: self.scroll(-3))
+        self.canvas.bind('<Button-5>', lambda event: self.scroll(3))
+        self.canvas.bind('<Up>', lambda event: self.move_selection(-1))
+        self.canvas.bind('<Down>', lambda event: self.move_selection(1))
+        self.canvas.bind('<Prior>', lambda event: self.move_selection(-len(self.pool)))
+        self.canvas.bind('<Next>', lambda event: self.move_selection(len(self.pool)))
+        self.canvas.bind('<Return>', self.on_double_click)
+        
+    def bind(self, sequence, func):
+        self.canvas.bind(sequence, func)
+        
+    def visible_rows(self):
+        return len(self.pool)
+        
+    def on_resize(self, event=None):
+        """Grow or shrink the row pool to fill the canvas"""
+        width = self.canvas.winfo_width()
+        rows = max(1, self.canvas.winfo_height() // self.row_height + 1)
+        
+        while len(self.pool) < rows:
+            y = len(self.pool) * self.row_height
+            rect = self.canvas.create_rectangle(
+                0, y, width, y + self.row_height, fill=self.bg, width=0
+            )
+            text = self.canvas.create_text(
+                4, y + self.row_height // 2, anchor='w', font=self.font, fill=self.fg
+            )
+            self.pool.append((rect, text))
+            self.shown.append(None)
+        while len(self.pool) > rows:
+            rect, text = self.pool.pop()
+            self.shown.pop()
+            self.canvas.delete(rect, text)
+            
+        for slot, (rect, text) in enumerate(self.pool):
+            y = slot * self.row_height
+            self.canvas.coords(rect, 0, y, width, y + self.row_height)
+            
+        self.clamp_top()
+        self.redraw()
+        
+    def clamp_top(self):
+        page = max(1, self.canvas.winfo_height() // self.row_height)
+        self.top = max(0, min(self.top, len(self.model) - page))
+        
+    def redraw(self):
+        """Refresh every visible slot; items are touched only if they changed"""
+        for slot in range(len(self.pool)):
+            self.draw_slot(slot)
+        self.update_scrollbar()
+        
+    def draw_slot(self, slot):
+        row = self.top + slot
+        if row < len(self.model):
+            item = self.model[row]
+            text = self.row_text(item)
+            fill = self.select_bg if row == self.selected else self.bg
+            if row == self.current and row != self.selected:
+                text_fill = self.current_fg
+            elif self.is_dimmed is not None and self.is_dimmed(item):
+                text_fill = self.dimmed_fg
+            else:
+                text_fill = self.fg
+        else:
+            text, fill, text_fill = "", self.bg, self.fg
+            
+        state = (text, fill, text_fill)
+        if self.shown[slot] != state:
+            rect, text_id = self.pool[slot]
+            self.canvas.itemconfigure(rect, fill=fill)
+            self.canvas.itemconfigure(text_id, text=text, fill=text_fill)
+            self.shown[slot] = state
+            
+    def refresh(self):
+        """Redraw after the model changed size or order"""
+        self.clamp_top()
+        self.redraw()
+        
+    def refresh_row(self, row):
+        """Redraw a single row if it is on screen"""
+        slot = row - self.top
+        if 0 <= slot < len(self.pool):
+            self.draw_slot(slot)
+            
+    def update_scrollbar(self):
+        total = len(self.model)
+        if total == 0:
+            self.scrollbar.set(0, 1)
+            return
+        page = self.canvas.winfo_height() / self.row_height
+        self.scrollbar.set(self.top / total, min(1.0, (self.top + page) / total))
+        
+    def yview(self, *args):
+        """Scrollbar callback, same protocol as Listbox.yview"""
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * len(self.model))
+        elif args[0] == 'scroll':
+            amount = int(args[1])
+            if args[2] == 'pages':
+                amount *= max(1, len(self.pool) - 1)
+            self.top += amount
+        self.refresh()
+        
+    def scroll(self, rows):
+        self.top += rows
+        self.refresh()
+        
+    def on_wheel(self, event):
+        self.scroll(-3 if event.delta > 0 else 3)
+        
+    def row_at(self, y):
+        row = self.top + int(y // self.row_height)
+        return row if row < len(self.model) else None
+        
+    def on_click(self, event):
+        self.canvas.focus_set()
+        row = self.row_at(event.y)
+        if row is not None:
+            self.selection_set(row)
+            
+    def on_double_click(self, event):
+        if self.selected is not None:
+            self.on_activate(event)
+            
+    def move_selection(self, delta):
+        if not len(self.model):
+            return
+        row = 0 if self.selected is None else self.selected + delta
+        row = max(0, min(row, len(self.model) - 1))
+        self.selection_set(row)
+        self.see(row)
+        
+    # Listbox-compatible selection API
+    def curselection(self):
+        return () if self.selected is None else (self.selected,)
+        
+    def selection_set(self, row):
+        previous, self.selected = self.selected, row
+        if previous is not None:
+            self.refresh_row(previous)
+        self.refresh_row(row)
+        
+    def selection_clear(self):
+        previous, self.selected = self.selected, None
+        if previous is not None:
+            self.refresh_row(previous)
+            
+    def set_current(self, row):
+        """Mark the row of the playing track"""
+        previous, self.current = self.current, row
+        if previous is not None:
+            self.refresh_row(previous)
+        if row is not None:
+            self.refresh_row(row)
+            
+    def set_model(self, model, top=0):
+        """Show another list, e.g. search results"""
+        self.model = model
+        self.top = top
+        self.selected = None
+        self.current = None
+        self.refresh()
+        
+    def see(self, row):
+        """Scroll so that row is visible"""
+        page = max(1, self.canvas.winfo_height() // self.row_height)
+        if row < self.top:
+            self.top = row
+        elif row >= self.top + page:
+            self.top = row - page + 1
+        else:
+            return
+        self.refresh()
+
+
+class Histogram:
+    """Count, total, max and fixed log-spaced buckets of durations"""
+    
+    __slots__ = ('count', 'total', 'max', 'buckets')
+    
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(PERF_BUCKETS_MS) + 1)  # last one is overflow
+        
+    def add(self, ms):
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+        self.buckets[bisect.bisect_left(PERF_BUCKETS_MS, ms)] += 1
+        
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples"""
+        wanted = fraction * self.count
+        seen = 0
+        for bound, count in zip(PERF_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= wanted:
+                return min(bound, self.max)
+        return self.max
+        
+    def summary(self):
+        labels = [f"<={bound}" for bound in PERF_BUCKETS_MS] + [f">{PERF_BUCKETS_MS[-1]}"]
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else 0,
+            'max_ms': self.max,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'buckets_ms': {label: count for label, count in zip(labels, self.buckets) if count},
+        }
+
+
+class PerfStats:
+    """Opt-in timings of the hot paths and the main loop's lag
+    
+    Off by default, and then record() returns at once. When on, every
+    sample is a bisect into fixed buckets under a lock, and the lag monitor
+    wakes the main loop every LAG_PROBE_MS to see how late it runs.
+    """
+    
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+        
+    def enable(self, timers):
+        """Start collecting, with the lag monitor running on timers"""
+        if self.enabled:
+            return
+        self.enabled = True
+        self.started = time.perf_counter()
+        timers.after(LAG_PROBE_MS, self.heartbeat, timers, time.perf_counter() + LAG_PROBE_MS / 1000)
+        
+    def record(self, name, started):
+        """Add the time since started (a perf_counter value) to name's histogram"""
+        if self.enabled:
+            self.add_sample(name, time.perf_counter() - started)
+            
+    def add_sample(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(seconds * 1000)
+            
+    def count(self, name, amount=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+                
+    def heartbeat(self, timers, due):
+        """Lag monitor: how much later than asked the main loop ran us"""
+        lag = time.perf_counter() - due
+        self.add_sample('main loop lag', lag)
+        if lag > LATE_MS / 1000:
+            self.count('main loop late')
+        if self.enabled:
+            timers.after(LAG_PROBE_MS, self.heartbeat, timers, time.perf_counter() + LAG_PROBE_MS / 1000)
+            
+    def run_callback(self, name, due, callback, args):
+        """Run a timer callback, recording its lateness and duration"""
+        started = time.perf_counter()
+        if started - due > LATE_MS / 1000:
+            self.count('late callbacks')
+        try:
+            callback(*args)
+        finally:
+            self.record(f"after: {name}", started)
+            
+    def tick_lateness(self, lateness, interval):
+        """Count a position tick that ran late, or so late that whole ticks were lost"""
+        if lateness >= interval > 0:
+            self.count('ticks skipped', int(lateness // interval))
+        elif lateness > LATE_MS / 1000:
+            self.count('ticks late')
+            
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+            self.started = time.perf_counter()
+            
+    def snapshot(self):
+        with self.lock:
+            return {
+                'seconds': time.perf_counter() - self.started,
+                'histograms': {name: h.summary() for name, h in sorted(self.histograms.items())},
+                'counters': dict(sorted(self.counters.items())),
+            }
+            
+    def dump(self, path):
+        """Write a snapshot as JSON"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, indent=2)
+            
+    def report(self):
+        """Snapshot as text for the debug panel"""
+        snapshot = self.snapshot()
+        lines = [f"{'':28}{'count':>8}{'mean':>9}{'p95':>9}{'max':>9}  ms"]
+        for name, h in snapshot['histograms'].items():
+            lines.append(
+                f"{name[:27]:28}{h['count']:8}{h['mean_ms']:9.2f}{h['p95_ms']:9.2f}{h['max_ms']:9.2f}"
+            )
+        lines.append("")
+        for name, value in snapshot['counters'].items():
+            lines.append(f"{name:28}{value:8}")
+        lines.append(f"over {snapshot['seconds']:.0f} s")
+        return "\n".join(lines)
+
+
+PERF = PerfStats()
+
+
+class InstrumentedTimers:
+    """Wraps after()/after_cancel() so every callback is timed while PERF is on"""
+    
+    def __init__(self, timers):
+        self.timers = timers
+        
+    def after(self, ms, callback, *args):
+        if not PERF.enabled:
+            return self.timers.after(ms, callback, *args)
+        due = time.perf_counter() + ms / 1000
+        name = getattr(callback, '__name__', 'callback')
+        return self.timers.after(ms, PERF.run_callback, name, due, callback, args)
+        
+    def after_cancel(self, job):
+        self.timers.after_cancel(job)
+
+
+class PlaybackScheduler:
+    """Single owner of the engine's timers
+    
+    Nothing is scheduled while stopped or paused. While playing, a one-shot
+    timer fires at the expected end of the track instead of polling
+    get_busy(). The position tick only runs while someone displays it (see
+    PlayerEngine.set_progress_ticks) and is timed for the next moment the
+    displayed time or bar actually changes.
+    
+    SDL's music end event (set_endevent) is only delivered through the
+    pygame video subsystem, which would compete with Tk for the display, so
+    the end timer plays that role here.
+    """
+    
+    def __init__(self, engine):
+        self.engine = engine
+        self.timers = engine.timers
+        self.tick_job = None
+        self.tick_due = None  # perf_counter time the tick was planned for
+        self.tick_interval = 0
+        self.end_job = None
+        self.fade_job = None
+        
+    def cancel(self):
+        if self.tick_job is not None:
+            self.timers.after_cancel(self.tick_job)
+            self.tick_job = None
+        if self.end_job is not None:
+            self.timers.after_cancel(self.end_job)
+            self.end_job = None
+        if self.fade_job is not None:
+            self.timers.after_cancel(self.fade_job)
+            self.fade_job = None
+            
+    def reschedule(self):
+        """Re-plan timers after any change of playback or display state"""
+        self.cancel()
+        engine = self.engine
+        if not engine.is_playing or engine.is_paused:
+            return
+            
+        self.arm_end_timer()
+        if engine.crossfade > 0:
+            self.fade_job = self.timers.after(0, self.on_fade)
+        if engine.tick_width is not None:
+            self.schedule_tick(0)
+            
+    def schedule_tick(self, delay):
+        self.tick_due = time.perf_counter() + delay / 1000
+        self.tick_interval = max(delay, FRAME_MS) / 1000
+        self.tick_job = self.timers.after(delay, self.on_tick)
+            
+    def arm_end_timer(self):
+        remaining = self.engine.current_duration - self.engine.get_position()
+        delay = int(max(remaining, 0) * 1000) + END_RECHECK_MS
+        self.end_job = self.timers.after(min(delay, END_CHECK_MAX_MS), self.on_end_timer)
+        
+    def on_end_timer(self):
+        self.end_job = None
+        if not self.engine.check_music_end():
+            self.arm_end_timer()
+            
+    def on_fade(self):
+        """Ramp the volume in or out by the real position, then sleep until the next fade"""
+        self.fade_job = None
+        engine = self.engine
+        if not engine.is_playing or engine.is_paused or engine.crossfade <= 0:
+            return
+            
+        next_delay = engine.update_fade()
+        if next_delay is not None:
+            self.fade_job = self.timers.after(next_delay, self.on_fade)
+            
+    def on_tick(self):
+        self.tick_job = None
+        if PERF.enabled:
+            PERF.tick_lateness(time.perf_counter() - self.tick_due, self.tick_interval)
+        engine = self.engine
+        if not engine.is_playing or engine.is_paused or engine.tick_width is None:
+            return
+        engine.update_progress()
+        if self.tick_job is None and engine.is_playing and not engine.is_paused:
+            self.schedule_tick(self.next_tick_delay())
+        
+    def next_tick_delay(self):
+        """Milliseconds until the time label or progress bar would change"""
+        position = self.engine.get_position()
+        until_next_second = 1 - (position % 1)
+        
+        duration = self.engine.current_duration
+        bar_width = max(self.engine.tick_width or 1, 1)
+        per_pixel = duration / bar_width if duration > 0 else 1
+        
+        delay = int(min(until_next_second, per_pixel) * 1000) + 1
+        return max(FRAME_MS, min(delay, MAX_TICK_MS))
+
+
+class HeadlessTimers:
+    """Timer loop with the after()/after_cancel() interface of a Tk root
+    
+    Lets PlayerEngine run without a display. Callbacks run on the thread
+    that calls run(); after() may be called from any thread. Like Tk, an
+    exception in a callback is printed and the loop goes on.
+    """
+    
+    def __init__(self):
+        self.jobs = []  # heap of (due, sequence, callback, args)
+        self.scheduled = set()  # sequences of jobs not yet run or cancelled
+        self.sequence = 0
+        self.running = False
+        self.condition = threading.Condition()
+        
+    def after(self, ms, callback, *args):
+        with self.condition:
+            self.sequence += 1
+            due = time.monotonic() + ms / 1000
+            heapq.heappush(self.jobs, (due, self.sequence, callback, args))
+            self.scheduled.add(self.sequence)
+            self.condition.notify()
+            return self.sequence
+            
+    def after_cancel(self, job):
+        with self.condition:
+            # The job stays in the heap and is skipped when it comes due
+            self.scheduled.discard(job)
+            
+    def run(self):
+        """Run callbacks as they come due until quit() is called"""
+        self.running = True
+        while self.running:
+            with self.condition:
+                while self.running:
+                    if self.jobs:
+                        wait = self.jobs[0][0] - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self.condition.wait(wait)
+                    else:
+                        self.condition.wait()
+                if not self.running:
+                    break
+                _, sequence, callback, args = heapq.heappop(self.jobs)
+                if sequence not in self.scheduled:
+                    continue
+                self.scheduled.discard(sequence)
+            try:
+                callback(*args)
+            except Exception:
+                print("Error in timer callback:")
+                traceback.print_exc()
+            
+    def quit(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+
+class PlayerEngine:
+    """Playlist, playback state and everything that talks to the mixer
+    
+    Commands are plain method calls made on the timer thread (the Tk main
+    loop, or HeadlessTimers.run). Listeners added with subscribe() are
+    called as callback(event, *args) for:
+    
+        'track_changed'      a new current track started, or none is left
+        'state_changed'      state: 'playing', 'paused', 'stopped', 'finished'
+        'position'           position, duration in seconds
+        'playlist_changed'   reordered: True if tracks moved or left the playlist
+        'track_updated'      index of a track whose duration and tags arrived
+        'volume_changed'     volume from 0 to 1
+        'analysis_progress'  done, total files of a loudness analysis
+        'order_changed'      shuffle or repeat mode changed
+        'error'              message
+    """
+    
+    def __init__(self, timers):
+        self.timers = InstrumentedTimers(timers)
+        self.listeners = []
+        
+        # The mixer opens in the background so the window can show first
+        self.mixer_ready = threading.Event()
+        threading.Thread(target=self.init_mixer, daemon=True).start()
+        
+        # State variables
+        self.playlist = Playlist()
+        self.current_index = 0  # Current track index
+        self.current_file = None
+        self.current_duration = 0  # Duration in seconds
+        self.is_playing = False
+        self.is_paused = False
+        self.volume = 0.5
+        
+        # Persistent metadata cache
+        try:
+            self.metadata_cache = MetadataCache(
+                os.path.join(get_app_dir(), METADATA_CACHE_FILE)
+            )
+        except (OSError, sqlite3.Error) as e:
+            print(f"Metadata cache disabled: {e}")
+            self.metadata_cache = None
+            
+        # Play history, buffered and written by a probe worker
+        try:
+            self.play_stats = PlayStats(os.path.join(get_app_dir(), PLAY_STATS_FILE))
+        except (OSError, sqlite3.Error) as e:
+            print(f"Play history disabled: {e}")
+            self.play_stats = None
+        self.listening = None  # (path, duration) of the track being listened to
+        
+        # Background duration probing
+        self.probe_executor = ThreadPoolExecutor(
+            max_workers=PROBE_WORKERS,
+            thread_name_prefix="probe"
+        )
+        self.probe_results = queue.Queue()
+        self.probe_generation = 0  # bumped on clear to drop stale results
+        self.pending_probes = 0
+        self.probe_flush_scheduled = False
+        
+        # Type-ahead search, indexed and queried on one background thread
+        self.search_index = SearchIndex()
+        self.search_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search")
+        self.search_generation = 0  # bumped per query so stale ones are skipped
+        
+        # Gapless playback: the next track is queued behind the current one
+        self.gapless = False
+        self.crossfade = 0  # seconds, 0 = off
+        self.queued_track = None
+        
+        # Play order. The queue, history and shuffle state hold Tracks, not
+        # positions, and skip removed ones when they get to them, so removing
+        # tracks costs nothing here.
+        self.shuffle = False
+        self.repeat = 'off'  # 'off', 'all' or 'one'
+        self.up_next = deque()  # Tracks to play before the normal order continues
+        self.history = deque(maxlen=HISTORY_LENGTH)  # Tracks played before the current one
+        self.future = []  # Tracks Previous stepped back from, most recent last
+        self.order_track = None  # last track played in normal order, queued ones don't count
+        self.shuffle_order = None  # ShuffleOrder over the playlist, None = draw a new one
+        self.shuffle_played = set()  # Tracks played in this round of shuffle
+        self.shuffle_next = None  # Track drawn to play next
+        self.clock = PlaybackClock(lambda: self.music().get_pos())
+        self.fade_gain = 1.0
+        self.fading_in = False
+        
+        # Loudness normalization
+        self.gain_mode = 'off'
+        self.replay_gain = 1.0  # linear gain for the current track
+        self.analysis_executor = None  # process pool, created on first use
+        
+        # Duplicate detection
+        self.identities = {}  # (st_dev, st_ino) -> Track, from adds and probes
+        self.fingerprint_executor = None  # process pool for audio hashes, created on first use
+        self.analysis_results = queue.Queue()
+        self.analysis_total = 0
+        self.analysis_done = 0
+        self.analyzed = {}  # path -> values measured in the current batch
+        
+        # Seeking
+        self.music_source = None  # file object pygame is playing from, if any
+        self.seek_indexes = OrderedDict()  # path -> Mp3SeekIndex, most recent last
+        self.seek_index_jobs = set()
+        self.seek_index_lock = threading.Lock()
+        
+        # HTTP(S) tracks
+        self.connections = ConnectionPool()
+        self.stream_generation = 0  # bumped to drop a stream still connecting
+        self.connecting = False  # the current track is a stream that hasn't started yet
+        self.stream_underruns = 0  # of the streams played before the current one
+        
+        # Equalizer: plays through a DspPlayer instead of pygame.mixer.music while on
+        self.dsp = None
+        self.eq_gains = [0.0] * len(EQ_BANDS)  # dB per band
+        self.eq_preamp = 0.0  # dB
+        self.dsp_chain = None  # kept while off, so turning it on again is instant
+        
+        # Folder scanning
+        self.folder_index = FolderIndex(os.path.join(get_app_dir(), FOLDER_INDEX_FILE))
+        self.scan_results = queue.Queue()
+        self.active_scans = 0  # background scans, imports and checks feeding scan_results
+        
+        # Session restore
+        self.session_path = None  # autosaved while set
+        self.session_lock = threading.Lock()
+        self.session_save_scheduled = False
+        self.resume_at = None  # (path, seconds) to continue from on the first play
+        
+        # Timers run only while something is playing
+        self.tick_owners = {}  # who displays the position -> steps it needs
+        self.tick_width = None  # steps of the finest position display, None = no ticks
+        self.scheduler = PlaybackScheduler(self)
+        
+    def init_mixer(self):
+        """Import pygame and open the audio device, off the UI thread"""
+        try:
+            with STARTUP.phase("pygame.mixer.init"):
+                pygame.mixer.init()
+        except Exception as e:
+            print(f"Error initializing audio: {e}")
+        finally:
+            self.mixer_ready.set()
+            
+    def music(self):
+        """pygame's music player or the equalizer's, once the mixer is open"""
+        self.mixer_ready.wait()
+        if self.dsp is not None:
+            return self.dsp
+        return pygame.mixer.music
+        
+    def subscribe(self, callback):
+        """Call callback(event, *args) on every engine event"""
+        self.listeners.append(callback)
+        
+    def emit(self, event, *args):
+        for callback in self.listeners:
+            callback(event, *args)
+            
+    def set_progress_ticks(self, width, owner='window'):
+        """Send position events at a resolution of width steps, or stop owner's with None"""
+        if width is None:
+            self.tick_owners.pop(owner, None)
+        else:
+            self.tick_owners[owner] = width
+        self.tick_width = max(self.tick_owners.values(), default=None)
+        self.scheduler.reschedule()
+        
+    def get_audio_info(self, file_path, stat=None):
+        """Get stream info of audio file, using the metadata cache"""
+        if is_stream_url(file_path):
+            return self.get_stream_info(file_path)
+        try:
+            stat = stat or os.stat(file_path)
+            if self.metadata_cache is not None:
+                info = self.metadata_cache.lookup(file_path, stat.st_size, stat.st_mtime_ns)
+                if info is not None:
+                    return info
+                    
+            started = time.perf_counter()
+            info = probe_audio_info(file_path)
+            PERF.record('metadata probe', started)
+            replaygain = info.pop('replaygain')
+            if self.metadata_cache is not None:
+                self.metadata_cache.store(file_path, stat.st_size, stat.st_mtime_ns, info)
+                # Tagged files never need decoding for loudness
+                if replaygain is not None:
+                    self.metadata_cache.store_loudness(
+                        file_path, stat.st_size, stat.st_mtime_ns, replaygain
+                    )
+            return info
+        except Exception as e:
+            print(f"Error getting duration: {e}")
+            return None
+        
+    def get_stream_info(self, url):
+        """Read the stream info of a remote file from its first and last bytes
+        
+        Live streams have no duration and are named after the station.
+        """
+        try:
+            with HttpStream(
+                url, self.connections, readahead=STREAM_PROBE_READAHEAD, block=STREAM_PROBE_READAHEAD
+            ) as stream:
+                if stream.length is None:
+                    return {
+                        'duration': 0,
+                        'sample_rate': 0,
+                        'channels': 0,
+                        'bitrate': 0,
+                        'title': stream.station,
+                        'artist': None,
+                        'album': None,
+                    }
+                started = time.perf_counter()
+                info = probe_audio_info(url, stream)
+                PERF.record('metadata probe', started)
+        except Exception as e:
+            print(f"Error getting duration: {e}")
+            return None
+        info.pop('replaygain')
+        return info
+        
+    def get_audio_duration(self, file_path):
+        """Get duration of audio file in seconds"""
+        info = self.get_audio_info(file_path)
+        return info['duration'] if info else 0
+        
+    def probe_worker(self, file_paths, generation, warm=False):
+        """Probe a chunk of files in a worker thread and queue the results"""
+        for file_path in file_paths:
+            if generation != self.probe_generation:
+                return
+            if warm:
+                # Pull the start of the file into the OS cache
+                try:
+                    with open(file_path, 'rb') as f:
+                        f.read(PREFETCH_BYTES)
+                except OSError:
+                    pass
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                stat = None
+            identity = None if stat is None else (stat.st_dev, stat.st_ino)
+            info = self.get_audio_info(file_path, stat)
+            # The next track's gain is ready before it starts
+            loudness = (self.lookup_loudness(file_path) or False) if warm else None
+            self.probe_results.put((generation, file_path, info, identity, loudness))
+        
+    def queue_probes(self, file_paths, warm=False):
+        """Start background probing for files added to the playlist"""
+        generation = self.probe_generation
+        for start in range(0, len(file_paths), PROBE_CHUNK_SIZE):
+            chunk = file_paths[start:start + PROBE_CHUNK_SIZE]
+            self.probe_executor.submit(self.probe_worker, chunk, generation, warm)
+        self.pending_probes += len(file_paths)
+        
+        if not self.probe_flush_scheduled:
+            self.probe_flush_scheduled = True
+            self.timers.after(PROBE_BATCH_INTERVAL, self.flush_probe_results)
+        
+    def flush_probe_results(self):
+        """Apply a batch of probe results to the playlist on the timer thread"""
+        self.probe_flush_scheduled = False
+        deadline = time.perf_counter() + PROBE_BATCH_BUDGET
+        tagged = []
+        duplicates = []
+        
+        while time.perf_counter() < deadline:
+            try:
+                generation, file_path, info, identity, loudness = self.probe_results.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self.probe_generation:
+                continue
+            self.pending_probes -= 1
+            
+            track = self.playlist.get(file_path)
+            if track is not None:
+                if info is None:
+                    track.duration = 0
+                else:
+                    track.duration = info['duration']
+                    if track.set_tags(info):
+                        tagged.append(track)
+                if loudness is not None:
+                    track.loudness = loudness
+                if file_path == self.current_file:
+                    # Streams start before their duration is known
+                    self.current_duration = track.duration
+                self.emit('track_updated', self.playlist.index_of(file_path))
+                if identity is not None and self.is_same_file(track, identity):
+                    duplicates.append(file_path)
+        self.index_tags(tagged)
+        if duplicates:
+            self.remove_paths(duplicates)
+        
+        # Keep flushing only while there is work in flight
+        if self.pending_probes > 0 or not self.probe_results.empty():
+            self.probe_flush_scheduled = True
+            self.timers.after(PROBE_BATCH_INTERVAL, self.flush_probe_results)
+        elif self.metadata_cache is not None:
+            self.probe_executor.submit(self.metadata_cache.flush)
+        
+    def open_paths(self, paths, play_now=False):
+        """Add files and folders, e.g. from the command line
+        
+        With play_now the first file starts playing even if another track is.
+        """
+        file_paths = []
+        for path in paths:
+            if is_stream_url(path):
+                file_paths.append(path)
+            elif os.path.isdir(path):
+                self.scan_folder(path)
+            elif path.lower().endswith(PLAYLIST_EXTENSIONS):
+                self.import_playlist(path)
+            else:
+                file_paths.append(os.path.abspath(path))
+        if file_paths:
+            self.add_files(file_paths)
+            index = self.playlist.index_of(file_paths[0])
+            if play_now and index is not None and not (self.is_playing and index == self.current_index):
+                self.play(index)
+        
+    def start_scan(self, target, *args):
+        """Run a worker thread that feeds scan_results, flushing them while any run"""
+        self.active_scans += 1
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        if self.active_scans == 1:
+            self.timers.after(PROBE_BATCH_INTERVAL, self.flush_scan_results)
+            
+    def scan_folder(self, folder, only_new=False):
+        """Walk a folder in a background thread, streaming files into the playlist"""
+        self.start_scan(self.scan_worker, folder, only_new)
+        
+    def import_playlist(self, playlist_path):
+        """Stream an M3U/M3U8/PLS file into the playlist in a background thread"""
+        self.start_scan(self.playlist_worker, playlist_path)
+        
+    def playlist_worker(self, playlist_path):
+        """Read a playlist file and queue its entries with their known durations"""
+        generation = self.probe_generation
+        paths = []
+        durations = {}
+        known = []  # paths that skip probing, checked afterwards
+        try:
+            for file_path, duration in read_playlist_file(playlist_path):
+                paths.append(file_path)
+                if duration is not None:
+                    durations[file_path] = duration
+                    known.append(file_path)
+                if len(paths) >= SCAN_CHUNK_SIZE:
+                    self.scan_results.put(('import', (paths, durations)))
+                    paths = []
+                    durations = {}
+            if paths:
+                self.scan_results.put(('import', (paths, durations)))
+            self.check_paths(known, generation)
+        except OSError as e:
+            self.scan_results.put(('error', f"Failed to read playlist:\n{e}"))
+        finally:
+            self.scan_results.put(('done', None))
+            
+    def export_playlist(self, playlist_path):
+        """Write the playlist as M3U8, or PLS if playlist_path ends in .pls"""
+        entries = [(track.path, track.duration) for track in self.playlist]
+        try:
+            write_playlist_file(playlist_path, entries)
+        except OSError as e:
+            self.emit('error', f"Failed to save playlist:\n{e}")
+            
+    def check_worker(self, paths, generation):
+        """Run check_paths in a background thread"""
+        try:
+            self.check_paths(paths, generation)
+        finally:
+            self.scan_results.put(('done', None))
+            
+    def check_paths(self, paths, generation):
+        """Flag missing files and look up cached tags of tracks that weren't probed"""
+        missing = []
+        tagged = []
+        for file_path in paths:
+            if generation != self.probe_generation:
+                return
+            if is_stream_url(file_path):
+                continue
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                missing.append(file_path)
+                if len(missing) >= SCAN_CHUNK_SIZE:
+                    self.scan_results.put(('missing', missing))
+                    missing = []
+                continue
+                
+            if self.metadata_cache is not None:
+                info = self.metadata_cache.lookup(file_path, stat.st_size, stat.st_mtime_ns)
+                if info is not None:
+                    tagged.append((file_path, info))
+                    if len(tagged) >= SCAN_CHUNK_SIZE:
+                        self.scan_results.put(('tags', tagged))
+                        tagged = []
+        if missing:
+            self.scan_results.put(('missing', missing))
+        if tagged:
+            self.scan_results.put(('tags', tagged))
+            
+    def mark_missing(self, paths):
+        """Flag tracks whose files weren't found; they stay, in case the drive comes back"""
+        for file_path in paths:
+            track = self.playlist.get(file_path)
+            if track is not None:
+                track.missing = True
+        self.emit('playlist_changed', False)
+        
+    def apply_cached_tags(self, entries):
+        """Set tags found by check_worker"""
+        tagged = []
+        for file_path, info in entries:
+            track = self.playlist.get(file_path)
+            if track is not None and track.set_tags(info):
+                tagged.append(track)
+        self.index_tags(tagged)
+        
+    def index_tags(self, tracks):
+        """Add the tags of tracks to the search index"""
+        if tracks:
+            self.search_executor.submit(self.index_tags_worker, tracks)
+            
+    def index_tags_worker(self, tracks):
+        for track in tracks:
+            self.search_index.add_text(track, track.tag_text())
+            
+    def reindex(self, removed=0):
+        """Give the search index the playlist order after a move or removal"""
+        self.search_executor.submit(self.search_index.renumber, self.playlist.tracks[:], removed)
+        
+    def search(self, query, callback):
+        """Find tracks in the background, calling callback(query, tracks) on the timer thread
+        
+        Matches are the tracks whose file name, folder or tags contain a word
+        starting with each word of query, in playlist order. Only the latest
+        query is answered when several are waiting.
+        """
+        self.search_generation += 1
+        self.search_executor.submit(self.search_worker, query, self.search_generation, callback)
+        
+    def search_worker(self, query, generation, callback):
+        if generation != self.search_generation:
+            return
+        started = time.perf_counter()
+        matches = self.search_index.search(query)
+        if matches is None:
+            matches = self.search_index.tracks[:]
+        PERF.record('search', started)
+        self.timers.after(0, callback, query, matches)
+        
+    def rescan_folders(self):
+        """Pick up changes in every previously added folder"""
+        for folder in self.folder_index.folders():
+            self.scan_folder(folder, only_new=True)
+        
+    def scan_worker(self, folder, only_new):
+        """Scan a folder tree and queue found files in chunks"""
+        removed = []
+        chunk = []
+        try:
+            for file_path in self.folder_index.scan(folder, only_new, removed):
+                chunk.append(file_path)
+                if len(chunk) >= SCAN_CHUNK_SIZE:
+                    self.scan_results.put(('add', chunk))
+                    chunk = []
+            if chunk:
+                self.scan_results.put(('add', chunk))
+            if removed:
+                self.scan_results.put(('remove', removed))
+            self.folder_index.save()
+        except OSError as e:
+            print(f"Error scanning folder: {e}")
+        finally:
+            self.scan_results.put(('done', None))
+        
+    def flush_scan_results(self):
+        """Feed scanned files into the playlist on the timer thread"""
+        deadline = time.perf_counter() + PROBE_BATCH_BUDGET
+        while time.perf_counter() < deadline:
+            try:
+                action, payload = self.scan_results.get_nowait()
+            except queue.Empty:
+                break
+            if action == 'add':
+                self.add_files(payload)
+            elif action == 'import':
+                self.add_files(*payload)
+            elif action == 'remove':
+                self.remove_paths(payload)
+            elif action == 'missing':
+                self.mark_missing(payload)
+            elif action == 'tags':
+                self.apply_cached_tags(payload)
+            elif action == 'error':
+                self.emit('error', payload)
+            else:
+                self.active_scans -= 1
+                
+        if self.active_scans > 0 or not self.scan_results.empty():
+            self.timers.after(PROBE_BATCH_INTERVAL, self.flush_scan_results)
+        
+    def add_files(self, file_paths, durations=None):
+        """Add files to playlist, probing durations in the background
+        
+        durations maps paths to seconds already known, e.g. from #EXTINF.
+        """
+        first_new = len(self.playlist)
+        identities = {}
+        if len(file_paths) <= DUPLICATE_SYNC_LIMIT:
+            file_paths, identities = self.drop_same_files(file_paths)
+        new_tracks = self.playlist.extend(file_paths)
+        for identity, file_path in identities.items():
+            self.identities[identity] = self.playlist.get(file_path)
+        if self.shuffle_order is not None:
+            self.shuffle_order.grow(len(self.playlist))
+        
+        if not new_tracks:
+            return
+        self.search_executor.submit(self.search_index.add, new_tracks)
+        
+        # Rows show a placeholder until the duration arrives
+        if durations:
+            for track in new_tracks:
+                track.duration = durations.get(track.path)
+        self.emit('playlist_changed', False)
+        self.queue_probes([track.path for track in new_tracks if track.duration is None])
+        
+        # If nothing is playing, start first added file
+        if not self.is_playing and not self.connecting:
+            self.play(first_new)
+        elif self.queued_track is None:
+            self.prepare_next()
+            
+    def drop_same_files(self, file_paths):
+        """Leave out files already in the playlist under another path
+        
+        Returns the remaining paths and the (st_dev, st_ino) of the new ones.
+        Large adds skip this and are checked as their durations are probed.
+        """
+        kept = []
+        found = {}
+        for file_path in file_paths:
+            if file_path in self.playlist:
+                continue
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                kept.append(file_path)
+                continue
+            identity = (stat.st_dev, stat.st_ino)
+            track = self.identities.get(identity)
+            if identity in found or (track is not None and self.playlist.holds(track)):
+                continue
+            found[identity] = file_path
+            kept.append(file_path)
+        return kept, found
+        
+    def is_same_file(self, track, identity):
+        """Remember a probed track's identity, return True if another track has it"""
+        other = self.identities.get(identity)
+        if other is None or other is track or not self.playlist.holds(other):
+            self.identities[identity] = track
+            return False
+        # Never pull the playing track from under the listener
+        return track.path != self.current_file
+        
+    def find_duplicates(self, callback, full=False):
+        """Group the playlist's duplicates in a background thread
+        
+        Calls callback(groups) on the timer thread, with groups a list of
+        (reason, paths) in playlist order. Each check only runs where the
+        cheaper one before it can't tell: the same file under several paths
+        ('same file'), then equal size and start and end bytes ('same
+        content'), then with full the audio data without tags, hashed in a
+        process pool ('same audio').
+        """
+        entries = [(track.path, track.duration) for track in self.playlist]
+        thread = threading.Thread(target=self.duplicates_worker, args=(entries, full, callback), daemon=True)
+        thread.start()
+        
+    def duplicates_worker(self, entries, full, callback):
+        started = time.perf_counter()
+        groups = {}  # representative path -> [reason, paths]
+        files = {}  # representative path -> (size, mtime_ns, duration)
+        by_identity = {}
+        for file_path, duration in entries:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            identity = (stat.st_dev, stat.st_ino)
+            first = by_identity.setdefault(identity, file_path)
+            if first == file_path:
+                groups[file_path] = [None, [file_path]]
+                files[file_path] = (stat.st_size, stat.st_mtime_ns, duration)
+            else:
+                groups[first][0] = 'same file'
+                groups[first][1].append(file_path)
+                
+        def merge(representatives, reason):
+            first = representatives[0]
+            for other in representatives[1:]:
+                groups[first][1].extend(groups.pop(other)[1])
+            groups[first][0] = reason
+            
+        # Equal sizes are rare, and only they need reading
+        by_size = {}
+        for file_path, (size, _, _) in files.items():
+            by_size.setdefault(size, []).append(file_path)
+        candidates = [path for paths in by_size.values() if len(paths) > 1 for path in paths]
+        for paths in self.group_by_hash(candidates, files, 'partial').values():
+            merge(paths, 'same content')
+            
+        if full:
+            # Retagging changes the size, not the duration
+            by_duration = {}
+            for file_path in groups:
+                duration = files[file_path][2]
+                if duration:
+                    by_duration.setdefault(round(duration / DUPLICATE_DURATION_STEP), []).append(file_path)
+            candidates = [path for paths in by_duration.values() if len(paths) > 1 for path in paths]
+            try:
+                for paths in self.group_by_hash(candidates, files, 'payload').values():
+                    merge(paths, 'same audio')
+            except Exception as e:
+                print(f"Error comparing audio: {e}")
+                
+        result = [(reason, paths) for reason, paths in groups.values() if len(paths) > 1]
+        PERF.record('find duplicates', started)
+        self.timers.after(0, callback, result)
+        
+    def group_by_hash(self, file_paths, files, column):
+        """Hash files ('partial' or 'payload'), using the cache; return groups of equal ones"""
+        digests = {}
+        missing = []
+        for file_path in file_paths:
+            size, mtime_ns, _ = files[file_path]
+            digest = None
+            if self.metadata_cache is not None:
+                digest = self.metadata_cache.lookup_fingerprint(file_path, size, mtime_ns, column)
+            if digest is None:
+                missing.append(file_path)
+            else:
+                digests[file_path] = digest
+                
+        if column == 'partial':
+            computed = []
+            for file_path in missing:
+                try:
+                    computed.append((file_path, partial_hash(file_path, files[file_path][0])))
+                except OSError as e:
+                    print(f"Error hashing file: {e}")
+        elif missing:
+            if self.fingerprint_executor is None:
+                self.fingerprint_executor = ProcessPoolExecutor(
+                    max_workers=os.cpu_count() or 2,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            computed = list(self.fingerprint_executor.map(audio_payload_hash, missing, chunksize=16))
+        else:
+            computed = []
+            
+        computed = [(path, digest) for path, digest in computed if digest is not None]
+        digests.update(computed)
+        if self.metadata_cache is not None and computed:
+            self.metadata_cache.store_fingerprints(
+                column, [(path,) + files[path][:2] + (digest,) for path, digest in computed]
+            )
+            
+        by_digest = {}
+        for file_path in file_paths:
+            if file_path in digests:
+                by_digest.setdefault(digests[file_path], []).append(file_path)
+        return {digest: paths for digest, paths in by_digest.items() if len(paths) > 1}
+        
+    def play_current(self):
+        """Play the current track from playlist"""
+        if self.playlist and 0 <= self.current_index < len(self.playlist):
+            self.end_listen()
+            self.set_current_track(self.playlist[self.current_index])
+            resume_at, self.resume_at = self.resume_at, None
+            if is_stream_url(self.current_file):
+                self.connect_stream(resume_at)
+                return
+                
+            try:
+                self.start_playback(self.current_file)
+            except Exception as e:
+                self.emit('error', f"Failed to play file:\n{e}")
+                return
+            track = self.playlist[self.current_index]
+            if track.missing:
+                # The file is back, e.g. its drive was mounted after the check
+                track.missing = False
+                self.emit('track_updated', self.current_index)
+            self.resume_session(resume_at)
+            
+    def start_playback(self, source, namehint=""):
+        """Load source and play it from the start as the current track"""
+        self.load_music(source, namehint)
+        self.fade_gain = 1.0
+        self.fading_in = False
+        self.apply_volume()
+        self.music().play()
+        self.clock.restart()
+        self.track_started()
+        
+    def resume_session(self, resume_at):
+        """The first play after a restore continues where the session left off"""
+        if resume_at is not None and resume_at[0] == self.current_file and resume_at[1] > 0:
+            self.seek(resume_at[1])
+            
+    def connect_stream(self, resume_at):
+        """Stop, then play the current track's URL once its first bytes are buffered"""
+        self.stream_generation += 1
+        self.connecting = True
+        self.abort_stream()
+        self.music().stop()
+        self.queued_track = None
+        self.is_playing = False
+        self.is_paused = False
+        self.emit('state_changed', 'buffering')
+        self.scheduler.reschedule()
+        thread = threading.Thread(
+            target=self.stream_worker,
+            args=(self.current_file, self.stream_generation, resume_at),
+            daemon=True
+        )
+        thread.start()
+        
+    def stream_worker(self, url, generation, resume_at):
+        """Connect and prefill in a background thread, then hand the stream to the timer thread"""
+        started = time.perf_counter()
+        try:
+            stream = self.open_stream(url)
+            if self.dsp is not None and stream.length is None:
+                stream.close()
+                raise OSError("Live streams can't play through the equalizer")
+            stream.wait_buffered(STREAM_PREFILL)
+        except Exception as e:
+            self.timers.after(0, self.stream_failed, generation, e)
+            return
+        PERF.record('stream start', started)
+        self.timers.after(0, self.stream_ready, generation, stream, resume_at)
+        
+    def stream_ready(self, generation, stream, resume_at):
+        if generation != self.stream_generation:
+            stream.close()
+            return
+        self.connecting = False
+        try:
+            self.start_playback(stream, stream.namehint)
+        except Exception as e:
+            self.emit('error', f"Failed to play stream:\n{e}")
+            self.emit('state_changed', 'stopped')
+            return
+        self.resume_session(resume_at)
+        
+    def stream_failed(self, generation, error):
+        if generation == self.stream_generation:
+            self.connecting = False
+            self.emit('error', f"Failed to play stream:\n{error}")
+            self.emit('state_changed', 'stopped')
+            
+    def open_stream(self, url, offset=0):
+        """HttpStream of url for playback, passing ICY titles to the playlist"""
+        return HttpStream(
+            url,
+            self.connections,
+            offset,
+            on_title=lambda title: self.timers.after(0, self.set_stream_title, url, title)
+        )
+        
+    def set_stream_title(self, url, title):
+        """Show what a radio station is playing now, from its ICY metadata"""
+        track = self.playlist.get(url)
+        if track is None or not title:
+            return
+        artist, separator, song = title.partition(" - ")
+        track.artist, track.title = (artist, song) if separator else (None, title)
+        self.index_tags([track])
+        self.emit('track_updated', self.playlist.index_of(url))
+        
+    def abort_stream(self):
+        """Make a stream read that waits for the network give up
+        
+        pygame reads with the mixer locked, so stopping or replacing the
+        music would otherwise wait for the network too.
+        """
+        if isinstance(self.music_source, HttpStream):
+            self.music_source.abort()
+            
+    def stream_stalled(self):
+        """True while the decoder waits for data from the network"""
+        return isinstance(self.music_source, HttpStream) and self.music_source.stalled
+        
+    def buffer_underruns(self):
+        """Reads of all streams played so far that had to wait for the network"""
+        current = self.music_source.underruns if isinstance(self.music_source, HttpStream) else 0
+        return self.stream_underruns + current
+                
+    def set_current_track(self, track):
+        """Make track the current one"""
+        self.current_file = track.path
+        
+        # Get duration, probing now only if the background probe hasn't finished
+        if track.duration is None and not is_stream_url(track.path):
+            info = self.get_audio_info(self.current_file)
+            track.duration = info['duration'] if info else 0
+            if info and track.set_tags(info):
+                self.index_tags([track])
+        self.current_duration = track.duration or 0
+        
+    def track_started(self):
+        """Announce the current track once it is audible"""
+        self.is_playing = True
+        self.is_paused = False
+        self.listening = (self.current_file, self.current_duration)
+        self.emit('track_changed')
+        self.emit('state_changed', 'playing')
+        
+        # Reset progress
+        self.set_progress(0, 0)
+        
+        self.update_replay_gain()
+        self.prepare_next()
+        self.request_seek_index(self.current_file)
+        self.scheduler.reschedule()
+        
+    def load_music(self, source, namehint=""):
+        """Load a path or file object into the mixer, closing the previous source"""
+        started = time.perf_counter()
+        self.abort_stream()
+        if isinstance(source, str):
+            self.music().load(source)
+        else:
+            self.music().load(source, namehint)
+        PERF.record('track load', started)
+        # Loading drops whatever was queued
+        self.queued_track = None
+        
+        if self.music_source is not None:
+            if isinstance(self.music_source, HttpStream):
+                self.stream_underruns += self.music_source.underruns
+            self.music_source.close()
+        self.music_source = None if isinstance(source, str) else source
+        
+    def request_seek_index(self, file_path):
+        """Return the seek index of an MP3 if ready, otherwise start building it"""
+        if os.path.splitext(file_path)[1].lower() != '.mp3' or is_stream_url(file_path):
+            return None
+        with self.seek_index_lock:
+            index = self.seek_indexes.get(file_path)
+            if index is not None:
+                self.seek_indexes.move_to_end(file_path)
+                return index
+            if file_path in self.seek_index_jobs:
+                return None
+            self.seek_index_jobs.add(file_path)
+        self.probe_executor.submit(self.seek_index_worker, file_path)
+        return None
+        
+    def seek_index_worker(self, file_path):
+        """Load a seek index from disk or scan the file, in a worker thread"""
+        index = None
+        try:
+            index_dir = os.path.join(get_app_dir(), SEEK_INDEX_DIR)
+            os.makedirs(index_dir, exist_ok=True)
+            index_path = os.path.join(index_dir, file_cache_key(file_path) + ".idx")
+            try:
+                index = Mp3SeekIndex.load(index_path)
+            except (OSError, struct.error, EOFError):
+                index = None
+            if index is None:
+                # Missing or corrupt: scan again and replace the file
+                index = Mp3SeekIndex.build(file_path)
+                if index is not None:
+                    index.save(index_path)
+        except (OSError, ValueError) as e:
+            print(f"Error building seek index: {e}")
+            
+        with self.seek_index_lock:
+            self.seek_index_jobs.discard(file_path)
+            if index is not None:
+                self.seek_indexes[file_path] = index
+                while len(self.seek_indexes) > SEEK_INDEX_MEMORY:
+                    self.seek_indexes.popitem(last=False)
+        
+    def seek(self, position):
+        """Jump to position seconds in the current track"""
+        started = time.perf_counter()
+        if not self.seekable():
+            return
+        stream = self.music_source if isinstance(self.music_source, HttpStream) else None
+        position = max(0, min(position, self.current_duration))
+        # The equalizer seeks in decoded samples and needs no index
+        index = self.request_seek_index(self.current_file) if self.dsp is None else None
+        
+        try:
+            if index is not None:
+                # Restart the decoder on the exact frame boundary
+                offset, position = index.locate(position)
+                self.load_music(FileSlice(self.current_file, offset), 'mp3')
+                self.apply_volume()
+                self.music().play()
+            elif stream is not None and stream.namehint == 'mp3' and self.dsp is None:
+                # No index for remote MP3s: request the same share of the file, the
+                # decoder syncs to the next frame
+                offset = int(stream.length * position / self.current_duration)
+                self.load_music(self.open_stream(self.current_file, offset), 'mp3')
+                self.apply_volume()
+                self.music().play()
+            else:
+                if isinstance(self.music_source, FileSlice):
+                    # An earlier indexed seek left a slice loaded; play(start=) would count from its offset
+                    self.load_music(self.current_file)
+                    self.apply_volume()
+                self.music().play(start=position)
+        except Exception as e:
+            print(f"Error seeking: {e}")
+            return
+            
+        self.clock.restart(position)
+        if self.is_paused:
+            self.music().pause()
+        if self.queued_track is None:
+            self.prepare_next()
+        PERF.record('seek', started)
+        self.set_progress(position, self.current_duration)
+        self.scheduler.reschedule()
+        
+    def seekable(self):
+        """False for live streams and while the current track's duration is unknown"""
+        if not self.current_duration:
+            return False
+        return not isinstance(self.music_source, HttpStream) or self.music_source.length is not None
+        
+    def prepare_next(self):
+        """Resolve and warm up the next track, and queue it for gapless playback"""
+        if not self.is_playing:
+            return
+        track = self.peek_next(ended=True)
+        if track is None:
+            return
+        
+        # Metadata and the first buffers are loaded off the UI thread
+        stream = is_stream_url(track.path)
+        if not stream or track.duration is None:
+            self.queue_probes([track.path], warm=True)
+            
+        # Streams connect when they start, so they can't be queued
+        if (self.gapless or self.crossfade > 0) and self.queued_track is None and not stream:
+            try:
+                self.music().queue(track.path)
+                self.queued_track = track
+            except Exception as e:
+                print(f"Error queueing next track: {e}")
+        
+    def requeue(self):
+        """Queue the track that now comes next in place of the one queued before"""
+        if self.queued_track is None:
+            return
+        track = self.peek_next(ended=True)
+        if track is not None and track is not self.queued_track:
+            # Queueing replaces what pygame had queued
+            self.queued_track = None
+            self.prepare_next()
+            
+    def advance_to_queued(self):
+        """The queued track took over from the one that just ended"""
+        track, self.queued_track = self.queued_track, None
+        self.end_listen(ended=True)
+        if not self.playlist.holds(track):
+            # Removed while queued, so don't let it keep playing
+            self.stop()
+            self.advance(ended=True)
+            return
+            
+        self.take(track)
+        self.move_to(track)
+        self.set_current_track(track)
+        self.fading_in = self.crossfade > 0
+        self.track_started()
+        
+    def play(self, index):
+        """Play the track at index"""
+        # Choosing a track starts a new path: Next no longer retraces Previous
+        self.future.clear()
+        track = self.playlist[index]
+        self.order_track = track
+        self.move_to(track)
+        self.play_current()
+        
+    def prev_track(self):
+        """Play the track played before this one, or the one above it"""
+        if not self.playlist:
+            return
+        track = self.pop_live(self.history)
+        if track is None:
+            track = self.playlist[(self.current_index - 1) % len(self.playlist)]
+        self.move_to(track, back=True)
+        self.play_current()
+        
+    def next_track(self):
+        """Play next track"""
+        if self.playlist:
+            self.advance()
+            
+    def advance(self, ended=False):
+        """Play the next track in play order, return False if there is none"""
+        track = self.peek_next(ended)
+        if track is None:
+            return False
+        self.take(track)
+        self.move_to(track)
+        self.play_current()
+        return True
+        
+    def pop_live(self, tracks):
+        """Pop the last track still in the playlist off tracks, or return None"""
+        while tracks:
+            track = tracks.pop()
+            if self.playlist.holds(track):
+                return track
+        return None
+        
+    def peek_next(self, ended=False):
+        """The track that plays after the current one, or None
+        
+        ended: the current track finished by itself, so repeat-one replays
+        it and the end of the order stops playback unless repeat is 'all'.
+        Pressing Next wraps around as it always has.
+        """
+        current = self.playlist.get(self.current_file) if self.current_file else None
+        if ended and self.repeat == 'one' and current is not None:
+            return current
+        while self.future and not self.playlist.holds(self.future[-1]):
+            self.future.pop()
+        if self.future:
+            return self.future[-1]
+        while self.up_next and not self.playlist.holds(self.up_next[0]):
+            self.up_next.popleft()
+        if self.up_next:
+            return self.up_next[0]
+        wrap = not ended or self.repeat == 'all'
+        if self.shuffle:
+            return self.peek_shuffle(current, wrap)
+            
+        # Queued tracks are a detour: the order continues after the last regular one
+        anchor = self.order_track
+        if anchor is not None and self.playlist.holds(anchor):
+            index = self.playlist.index_of(anchor.path)
+        else:
+            index = self.current_index
+        index += 1
+        if index >= len(self.playlist):
+            if not wrap or not self.playlist:
+                return None
+            index = 0
+        return self.playlist[index]
+        
+    def peek_shuffle(self, current, wrap):
+        """Draw the next shuffled track not played in this round"""
+        if self.shuffle_next is not None and self.playlist.holds(self.shuffle_next):
+            return self.shuffle_next
+        self.shuffle_next = None
+        if not self.playlist:
+            return None
+        for _ in range(2):
+            if self.shuffle_order is None:
+                self.shuffle_order = ShuffleOrder(len(self.playlist))
+            order = self.shuffle_order
+            while order.remaining():
+                track = self.playlist[order.draw()]
+                if track not in self.shuffle_played and track is not current:
+                    self.shuffle_next = track
+                    return track
+            if not wrap:
+                return None
+            # Every track had its turn, start a new round
+            self.shuffle_played.clear()
+            self.shuffle_order = None
+        return current
+        
+    def take(self, track):
+        """Consume track from wherever peek_next() found it"""
+        if self.future and self.future[-1] is track:
+            self.future.pop()
+        elif self.up_next and self.up_next[0] is track:
+            self.up_next.popleft()
+            return
+        if track is self.shuffle_next:
+            self.shuffle_next = None
+        self.order_track = track
+        
+    def move_to(self, track, back=False):
+        """Make track the current one for play_current(), recording the one it replaces"""
+        previous = self.playlist.get(self.current_file) if self.current_file else None
+        if previous is not None and previous is not track:
+            if back:
+                self.future.append(previous)
+            else:
+                self.history.append(previous)
+        if back or self.order_track is None or not self.playlist.holds(self.order_track):
+            # Previous, or the order lost its place: continue from here
+            self.order_track = track
+        if self.shuffle:
+            self.shuffle_played.add(track)
+        self.current_index = self.playlist.index_of(track.path)
+        
+    def play_next(self, indexes):
+        """Queue the tracks at indexes to play after the current one, in order"""
+        self.up_next.extend(self.playlist[index] for index in indexes)
+        self.requeue()
+        if self.is_playing and self.queued_track is None:
+            self.prepare_next()
+            
+    def set_shuffle(self, enabled):
+        """Turn shuffle on or off; a new round starts each time it is turned on"""
+        self.shuffle = enabled
+        self.shuffle_order = None
+        self.shuffle_next = None
+        self.shuffle_played.clear()
+        current = self.playlist.get(self.current_file) if self.current_file else None
+        if enabled and current is not None:
+            self.shuffle_played.add(current)
+        self.order_track = current
+        self.requeue()
+        self.emit('order_changed')
+        
+    def set_repeat(self, mode):
+        """Set the repeat mode: 'off', 'all' or 'one'"""
+        self.repeat = mode
+        self.requeue()
+        if self.is_playing and self.queued_track is None:
+            self.prepare_next()
+        self.emit('order_changed')
+        
+    def rewind(self):
+        """Rewind 5 seconds"""
+        if self.is_playing and self.current_file:
+            self.seek(self.get_position() - SEEK_STEP)
+        
+    def forward(self):
+        """Forward 5 seconds"""
+        if self.is_playing and self.current_file and self.seekable():
+            new_pos = self.get_position() + SEEK_STEP
+            if new_pos < self.current_duration:
+                self.seek(new_pos)
+            else:
+                self.next_track()
+        
+    def check_music_end(self):
+        """Check if current track ended and play next, return True if it did"""
+        if self.is_playing and not self.is_paused:
+            if self.stream_stalled():
+                # get_busy() would wait for the network with the mixer locked
+                return False
+            if self.queued_track is not None and self.music().get_busy():
+                # get_pos() restarts from zero when the queued track begins
+                self.clock.position()
+                if self.clock.wrapped:
+                    self.clock.wrapped = False
+                    self.advance_to_queued()
+                    return True
+                return False
+                
+            if not self.music().get_busy():
+                # Music ended, play next
+                self.end_listen(ended=True)
+                if not self.advance(ended=True):
+                    # End of playlist
+                    self.is_playing = False
+                    self.emit('state_changed', 'finished')
+                    self.set_progress(self.current_duration, self.current_duration)
+                    self.scheduler.reschedule()
+                return True
+        return False
+        
+    def play_pause(self):
+        """Toggle play/pause"""
+        if self.is_playing and not self.is_paused:
+            self.pause()
+        elif self.is_paused:
+            self.resume()
+        else:
+            self.play_current()
+            
+    def pause(self):
+        """Pause playback"""
+        if self.is_playing and not self.is_paused:
+            self.music().pause()
+            self.is_paused = True
+            self.emit('state_changed', 'paused')
+            self.scheduler.reschedule()
+            
+    def resume(self):
+        """Continue paused playback"""
+        if self.is_paused:
+            self.music().unpause()
+            self.is_paused = False
+            self.emit('state_changed', 'playing')
+            self.scheduler.reschedule()
+            
+    def stop(self):
+        """Stop playback"""
+        self.end_listen()
+        self.stream_generation += 1
+        self.connecting = False
+        self.abort_stream()
+        self.music().stop()  # also drops a queued track
+        self.queued_track = None
+        self.is_playing = False
+        self.is_paused = False
+        self.emit('state_changed', 'stopped')
+        self.set_progress(0, 0)
+        self.scheduler.reschedule()
+        
+    def clear_playlist(self):
+        """Clear playlist"""
+        self.stop()
+        self.playlist.clear()
+        self.search_executor.submit(self.search_index.clear)
+        self.up_next.clear()
+        self.history.clear()
+        self.future.clear()
+        self.order_track = None
+        self.shuffle_order = None
+        self.shuffle_played.clear()
+        self.shuffle_next = None
+        
+        # Drop probes still in flight for the old playlist
+        self.probe_generation += 1
+        self.pending_probes = 0
+        self.current_index = 0
+        self.current_file = None
+        self.current_duration = 0
+        self.emit('playlist_changed', True)
+        self.emit('track_changed')
+        
+    def remove_range(self, start, stop):
+        """Remove tracks start to stop (exclusive)"""
+        current = self.playlist[self.current_index] if self.playlist else None
+        
+        if start <= self.current_index < stop and self.is_playing:
+            self.stop()
+            
+        removed = self.playlist.remove_range(start, stop)
+        self.reindex(len(removed))
+        # Positions shifted; the queue and history skip removed tracks by themselves
+        self.shuffle_order = None
+        
+        # Follow the current track, or stay on the slot that replaced it
+        if current is not None and current.path in self.playlist:
+            self.current_index = self.playlist.index_of(current.path)
+        else:
+            self.current_index = min(start, max(len(self.playlist) - 1, 0))
+        self.requeue()
+        self.emit('playlist_changed', True)
+        
+    def remove_paths(self, paths):
+        """Remove the tracks of paths, e.g. files that are gone or duplicates"""
+        current = self.playlist[self.current_index] if self.playlist else None
+        if self.is_playing and current is not None and current.path in set(paths):
+            self.stop()
+            
+        removed = self.playlist.remove_paths(paths)
+        self.reindex(len(removed))
+        self.shuffle_order = None
+        
+        if current is not None and current.path in self.playlist:
+            self.current_index = self.playlist.index_of(current.path)
+        else:
+            self.current_index = min(self.current_index, max(len(self.playlist) - 1, 0))
+        self.requeue()
+        self.emit('playlist_changed', True)
+        
+    def move_tracks(self, start, stop, dest):
+        """Move tracks start to stop (exclusive) so the block begins at dest"""
+        current = self.playlist[self.current_index] if self.playlist else None
+        self.playlist.move(start, stop, dest)
+        self.reindex()
+        self.shuffle_order = None
+        if current is not None:
+            self.current_index = self.playlist.index_of(current.path)
+        self.requeue()
+        self.emit('playlist_changed', True)
+        
+    def is_current(self, index):
+        """True if the row at index holds the loaded track"""
+        return (
+            self.current_file is not None
+            and index == self.current_index < len(self.playlist)
+            and self.playlist[index].path == self.current_file
+        )
+        
+    def set_volume(self, volume):
+        """Set volume from 0 to 1"""
+        volume = max(0.0, min(volume, 1.0))
+        if volume == self.volume:
+            return
+        self.volume = volume
+        self.apply_volume()
+        self.emit('volume_changed', volume)
+        
+    def get_position(self):
+        """Current playback position in seconds"""
+        return self.clock.position()
+        
+    def end_listen(self, ended=False):
+        """Record the listen to the current track as a play or a skip
+        
+        ended: the track played to its end, otherwise the position tells
+        how far it got.
+        """
+        listening, self.listening = self.listening, None
+        if listening is None or self.play_stats is None:
+            return
+        file_path, duration = listening
+        listened = duration if ended else max(0.0, self.get_position())
+        if duration:
+            listened = min(listened, duration)
+        played = listened >= PLAYED_SECONDS or (duration > 0 and listened >= duration * PLAYED_FRACTION)
+        if self.play_stats.record(file_path, listened, played):
+            self.timers.after(PLAY_STATS_FLUSH_MS, self.flush_play_stats)
+            
+    def flush_play_stats(self):
+        """Write buffered listens on a probe worker, off the timer thread"""
+        self.probe_executor.submit(self.play_stats_worker, self.play_stats.flush)
+        
+    def play_stats_worker(self, query, *args):
+        try:
+            return query(*args)
+        except sqlite3.Error as e:
+            print(f"Error updating play history: {e}")
+            return None
+            
+    def smart_playlist(self, kind, callback):
+        """Look up tracks by play history in a probe worker
+        
+        kind is 'most_played', 'recently_played' or 'never_played'. Calls
+        callback(kind, paths) on the timer thread: up to SMART_PLAYLIST_SIZE
+        existing files, or the playlist's tracks never played to the end.
+        """
+        if self.play_stats is None:
+            self.timers.after(0, callback, kind, [])
+            return
+        entries = [track.path for track in self.playlist]
+        self.probe_executor.submit(self.smart_playlist_worker, kind, entries, callback)
+        
+    def smart_playlist_worker(self, kind, entries, callback):
+        started = time.perf_counter()
+        if kind == 'never_played':
+            played = self.play_stats_worker(self.play_stats.played_paths) or set()
+            paths = [path for path in entries if path not in played]
+        else:
+            query = self.play_stats.most_played if kind == 'most_played' else self.play_stats.recently_played
+            paths = self.play_stats_worker(query, SMART_PLAYLIST_SIZE) or []
+            # Moved and deleted files stay in the history
+            paths = [path for path in paths if is_stream_url(path) or os.path.isfile(path)]
+        PERF.record('smart playlist', started)
+        self.timers.after(0, callback, kind, paths)
+        
+    def apply_volume(self):
+        """Set the mixer volume from the slider, the current fade and ReplayGain"""
+        self.music().set_volume(min(1.0, self.volume * self.fade_gain * self.replay_gain))
+        
+    def lookup_loudness(self, file_path):
+        """Cached ReplayGain values of a file, or None"""
+        if self.metadata_cache is None:
+            return None
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return self.metadata_cache.lookup_loudness(file_path, stat.st_size, stat.st_mtime_ns)
+        
+    def update_replay_gain(self):
+        """Pick the gain for the current track from the selected mode
+        
+        Uses the values cached on the track; the first time, they are looked
+        up in a probe worker and the gain changes when they arrive, so a
+        track start never waits for the disk or the database.
+        """
+        track = self.playlist.get(self.current_file) if self.current_file else None
+        if self.gain_mode == 'off' or track is None or is_stream_url(track.path):
+            self.apply_replay_gain(None)
+        elif track.loudness is None:
+            self.probe_executor.submit(self.loudness_worker, track)
+        else:
+            self.apply_replay_gain(track.loudness or None)
+            
+    def loudness_worker(self, track):
+        values = self.lookup_loudness(track.path)
+        self.timers.after(0, self.set_track_loudness, track, values)
+        
+    def set_track_loudness(self, track, values):
+        track.loudness = values or False
+        if track.path == self.current_file:
+            self.update_replay_gain()
+            
+    def apply_replay_gain(self, values):
+        """Set the gain from ReplayGain values, or unity gain for None"""
+        self.replay_gain = 1.0
+        if values is not None:
+            gain, peak = values['track_gain'], values['track_peak']
+            if self.gain_mode == 'album' and values['album_gain'] is not None:
+                gain, peak = values['album_gain'], values['album_peak']
+            self.replay_gain = 10 ** (gain / 20)
+            # Never push the peak past full scale
+            if peak:
+                self.replay_gain = min(self.replay_gain, 1 / peak)
+        self.apply_volume()
+        
+    def set_gain_mode(self, mode):
+        """Switch between no normalization, track gain and album gain"""
+        self.gain_mode = mode
+        if self.current_file:
+            self.update_replay_gain()
+            
+    def analyze_playlist_loudness(self, callback):
+        """Measure every playlist track without ReplayGain data, one process per file
+        
+        Tracks that already have values are filtered out in a probe worker,
+        so the timer thread never stats the whole library. Calls
+        callback(count) on the timer thread with the number of files queued
+        for analysis.
+        """
+        paths = [track.path for track in self.playlist]
+        self.probe_executor.submit(self.loudness_filter_worker, paths, callback)
+        
+    def loudness_filter_worker(self, paths, callback):
+        paths = [
+            file_path for file_path in paths
+            if not is_stream_url(file_path) and self.lookup_loudness(file_path) is None
+        ]
+        self.timers.after(0, self.start_analysis, paths, callback)
+        
+    def start_analysis(self, paths, callback):
+        """Queue files for loudness analysis on the timer thread"""
+        if not paths:
+            callback(0)
+            return
+            
+        if self.analysis_executor is None:
+            self.analysis_executor = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 2,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_analysis_worker
+            )
+        if self.analysis_total == self.analysis_done:
+            self.analysis_total = self.analysis_done = 0
+            self.analyzed = {}
+            self.timers.after(PROBE_BATCH_INTERVAL, self.flush_analysis_results)
+        self.analysis_total += len(paths)
+        
+        for file_path in paths:
+            future = self.analysis_executor.submit(analyze_loudness, file_path)
+            future.add_done_callback(self.analysis_done_callback)
+        callback(len(paths))
+        
+    def analysis_done_callback(self, future):
+        try:
+            self.analysis_results.put(future.result())
+        except Exception as e:
+            self.analysis_results.put((None, None))
+            print(f"Error analyzing loudness: {e}")
+        
+    def flush_analysis_results(self):
+        """Store finished measurements on the timer thread"""
+        while True:
+            try:
+                file_path, values = self.analysis_results.get_nowait()
+            except queue.Empty:
+                break
+            self.analysis_done += 1
+            if values is not None:
+                self.analyzed[file_path] = values
+                self.save_loudness(file_path, values)
+                track = self.playlist.get(file_path)
+                if track is not None:
+                    # Album gains are filled into the same dict later
+                    track.loudness = values
+                if file_path == self.current_file:
+                    self.update_replay_gain()
+                    
+        self.emit('analysis_progress', self.analysis_done, self.analysis_total)
+        if self.analysis_done < self.analysis_total:
+            self.timers.after(PROBE_BATCH_INTERVAL, self.flush_analysis_results)
+        else:
+            self.store_album_gains()
+            
+    def save_loudness(self, file_path, values):
+        if self.metadata_cache is None:
+            return
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return
+        self.metadata_cache.store_loudness(file_path, stat.st_size, stat.st_mtime_ns, values)
+        
+    def store_album_gains(self):
+        """Derive album gain for analyzed tracks, one album per folder"""
+        albums = {}
+        for file_path, values in self.analyzed.items():
+            albums.setdefault(os.path.dirname(file_path), []).append((file_path, values))
+            
+        for tracks in albums.values():
+            # Duration-weighted energy mean of the track loudness values
+            energy = weight = 0.0
+            for file_path, values in tracks:
+                track = self.playlist.get(file_path)
+                duration = (track.duration if track is not None else 0) or 1.0
+                energy += duration * 10 ** (values['loudness'] / 10)
+                weight += duration
+            album_gain = RG_REFERENCE_LUFS - 10 * math.log10(energy / weight)
+            album_peak = max(values['track_peak'] for _, values in tracks)
+            
+            for file_path, values in tracks:
+                values['album_gain'] = album_gain
+                values['album_peak'] = album_peak
+                self.save_loudness(file_path, values)
+                
+        self.analyzed = {}
+        if self.current_file:
+            self.update_replay_gain()
+        
+    def update_fade(self):
+        """Set the fade gain for the current position, return ms until the next update"""
+        position = self.get_position()
+        remaining = self.current_duration - position
+        gain = 1.0
+        
+        if self.fading_in:
+            if position < self.crossfade:
+                gain = position / self.crossfade
+            else:
+                self.fading_in = False
+        if self.queued_track is not None and remaining < self.crossfade:
+            gain = min(gain, max(remaining, 0) / self.crossfade)
+            
+        if gain != self.fade_gain:
+            self.fade_gain = gain
+            self.apply_volume()
+            
+        if self.fading_in or (self.queued_track is not None and remaining < self.crossfade):
+            return FADE_STEP_MS
+        if self.queued_track is not None:
+            return int((remaining - self.crossfade) * 1000) + 1
+        return None
+        
+    def set_gapless(self, enabled):
+        """Toggle gapless playback"""
+        self.gapless = enabled
+        if self.is_playing:
+            self.prepare_next()
+            
+    def set_equalizer(self, enabled):
+        """Play through the equalizer or straight through pygame, keeping the position"""
+        if enabled == (self.dsp is not None):
+            return
+        if enabled and np is None:
+            self.emit('error', "The equalizer needs NumPy (pip install numpy)")
+            return
+        self.mixer_ready.wait()
+        if not pygame.mixer.get_init():
+            return
+        playing = self.is_playing and self.current_file is not None
+        position = self.get_position() if playing else 0
+        paused = self.is_paused
+        self.music().stop()
+        self.queued_track = None
+        
+        if enabled:
+            if self.dsp_chain is None:
+                rate, _, channels = pygame.mixer.get_init()
+                self.dsp_chain = DspChain(rate, channels)
+                self.dsp_chain.set_gains(self.eq_gains, self.eq_preamp)
+            self.dsp = DspPlayer(self.dsp_chain)
+        else:
+            self.dsp.close()
+            self.dsp = None
+            
+        if not playing:
+            return
+        try:
+            self.load_music(self.current_file)
+            self.apply_volume()
+            self.music().play(start=position)
+        except Exception as e:
+            self.emit('error', f"Failed to play file:\n{e}")
+            return
+        self.clock.restart(position)
+        if paused:
+            self.music().pause()
+        self.prepare_next()
+        self.scheduler.reschedule()
+        
+    def playing_pcm(self):
+        """(samples, sample rate) of the current track if the equalizer decoded it, else None"""
+        if self.dsp is None:
+            return None
+        samples = self.dsp.current_pcm()
+        return None if samples is None else (samples, self.dsp.rate)
+        
+    def set_equalizer_gains(self, gains, preamp=0.0):
+        """Set the equalizer bands and preamp in dB, they apply within one block"""
+        self.eq_gains = [max(-EQ_MAX_DB, min(float(gain), EQ_MAX_DB)) for gain in gains]
+        self.eq_preamp = max(-EQ_MAX_DB, min(float(preamp), EQ_MAX_DB))
+        if self.dsp_chain is not None:
+            self.dsp_chain.set_gains(self.eq_gains, self.eq_preamp)
+            
+    def set_crossfade(self, seconds):
+        """Set crossfade length in seconds"""
+        self.crossfade = seconds
+        if not self.crossfade:
+            self.fade_gain = 1.0
+            self.fading_in = False
+            self.apply_volume()
+        if self.is_playing:
+            self.prepare_next()
+            self.scheduler.reschedule()
+        
+    def set_progress(self, position, duration):
+        """Announce position / duration"""
+        self.emit('position', position, duration)
+        
+    def update_progress(self):
+        """Update progress bar with actual duration"""
+        if self.is_playing and not self.is_paused and self.current_duration > 0:
+            position = self.get_position()
+            if self.clock.wrapped and self.queued_track is not None:
+                self.check_music_end()
+                return
+            self.set_progress(position, self.current_duration)
+        
+    def session_entries(self):
+        """Header and (path, duration) list describing the session, on the timer thread"""
+        if self.is_playing:
+            position = self.get_position()
+        elif self.resume_at is not None:
+            position = self.resume_at[1]
+        else:
+            position = 0
+        header = {
+            'version': SESSION_VERSION,
+            'current': self.current_file,
+            'index': self.current_index,
+            'position': position,
+            'volume': self.volume,
+            'shuffle': self.shuffle,
+            'repeat': self.repeat,
+        }
+        return header, [(track.path, track.duration) for track in self.playlist]
+        
+    def save_session(self, header, entries):
+        try:
+            with self.session_lock:
+                write_session(self.session_path, header, entries)
+        except OSError as e:
+            print(f"Error saving session: {e}")
+            
+    def on_session_event(self, event, *args):
+        """Autosave a while after the playlist, track or state changed"""
+        if event in ('playlist_changed', 'track_changed', 'state_changed', 'track_updated', 'order_changed'):
+            if not self.session_save_scheduled:
+                self.session_save_scheduled = True
+                self.timers.after(SESSION_SAVE_DELAY_MS, self.autosave)
+                
+    def autosave(self):
+        self.session_save_scheduled = False
+        self.probe_executor.submit(self.save_session, *self.session_entries())
+        
+    def restore_session(self, session_path):
+        """Load the saved playlist at once and keep saving it from now on
+        
+        Durations come from the session, so nothing is probed. Files are
+        checked for existence lazily, in a background thread; missing ones
+        stay in the playlist, flagged, so an unmounted drive loses nothing.
+        """
+        self.session_path = session_path
+        self.subscribe(self.on_session_event)
+        try:
+            header, paths, durations = read_session(session_path)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Error restoring session: {e}")
+            return
+            
+        new_tracks = self.playlist.extend(paths)
+        for track, duration in zip(new_tracks, durations):
+            track.duration = duration
+        if not new_tracks:
+            return
+            
+        index = self.playlist.index_of(header.get('current'))
+        if index is None:
+            index = min(max(int(header.get('index', 0)), 0), len(self.playlist) - 1)
+        self.current_index = index
+        track = self.playlist[index]
+        self.current_file = track.path
+        self.current_duration = track.duration or 0
+        position = float(header.get('position', 0))
+        self.resume_at = (track.path, position)
+        
+        # The mixer may still be starting, so the volume is applied on first play
+        self.volume = max(0.0, min(float(header.get('volume', self.volume)), 1.0))
+        self.emit('volume_changed', self.volume)
+        self.shuffle = bool(header.get('shuffle', False))
+        if header.get('repeat') in ('off', 'all', 'one'):
+            self.repeat = header['repeat']
+        self.emit('order_changed')
+        
+        self.emit('playlist_changed', False)
+        self.emit('track_changed')
+        self.set_progress(position, self.current_duration)
+        self.queue_probes([track.path for track in new_tracks if track.duration is None])
+        self.search_executor.submit(self.search_index.add, new_tracks)
+        self.start_scan(self.check_worker, paths, self.probe_generation)
+        
+    def shutdown(self):
+        """Stop playback and release the mixer, workers and caches"""
+        if self.session_path is not None:
+            self.save_session(*self.session_entries())
+        self.end_listen()
+        self.abort_stream()
+        if pygame.mixer.get_init():
+            self.music().stop()
+            if self.dsp is not None:
+                self.dsp.close()
+            pygame.mixer.quit()
+        self.scheduler.cancel()
+        
+        self.probe_generation += 1
+        self.probe_executor.shutdown(wait=True, cancel_futures=True)
+        self.search_executor.shutdown(wait=False, cancel_futures=True)
+        if self.analysis_executor is not None:
+            self.analysis_executor.shutdown(wait=False, cancel_futures=True)
+        if self.fingerprint_executor is not None:
+            self.fingerprint_executor.shutdown(wait=False, cancel_futures=True)
+        self.connections.close()
+        if self.metadata_cache is not None:
+            self.metadata_cache.close()
+        if self.play_stats is not None:
+            try:
+                self.play_stats.close()
+            except sqlite3.Error as e:
+                print(f"Error saving play history: {e}")
+
+
+class SingleInstance:
+    """Lock that lets one player own the audio device, and the channel to it
+    
+    The first launch holds an exclusive lock on a file in the app dir and
+    listens on a local socket: a Unix domain socket where available,
+    otherwise a loopback TCP port written next to the lock. Later launches
+    fail to take the lock and send their files over the socket instead of
+    starting a second Tk root and mixer. Messages are one JSON line,
+    answered with an empty line once received.
+    """
+    
+    def __init__(self, app_dir):
+        self.app_dir = app_dir
+        self.lock_file = None
+        self.server = None
+        
+    def acquire(self):
+        """Take the instance lock, return False if another player holds it"""
+        self.lock_file = open(os.path.join(self.app_dir, INSTANCE_LOCK_FILE), 'a+b')
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                self.lock_file.seek(0)
+                msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.lock_file.close()
+            self.lock_file = None
+            return False
+        return True
+        
+    def connect(self):
+        if hasattr(socket, 'AF_UNIX'):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = os.path.join(self.app_dir, INSTANCE_SOCKET_FILE)
+        else:
+            with open(os.path.join(self.app_dir, INSTANCE_PORT_FILE)) as f:
+                address = ('127.0.0.1', int(f.read()))
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(INSTANCE_TIMEOUT)
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+        
+    def send(self, message):
+        """Hand a message to the running player, return True once it arrived"""
+        data = (json.dumps(message) + '\n').encode('utf-8')
+        deadline = time.monotonic() + INSTANCE_TIMEOUT
+        while True:
+            try:
+                with self.connect() as sock:
+                    sock.sendall(data)
+                    return sock.recv(1) == b'\n'
+            except (OSError, ValueError):
+                # The running player may still be starting its server
+                if time.monotonic() > deadline:
+                    return False
+                time.sleep(0.05)
+                
+    def serve(self, on_message):
+        """Listen for later launches, calling on_message(message) from a server thread"""
+        if hasattr(socket, 'AF_UNIX'):
+            path = os.path.join(self.app_dir, INSTANCE_SOCKET_FILE)
+            # We hold the lock, so a socket file left behind is stale
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(path)
+        else:
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.bind(('127.0.0.1', 0))
+            with open(os.path.join(self.app_dir, INSTANCE_PORT_FILE), 'w') as f:
+                f.write(str(server.getsockname()[1]))
+        server.listen()
+        self.server = server
+        
+        thread = threading.Thread(target=self.accept_loop, args=(on_message,), daemon=True)
+        thread.start()
+        
+    def accept_loop(self, on_message):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return  # closed
+            try:
+                with conn:
+                    conn.settimeout(INSTANCE_TIMEOUT)
+                    data = b''
+                    while not data.endswith(b'\n'):
+                        chunk = conn.recv(65536)
+                        if not chunk:
+                            break
+                        data += chunk
+                    message = json.loads(data)
+                    conn.sendall(b'\n')
+            except (OSError, ValueError) as e:
+                print(f"Error reading message from another launch: {e}")
+                continue
+            on_message(message)
+            
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            if hasattr(socket, 'AF_UNIX'):
+                try:
+                    os.unlink(os.path.join(self.app_dir, INSTANCE_SOCKET_FILE))
+                except OSError:
+                    pass
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+
+class ControlServer:
+    """Local control and status API for scripts and status bars
+    
+    An asyncio server on its own thread speaks JSON lines over a Unix
+    domain socket (a loopback TCP port where those are missing). A request
+    is {"id": 1, "cmd": "next", ...arguments} and is answered with
+    {"id": 1, "ok": true, "result": ...} or {"id": 1, "ok": false,
+    "error": "..."}. After {"cmd": "subscribe", "events": ["position"]}
+    the connection also receives {"event": "position", "args": [...]}.
+    
+    Requests are read without waiting for earlier answers and reach the
+    timer thread in batches: everything that arrived within
+    CONTROL_BATCH_MS runs in one callback, with runs of enqueue merged
+    into a single add, so thousands of enqueues redraw the UI once.
+    """
+    
+    def __init__(self, engine, app_dir, extra_commands=None):
+        self.engine = engine
+        self.app_dir = app_dir
+        self.commands = {
+            'status': self.status,
+            'playlist': self.playlist_page,
+            'enqueue': self.enqueue,
+            'move': self.move,
+            'remove': self.remove,
+            'play': self.play,
+            'play_pause': lambda request: engine.play_pause(),
+            'pause': lambda request: engine.pause(),
+            'resume': lambda request: engine.resume(),
+            'stop': lambda request: engine.stop(),
+            'next': lambda request: engine.next_track(),
+            'prev': lambda request: engine.prev_track(),
+            'rewind': lambda request: engine.rewind(),
+            'forward': lambda request: engine.forward(),
+            'seek': lambda request: engine.seek(float(request['position'])),
+            'volume': lambda request: engine.set_volume(float(request['volume'])),
+            'volume_up': lambda request: engine.set_volume(engine.volume + VOLUME_STEP),
+            'volume_down': lambda request: engine.set_volume(engine.volume - VOLUME_STEP),
+            'clear': lambda request: engine.clear_playlist(),
+            'play_next': self.play_next,
+            'shuffle': lambda request: engine.set_shuffle(bool(request['enabled'])),
+            'repeat': self.repeat,
+        }
+        self.commands.update(extra_commands or {})
+        
+        self.pending = queue.Queue()  # (command, request, future) for the timer thread
+        self.lock = threading.Lock()
+        self.drain_scheduled = False
+        self.subscribers = {}  # stream writer -> names of the events it wants
+        self.loop = None
+        self.server = None
+        engine.subscribe(self.on_event)
+        
+    def start(self):
+        """Start serving on a background thread"""
+        self.loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        thread.start()
+        asyncio.run_coroutine_threadsafe(self.listen(), self.loop).result()
+        
+    async def listen(self):
+        if hasattr(socket, 'AF_UNIX'):
+            path = os.path.join(self.app_dir, CONTROL_SOCKET_FILE)
+            # Only the instance holding the single-instance lock serves
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self.server = await asyncio.start_unix_server(
+                self.handle_client, path, limit=CONTROL_LINE_LIMIT
+            )
+        else:
+            self.server = await asyncio.start_server(
+                self.handle_client, '127.0.0.1', 0, limit=CONTROL_LINE_LIMIT
+            )
+            with open(os.path.join(self.app_dir, CONTROL_PORT_FILE), 'w') as f:
+                f.write(str(self.server.sockets[0].getsockname()[1]))
+                
+    async def handle_client(self, reader, writer):
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.ensure_future(self.answer(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, ValueError) as e:
+            print(f"Error reading control request: {e}")
+        finally:
+            if self.subscribers.pop(writer, None) is not None:
+                self.engine.timers.after(0, self.update_ticks)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+            
+    async def answer(self, line, writer):
+        """Run one request and write its answer"""
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            command = request.get('cmd')
+            if command == 'subscribe':
+                result = sorted(set(request.get('events', [])))
+                self.subscribers[writer] = set(result)
+                self.engine.timers.after(0, self.update_ticks)
+            elif command in self.commands:
+                future = self.loop.create_future()
+                self.submit(command, request, future)
+                result = await future
+            else:
+                raise ValueError(f"unknown command {command!r}")
+            response = {'id': request_id, 'ok': True, 'result': result}
+        except Exception as e:
+            response = {'id': request_id, 'ok': False, 'error': str(e)}
+        self.write(writer, response)
+        
+    def write(self, writer, message):
+        if not writer.is_closing():
+            writer.write((json.dumps(message) + '\n').encode('utf-8'))
+            
+    def submit(self, command, request, future):
+        """Queue a command for the timer thread, scheduling one drain per batch"""
+        self.pending.put((command, request, future))
+        with self.lock:
+            if self.drain_scheduled:
+                return
+            self.drain_scheduled = True
+        self.engine.timers.after(CONTROL_BATCH_MS, self.drain)
+        
+    def drain(self):
+        """Run every queued command on the timer thread"""
+        with self.lock:
+            self.drain_scheduled = False
+        batch = []
+        while True:
+            try:
+                batch.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+                
+        start = 0
+        while start < len(batch):
+            # A run of plain enqueues becomes one add and one playlist update
+            stop = start + 1
+            if self.is_plain_enqueue(batch[start]):
+                while stop < len(batch) and self.is_plain_enqueue(batch[stop]):
+                    stop += 1
+            run = batch[start:stop]
+            if len(run) > 1:
+                self.enqueue_merged(run)
+            else:
+                command, request, future = run[0]
+                try:
+                    result, error = self.commands[command](request), None
+                except Exception as e:
+                    result, error = None, e
+                self.loop.call_soon_threadsafe(self.resolve, future, result, error)
+            start = stop
+            
+    def enqueue_merged(self, run):
+        """Add the paths of several plain enqueues at once; a malformed one only fails itself"""
+        paths = []
+        futures = []
+        for _, request, future in run:
+            try:
+                paths.extend(self.paths_of(request))
+            except ValueError as e:
+                self.loop.call_soon_threadsafe(self.resolve, future, None, e)
+                continue
+            futures.append(future)
+        if not futures:
+            return
+        try:
+            self.engine.open_paths(paths)
+            result, error = {'total': len(self.engine.playlist)}, None
+        except Exception as e:
+            result, error = None, e
+        for future in futures:
+            self.loop.call_soon_threadsafe(self.resolve, future, result, error)
+            
+    def is_plain_enqueue(self, item):
+        return item[0] == 'enqueue' and not item[1].get('play')
+        
+    def resolve(self, future, result, error):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+            
+    def paths_of(self, request):
+        paths = request.get('paths', [])
+        if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+            raise ValueError("paths must be a list of strings")
+        return paths
+        
+    def check_range(self, start, stop, limit):
+        if not 0 <= start < stop <= limit:
+            raise ValueError(f"range {start}:{stop} is outside the playlist")
+            
+    def status(self, request):
+        engine = self.engine
+        if engine.is_paused:
+            state = 'paused'
+        elif engine.is_playing:
+            state = 'playing'
+        else:
+            state = 'stopped'
+        return {
+            'state': state,
+            'file': engine.current_file,
+            'index': engine.current_index if engine.current_file else None,
+            'position': engine.get_position() if engine.is_playing else 0,
+            'duration': engine.current_duration,
+            'volume': engine.volume,
+            'tracks': len(engine.playlist),
+            'gapless': engine.gapless,
+            'crossfade': engine.crossfade,
+            'gain_mode': engine.gain_mode,
+            'shuffle': engine.shuffle,
+            'repeat': engine.repeat,
+            'up_next': sum(1 for track in engine.up_next if engine.playlist.holds(track)),
+            'buffer_underruns': engine.buffer_underruns(),
+        }
+        
+    def playlist_page(self, request):
+        """One page of the playlist: offset and limit, at most CONTROL_MAX_PAGE tracks"""
+        playlist = self.engine.playlist
+        offset = max(int(request.get('offset', 0)), 0)
+        limit = max(min(int(request.get('limit', CONTROL_PAGE_SIZE)), CONTROL_MAX_PAGE), 0)
+        tracks = []
+        for index in range(offset, min(offset + limit, len(playlist))):
+            track = playlist[index]
+            tracks.append({'index': index, 'path': track.path, 'duration': track.duration})
+        return {'total': len(playlist), 'offset': offset, 'tracks': tracks}
+        
+    def enqueue(self, request):
+        self.engine.open_paths(self.paths_of(request), play_now=bool(request.get('play')))
+        return {'total': len(self.engine.playlist)}
+        
+    def move(self, request):
+        start, stop, dest = int(request['start']), int(request['stop']), int(request['dest'])
+        self.check_range(start, stop, len(self.engine.playlist))
+        if not 0 <= dest <= len(self.engine.playlist) - (stop - start):
+            raise ValueError(f"destination {dest} is outside the playlist")
+        self.engine.move_tracks(start, stop, dest)
+        
+    def remove(self, request):
+        start = int(request['start'])
+        stop = int(request.get('stop', start + 1))
+        self.check_range(start, stop, len(self.engine.playlist))
+        self.engine.remove_range(start, stop)
+        
+    def play_next(self, request):
+        start = int(request['start'])
+        stop = int(request.get('stop', start + 1))
+        self.check_range(start, stop, len(self.engine.playlist))
+        self.engine.play_next(range(start, stop))
+        
+    def repeat(self, request):
+        mode = request['mode']
+        if mode not in ('off', 'all', 'one'):
+            raise ValueError(f"unknown repeat mode {mode!r}")
+        self.engine.set_repeat(mode)
+        
+    def play(self, request):
+        if 'index' in request:
+            index = int(request['index'])
+            self.check_range(index, index + 1, len(self.engine.playlist))
+            self.engine.play(index)
+        else:
+            self.engine.play_current()
+            
+    def update_ticks(self):
+        """Ask for a position event every second while a client subscribes to them"""
+        wanted = any('position' in events for events in list(self.subscribers.values()))
+        self.engine.set_progress_ticks(1 if wanted else None, owner='control')
+        
+    def on_event(self, event, *args):
+        """Forward an engine event to subscribed clients, from the timer thread"""
+        if not self.subscribers or self.loop is None:
+            return
+        if event == 'track_changed':
+            args = (self.engine.current_index if self.engine.current_file else None,
+                    self.engine.current_file)
+        self.loop.call_soon_threadsafe(self.push, {'event': event, 'args': list(args)})
+        
+    def push(self, message):
+        for writer, events in list(self.subscribers.items()):
+            if message['event'] not in events:
+                continue
+            if writer.transport.get_write_buffer_size() > CONTROL_MAX_BUFFER:
+                continue
+            self.write(writer, message)
+            
+    def close(self):
+        if self.server is None:
+            return
+        self.loop.call_soon_threadsafe(self.server.close)
+        if hasattr(socket, 'AF_UNIX'):
+            try:
+                os.unlink(os.path.join(self.app_dir, CONTROL_SOCKET_FILE))
+            except OSError:
+                pass
+
 
 class AudioPlayer:
-    def __init__(self):
-        self.root = tk.Tk()
+    def __init__(self, instance=None):
+        with STARTUP.phase("Tk root"):
+            self.root = tk.Tk()
         self.root.title("🎵 Audio Player")
-        self.root.geometry("500x520")
+        self.root.geometry("500x620")
         self.root.resizable(False, False)
         self.root.configure(bg='#1a1a2e')
         
-        # Initialize pygame mixer
-        pygame.mixer.init()
-        
-        # State variables
-        self.playlist = []  # List of file paths
-        self.current_index = 0  # Current track index
-        self.current_file = None
-        self.current_duration = 0  # Duration in seconds
-        self.is_playing = False
-        self.is_paused = False
-        self.volume = 0.5
+        # Playback runs in the engine, on Tk's timers; the window only listens
+        with STARTUP.phase("player engine"):
+            self.engine = PlayerEngine(self.root)
+        self.engine.subscribe(self.on_engine_event)
         self.tray_icon = None
         self.hidden = False
+        self.debug_panel = None
+        self.equalizer_panel = None
+        self.perf_stats_path = None  # --perf-stats output, written on exit
+        
+        # Waveform peaks are computed one track at a time
+        self.peak_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="peaks")
+        self.peak_results = queue.Queue()
+        self.peak_token = 0  # bumped per track to drop results for the previous one
+        self.peak_job_active = False
+        
+        # Spectrum visualizer: frames run only while shown, visible and playing
+        self.spectrum_job = None
+        self.spectrum_analyzer = None
+        self.spectrum_file = None  # track decoded (or being decoded) for it
+        self.spectrum_pcm = None  # its (samples, sample rate)
+        self.spectrum_on = False  # spectrum_var, for the peak worker
+        
+        # The waveform and the spectrum share one decode of the current track
+        self.decoded_lock = threading.Lock()
+        self.decoded = None  # (path, samples, sample rate), kept while the spectrum may need it
+        
+        # Cover art, decoded and scaled off the Tk thread
+        self.thumbnails = ThumbnailCache(os.path.join(get_app_dir(), THUMBNAIL_DIR))
+        self.art_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="art")
+        self.art_token = 0  # bumped per track like peak_token
+        self.cover_image = None  # keeps the shown PhotoImage alive
+        self.blank_image = None
+        
+        # Create interface
+        self.shown_time = None
+        with STARTUP.phase("widgets"):
+            self.create_widgets()
+        
+        # Search results shown instead of the playlist, None when not filtering
+        self.search_shown = None  # query of the results on screen
+        self.search_matches = None
+        self.search_rows = None  # path -> row in search_matches, built on demand
+        
+        # Handle window close
+        self.root.protocol("WM_DELETE_WINDOW", self.hide_to_tray)
+        
+        # Position updates only while the window shows them
+        self.engine.set_progress_ticks(self.waveform.winfo_width())
+        self.root.after(0, self.first_frame)
+        
+        # Files opened by later launches arrive here, scripts use the control API
+        self.instance = instance
+        self.control = None
+        if instance is not None:
+            # Only the instance holding the lock owns the saved session
+            self.engine.restore_session(os.path.join(get_app_dir(), SESSION_FILE))
+            instance.serve(self.on_instance_message)
+            self.control = ControlServer(
+                self.engine,
+                get_app_dir(),
+                {'show': lambda request: self.show_window()}
+            )
+            try:
+                self.control.start()
+            except OSError as e:
+                print(f"Control API disabled: {e}")
+                self.control = None
+        
+    def first_frame(self):
+        """Draw the window now, to time when it first appears"""
+        self.root.update_idletasks()
+        STARTUP.mark("first frame")
+        
+    def on_instance_message(self, message):
+        self.root.after(0, self.open_from_instance, message)
+        
+    def open_from_instance(self, message):
+        """Files from a later launch: add or play them and show the window"""
+        self.engine.open_paths(message.get('paths', []), play_now=message.get('action') == 'play')
+        self.show_window()
+        
+    def on_engine_event(self, event, *args):
+        """Route an engine event to its on_<event> handler"""
+        handler = getattr(self, 'on_' + event, None)
+        if handler is not None:
+            handler(*args)
+            
+    def on_track_changed(self):
+        """Show the new current track"""
+        engine = self.engine
+        if engine.current_file is None:
+            self.playlist_box.set_current(None)
+            self.peak_token += 1
+            self.waveform.clear()
+            self.art_token += 1
+            self.show_cover(self.art_token, b'')
+        else:
+            self.highlight_current()
+            self.load_waveform(engine.current_file)
+            self.load_cover(engine.current_file)
+        self.update_track_info()
+        self.update_track_label()
+        
+    def update_track_info(self):
+        """Show title, artist and album of the current track, or its file name"""
+        track = self.engine.playlist.get(self.engine.current_file)
+        if track is None:
+            self.file_label.config(text="No file selected")
+            self.tags_label.config(text="")
+            return
+        self.file_label.config(text=track.title or os.path.basename(track.path))
+        self.tags_label.config(text=" — ".join(filter(None, (track.artist, track.album))))
+        
+    def highlight_current(self):
+        """Mark, select and scroll to the current track"""
+        row = self.view_row(self.engine.current_index)
+        self.playlist_box.set_current(row)
+        if row is not None:
+            self.playlist_box.selection_set(row)
+            self.playlist_box.see(row)
+            
+    def on_state_changed(self, state):
+        """Update the play button and status line"""
+        if state == 'playing':
+            self.btn_play.config(text="⏸")
+            self.status_label.config(text="▶ Playing", fg='#00d25b')
+        elif state == 'paused':
+            self.btn_play.config(text="▶")
+            self.status_label.config(text="⏸ Paused", fg='#ffc107')
+        elif state == 'buffering':
+            self.btn_play.config(text="⏸")
+            self.status_label.config(text="⏳ Buffering...", fg='#ffc107')
+        elif state == 'finished':
+            self.btn_play.config(text="▶")
+            self.status_label.config(text="⏹ Finished", fg='#0f3460')
+        else:
+            self.btn_play.config(text="▶")
+            self.status_label.config(text="⏹ Stopped", fg='#0f3460')
+        self.update_spectrum_running()
+            
+    def on_playlist_changed(self, reordered):
+        """Redraw the playlist after tracks were added, moved or removed"""
+        started = time.perf_counter()
+        if self.search_matches is not None:
+            # Results refresh in the background and replace the filtered rows
+            self.engine.search(self.search_var.get(), self.on_search_results)
+        elif reordered:
+            self.playlist_box.selection_clear()
+            current = self.engine.current_index
+            self.playlist_box.set_current(current if self.engine.is_current(current) else None)
+        self.playlist_box.refresh()
+        self.update_track_label()
+        PERF.record('playlist redraw', started)
+        
+    def on_track_updated(self, index):
+        """Redraw one playlist row"""
+        row = self.view_row(index)
+        if row is not None:
+            self.playlist_box.refresh_row(row)
+        if self.engine.is_current(index):
+            self.update_track_info()
+            
+    def on_search_changed(self, *args):
+        """Filter the playlist as the search text changes"""
+        query = self.search_var.get()
+        if query.strip():
+            self.engine.search(query, self.on_search_results)
+        elif self.search_matches is not None:
+            self.search_shown = None
+            self.search_matches = None
+            self.search_rows = None
+            self.playlist_box.set_model(self.engine.playlist)
+            if self.engine.current_file is not None:
+                self.highlight_current()
+            
+    def on_search_results(self, query, matches):
+        """Show search results unless the text changed in the meantime"""
+        if query != self.search_var.get():
+            return
+        selected = self.playlist_box.curselection()
+        selected_track = self.playlist_box.model[selected[0]] if selected else None
+        
+        # Refreshed results for the same text keep the scroll position
+        top = self.playlist_box.top if query == self.search_shown else 0
+        self.search_shown = query
+        self.search_matches = matches
+        self.search_rows = None
+        self.playlist_box.set_model(matches, top)
+        engine = self.engine
+        if engine.current_file is not None:
+            self.playlist_box.set_current(self.view_row(engine.current_index))
+            
+        # Keep the selection on the same track if it still matches
+        if selected_track is not None:
+            row = self.view_row(engine.playlist.index_of(selected_track.path))
+            if row is not None:
+                self.playlist_box.selection_set(row)
+                self.playlist_box.see(row)
+                
+    def view_row(self, index):
+        """Row showing playlist position index, or None if it is filtered out"""
+        if index is None or not 0 <= index < len(self.engine.playlist):
+            return None
+        if self.search_matches is None:
+            return index
+        if self.search_rows is None:
+            self.search_rows = {track.path: row for row, track in enumerate(self.search_matches)}
+        return self.search_rows.get(self.engine.playlist[index].path)
         
-        # Create interface
-        self.create_widgets()
+    def playlist_index(self, row):
+        """Playlist position of a row, or None if its track was removed since"""
+        if self.search_matches is None:
+            return row
+        return self.engine.playlist.index_of(self.search_matches[row].path)
         
-        # Handle window close
-        self.root.protocol("WM_DELETE_WINDOW", self.hide_to_tray)
+    def play_first_match(self, event=None):
+        """Play the first search result"""
+        if self.search_matches:
+            index = self.playlist_index(0)
+            if index is not None:
+                self.engine.play(index)
         
-        # Start update loops
-        self.update_progress()
-        self.check_music_end()
+    def on_error(self, message):
+        messagebox.showerror("Error", message)
         
-    def get_audio_duration(self, file_path):
-        """Get duration of audio file in seconds"""
-        try:
-            # Try to detect file type and get duration
-            ext = os.path.splitext(file_path)[1].lower()
-            
-            if ext == '.mp3':
-                audio = MP3(file_path)
-                return audio.info.length
-            elif ext == '.ogg':
-                audio = OggVorbis(file_path)
-                return audio.info.length
-            elif ext == '.flac':
-                audio = FLAC(file_path)
-                return audio.info.length
-            elif ext == '.wav':
-                audio = WAVE(file_path)
-                return audio.info.length
-            else:
-                # Try generic mutagen
-                audio = MutagenFile(file_path)
-                if audio is not None and hasattr(audio.info, 'length'):
-                    return audio.info.length
-                return 0
-        except Exception as e:
-            print(f"Error getting duration: {e}")
-            return 0
+    def on_analysis_progress(self, done, total):
+        if done < total:
+            self.root.title(f"🎵 Audio Player - analyzing {done}/{total}")
+        else:
+            self.root.title("🎵 Audio Player")
             
+    def playlist_row_text(self, track):
+        """Text shown for a track in the playlist"""
+        if self.show_tags_var.get() and track.title:
+            file_name = f"{track.artist} — {track.title}" if track.artist else track.title
+        else:
+            file_name = os.path.basename(track.path)
+        if track.duration is None:
+            return f"{file_name} [{PLACEHOLDER_TIME}]"
+        return f"{file_name} [{self.format_time(track.duration)}]"
+        
     def format_time(self, seconds):
         """Format seconds to MM:SS"""
         if seconds < 0:
@@ -84,6 +5763,106 @@ class AudioPlayer:
         return f"{mins:02d}:{secs:02d}"
         
     def create_widgets(self):
+        # Menu bar
+        menubar = tk.Menu(self.root)
+        
+        playback_menu = tk.Menu(menubar, tearoff=0)
+        self.shuffle_var = tk.BooleanVar(value=self.engine.shuffle)
+        playback_menu.add_checkbutton(
+            label="Shuffle",
+            variable=self.shuffle_var,
+            command=lambda: self.engine.set_shuffle(self.shuffle_var.get())
+        )
+        
+        repeat_menu = tk.Menu(playback_menu, tearoff=0)
+        self.repeat_var = tk.StringVar(value=self.engine.repeat)
+        for label, mode in REPEAT_MODES:
+            repeat_menu.add_radiobutton(
+                label=label,
+                variable=self.repeat_var,
+                value=mode,
+                command=lambda: self.engine.set_repeat(self.repeat_var.get())
+            )
+        playback_menu.add_cascade(label="Repeat", menu=repeat_menu)
+        playback_menu.add_separator()
+        
+        self.gapless_var = tk.BooleanVar(value=self.engine.gapless)
+        playback_menu.add_checkbutton(
+            label="Gapless playback",
+            variable=self.gapless_var,
+            command=self.change_gapless
+        )
+        
+        crossfade_menu = tk.Menu(playback_menu, tearoff=0)
+        self.crossfade_var = tk.IntVar(value=self.engine.crossfade)
+        for seconds in CROSSFADE_CHOICES:
+            crossfade_menu.add_radiobutton(
+                label=f"{seconds} s" if seconds else "Off",
+                variable=self.crossfade_var,
+                value=seconds,
+                command=self.change_crossfade
+            )
+        playback_menu.add_cascade(label="Crossfade", menu=crossfade_menu)
+        
+        loudness_menu = tk.Menu(playback_menu, tearoff=0)
+        self.gain_mode_var = tk.StringVar(value=self.engine.gain_mode)
+        for label, mode in GAIN_MODES:
+            loudness_menu.add_radiobutton(
+                label=label,
+                variable=self.gain_mode_var,
+                value=mode,
+                command=self.change_gain_mode
+            )
+        loudness_menu.add_separator()
+        loudness_menu.add_command(
+            label="Analyze playlist loudness",
+            command=self.analyze_playlist_loudness
+        )
+        playback_menu.add_cascade(label="Loudness", menu=loudness_menu)
+        playback_menu.add_command(label="Equalizer...", command=self.open_equalizer)
+        self.spectrum_var = tk.BooleanVar(value=False)
+        playback_menu.add_checkbutton(
+            label="Spectrum visualizer",
+            variable=self.spectrum_var,
+            command=self.toggle_spectrum
+        )
+        
+        menubar.add_cascade(label="Playback", menu=playback_menu)
+        
+        playlist_menu = tk.Menu(menubar, tearoff=0)
+        playlist_menu.add_command(label="Play next", command=self.play_selected_next, accelerator="Ctrl+N")
+        playlist_menu.add_separator()
+        playlist_menu.add_command(label="Find duplicates", command=lambda: self.find_duplicates(False))
+        playlist_menu.add_command(
+            label="Find duplicates, ignoring tags",
+            command=lambda: self.find_duplicates(True)
+        )
+        playlist_menu.add_separator()
+        smart_menu = tk.Menu(playlist_menu, tearoff=0)
+        for label, kind in SMART_PLAYLISTS:
+            smart_menu.add_command(
+                label=label,
+                command=lambda kind=kind: self.engine.smart_playlist(kind, self.on_smart_playlist)
+            )
+        playlist_menu.add_cascade(label="From play history", menu=smart_menu)
+        playlist_menu.add_separator()
+        playlist_menu.add_command(label="Add URL...", command=self.add_url)
+        playlist_menu.add_command(label="Import playlist...", command=self.import_playlist)
+        playlist_menu.add_command(label="Export playlist...", command=self.export_playlist)
+        playlist_menu.add_separator()
+        self.show_tags_var = tk.BooleanVar(value=False)
+        playlist_menu.add_checkbutton(
+            label="Show artist and title",
+            variable=self.show_tags_var,
+            command=lambda: self.playlist_box.redraw()
+        )
+        menubar.add_cascade(label="Playlist", menu=playlist_menu)
+        
+        debug_menu = tk.Menu(menubar, tearoff=0)
+        debug_menu.add_command(label="Performance stats", command=self.open_debug_panel)
+        menubar.add_cascade(label="Debug", menu=debug_menu)
+        self.root.config(menu=menubar)
+        
         # Title
         title_label = tk.Label(
             self.root, 
@@ -98,15 +5877,41 @@ class AudioPlayer:
         info_frame = tk.Frame(self.root, bg='#16213e', relief='ridge', bd=2)
         info_frame.pack(fill='x', padx=20, pady=5)
         
+        # Cover art left of title, artist and album
+        self.art_label = tk.Label(
+            info_frame,
+            text="🎵",
+            font=("Arial", 24),
+            fg='#0f3460',
+            bg='#16213e',
+            width=THUMBNAIL_SIZE,
+            height=THUMBNAIL_SIZE,
+            image=self.blank_cover(),
+            compound='center'
+        )
+        self.art_label.pack(side='left', padx=10, pady=5)
+        
         self.file_label = tk.Label(
             info_frame,
             text="No file selected",
-            font=("Arial", 10),
+            font=("Arial", 10, "bold"),
             fg='#ffffff',
             bg='#16213e',
-            wraplength=380
+            wraplength=320,
+            justify='left'
         )
-        self.file_label.pack(pady=10, padx=10)
+        self.file_label.pack(anchor='w', padx=5, pady=(12, 0))
+        
+        self.tags_label = tk.Label(
+            info_frame,
+            text="",
+            font=("Arial", 9),
+            fg='#a0a0c0',
+            bg='#16213e',
+            wraplength=320,
+            justify='left'
+        )
+        self.tags_label.pack(anchor='w', padx=5)
         
         # Playback status
         self.status_label = tk.Label(
@@ -118,21 +5923,17 @@ class AudioPlayer:
         )
         self.status_label.pack(pady=5)
         
-        # Progress bar style
-        style = ttk.Style()
-        style.configure("Custom.Horizontal.TProgressbar", 
-                       troughcolor='#16213e', 
-                       background='#e94560')
-        
-        # Progress bar
-        self.progress_bar = ttk.Progressbar(
+        # Waveform overview, also the progress bar; click to seek
+        self.waveform = WaveformView(
             self.root,
-            style="Custom.Horizontal.TProgressbar",
-            length=400,
-            mode='determinate',
-            maximum=100
+            on_seek=self.seek_fraction,
+            bg='#16213e',
+            played='#e94560'
         )
-        self.progress_bar.pack(pady=5)
+        self.waveform.pack(pady=5)
+        
+        # Spectrum and VU meters, packed below the waveform when turned on
+        self.spectrum = SpectrumView(self.root)
         
         # Time display - current / total
         self.time_label = tk.Label(
@@ -184,7 +5985,7 @@ class AudioPlayer:
         self.btn_prev = tk.Button(
             control_frame,
             text="⏮",
-            command=self.prev_track,
+            command=self.engine.prev_track,
             **btn_style
         )
         self.btn_prev.grid(row=0, column=1, padx=5)
@@ -193,7 +5994,7 @@ class AudioPlayer:
         self.btn_rewind = tk.Button(
             control_frame,
             text="⏪",
-            command=self.rewind,
+            command=self.engine.rewind,
             **btn_style
         )
         self.btn_rewind.grid(row=0, column=2, padx=5)
@@ -211,7 +6012,7 @@ class AudioPlayer:
         self.btn_forward = tk.Button(
             control_frame,
             text="⏩",
-            command=self.forward,
+            command=self.engine.forward,
             **btn_style
         )
         self.btn_forward.grid(row=0, column=4, padx=5)
@@ -220,7 +6021,7 @@ class AudioPlayer:
         self.btn_stop = tk.Button(
             control_frame,
             text="⏹",
-            command=self.stop,
+            command=self.engine.stop,
             **btn_style
         )
         self.btn_stop.grid(row=0, column=5, padx=5)
@@ -229,7 +6030,7 @@ class AudioPlayer:
         self.btn_next = tk.Button(
             control_frame,
             text="⏭",
-            command=self.next_track,
+            command=self.engine.next_track,
             **btn_style
         )
         self.btn_next.grid(row=0, column=6, padx=5)
@@ -277,37 +6078,61 @@ class AudioPlayer:
         playlist_frame = tk.Frame(self.root, bg='#1a1a2e')
         playlist_frame.pack(fill='both', expand=True, padx=20, pady=10)
         
+        playlist_header = tk.Frame(playlist_frame, bg='#1a1a2e')
+        playlist_header.pack(fill='x')
+        
         playlist_label = tk.Label(
-            playlist_frame,
+            playlist_header,
             text="📋 Playlist",
             font=("Arial", 12, "bold"),
             fg='#e94560',
             bg='#1a1a2e'
         )
-        playlist_label.pack(anchor='w')
+        playlist_label.pack(side='left')
+        
+        # Type-ahead search, Ctrl+F to focus and Escape to clear
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add('write', self.on_search_changed)
+        self.search_entry = tk.Entry(
+            playlist_header,
+            textvariable=self.search_var,
+            font=("Arial", 9),
+            bg='#16213e',
+            fg='white',
+            insertbackground='white',
+            relief='flat',
+            width=30
+        )
+        self.search_entry.pack(side='right', padx=5)
+        tk.Label(
+            playlist_header,
+            text="🔍",
+            font=("Arial", 10),
+            fg='white',
+            bg='#1a1a2e'
+        ).pack(side='right')
+        self.search_entry.bind('<Escape>', lambda event: self.search_var.set(""))
+        self.search_entry.bind('<Return>', self.play_first_match)
+        self.root.bind('<Control-f>', lambda event: self.search_entry.focus_set())
+        self.root.bind('<Control-n>', lambda event: self.play_selected_next())
         
-        # Playlist listbox with scrollbar
+        # Playlist view with scrollbar, only visible rows are drawn
         list_container = tk.Frame(playlist_frame, bg='#1a1a2e')
         list_container.pack(fill='both', expand=True, pady=5)
         
-        scrollbar = ttk.Scrollbar(list_container)
-        scrollbar.pack(side='right', fill='y')
-        
-        self.playlist_box = tk.Listbox(
+        # Double-click to play selected track
+        self.playlist_box = PlaylistView(
             list_container,
+            model=self.engine.playlist,
+            row_text=self.playlist_row_text,
+            on_activate=self.play_selected,
+            font=("Arial", 9),
             bg='#16213e',
             fg='white',
-            selectbackground='#e94560',
-            selectforeground='white',
-            font=("Arial", 9),
+            select_bg='#e94560',
             height=6,
-            yscrollcommand=scrollbar.set
+            is_dimmed=lambda track: track.missing
         )
-        self.playlist_box.pack(fill='both', expand=True)
-        scrollbar.config(command=self.playlist_box.yview)
-        
-        # Double-click to play selected track
-        self.playlist_box.bind('<Double-1>', self.play_selected)
         
         # Playlist control buttons
         playlist_btn_frame = tk.Frame(playlist_frame, bg='#1a1a2e')
@@ -326,7 +6151,7 @@ class AudioPlayer:
         self.btn_clear = tk.Button(
             playlist_btn_frame,
             text="🗑 Clear",
-            command=self.clear_playlist,
+            command=self.engine.clear_playlist,
             **small_btn_style
         )
         self.btn_clear.pack(side='left', padx=5)
@@ -339,6 +6164,22 @@ class AudioPlayer:
         )
         self.btn_remove.pack(side='left', padx=5)
         
+        self.btn_add_folder = tk.Button(
+            playlist_btn_frame,
+            text="📂 Add Folder",
+            command=self.open_folder,
+            **small_btn_style
+        )
+        self.btn_add_folder.pack(side='left', padx=5)
+        
+        self.btn_rescan = tk.Button(
+            playlist_btn_frame,
+            text="🔄 Rescan",
+            command=self.engine.rescan_folders,
+            **small_btn_style
+        )
+        self.btn_rescan.pack(side='left', padx=5)
+        
         # Minimize to tray button
         self.btn_tray = tk.Button(
             playlist_btn_frame,
@@ -364,185 +6205,319 @@ class AudioPlayer:
         )
         
         if file_paths:
-            # Add files to playlist
-            for file_path in file_paths:
-                if file_path not in self.playlist:
-                    self.playlist.append(file_path)
-                    # Get duration and show in playlist
-                    duration = self.get_audio_duration(file_path)
-                    file_name = os.path.basename(file_path)
-                    display_text = f"{file_name} [{self.format_time(duration)}]"
-                    self.playlist_box.insert(tk.END, display_text)
-            
-            # If nothing is playing, start first added file
-            if not self.is_playing:
-                self.current_index = len(self.playlist) - len(file_paths)
-                self.play_current()
-                
-            self.update_track_label()
+            self.engine.add_files(file_paths)
             
-    def play_current(self):
-        """Play the current track from playlist"""
-        if self.playlist and 0 <= self.current_index < len(self.playlist):
-            self.current_file = self.playlist[self.current_index]
-            file_name = os.path.basename(self.current_file)
+    def open_folder(self):
+        """Add every audio file under a folder"""
+        folder = filedialog.askdirectory(title="Select music folder")
+        if folder:
+            self.engine.scan_folder(folder)
+            
+    def add_url(self):
+        """Add a remote file or an internet radio stream and play it"""
+        url = simpledialog.askstring("Add URL", "HTTP(S) address of a file or stream:", parent=self.root)
+        if not url:
+            return
+        url = url.strip()
+        if not is_stream_url(url):
+            messagebox.showinfo("Info", "Only http:// and https:// addresses can be played")
+            return
+        self.engine.open_paths([url], play_now=True)
+        
+    def import_playlist(self):
+        """Add the tracks listed in an M3U/M3U8/PLS file"""
+        playlist_path = filedialog.askopenfilename(
+            title="Import playlist",
+            filetypes=PLAYLIST_FILETYPES
+        )
+        if playlist_path:
+            self.engine.import_playlist(playlist_path)
             
-            # Get duration
-            self.current_duration = self.get_audio_duration(self.current_file)
+    def export_playlist(self):
+        """Save the playlist as M3U8 or PLS"""
+        playlist_path = filedialog.asksaveasfilename(
+            title="Export playlist",
+            defaultextension=".m3u8",
+            filetypes=PLAYLIST_FILETYPES
+        )
+        if playlist_path:
+            self.engine.export_playlist(playlist_path)
             
-            self.file_label.config(text=f"🎵 {file_name}")
+    def blank_cover(self):
+        """Transparent image that makes the art label measure in pixels"""
+        if self.blank_image is None:
+            self.blank_image = tk.PhotoImage(width=THUMBNAIL_SIZE, height=THUMBNAIL_SIZE)
+        return self.blank_image
+        
+    def load_cover(self, file_path):
+        """Show a cached thumbnail at once, or extract one in the background"""
+        self.art_token += 1
+        try:
+            key = file_cache_key(file_path)
+        except OSError:
+            self.show_cover(self.art_token, b'')
+            return
             
+        data = self.thumbnails.get(key, load=False)
+        if data is not None:
+            self.show_cover(self.art_token, data)
+            return
+        self.show_cover(self.art_token, b'')
+        self.art_executor.submit(self.cover_worker, file_path, key, self.art_token)
+        
+    def cover_worker(self, file_path, key, token):
+        """Load a thumbnail from disk, or decode and scale the embedded cover"""
+        if token != self.art_token:
+            return
+        data = self.thumbnails.get(key)
+        if data is None:
             try:
-                pygame.mixer.music.load(self.current_file)
-                pygame.mixer.music.set_volume(self.volume)
-                pygame.mixer.music.play()
-                self.is_playing = True
-                self.is_paused = False
-                self.btn_play.config(text="⏸")
-                self.status_label.config(text="▶ Playing", fg='#00d25b')
-                
-                # Reset progress
-                self.progress_bar['value'] = 0
-                
-                # Highlight current track
-                self.playlist_box.selection_clear(0, tk.END)
-                self.playlist_box.selection_set(self.current_index)
-                self.playlist_box.see(self.current_index)
-                
-                self.update_track_label()
-                
+                cover = read_cover_art(file_path)
+                data = make_thumbnail(cover) if cover else b''
             except Exception as e:
-                messagebox.showerror("Error", f"Failed to play file:\n{e}")
-                
-    def play_selected(self, event=None):
-        """Play selected track from playlist"""
-        selection = self.playlist_box.curselection()
-        if selection:
-            self.current_index = selection[0]
-            self.play_current()
+                print(f"Error reading cover art: {e}")
+                data = b''
+            self.thumbnails.put(key, data)
+        self.engine.timers.after(0, self.show_cover, token, data)
+        
+    def show_cover(self, token, data):
+        """Show PNG thumbnail data, or the placeholder for b''"""
+        if token != self.art_token:
+            return
+        if data:
+            self.cover_image = tk.PhotoImage(data=data)
+            self.art_label.config(image=self.cover_image, text="")
+        else:
+            self.cover_image = None
+            self.art_label.config(image=self.blank_cover(), text="🎵")
             
-    def prev_track(self):
-        """Play previous track"""
-        if self.playlist:
-            self.current_index = (self.current_index - 1) % len(self.playlist)
-            self.play_current()
+    def load_waveform(self, file_path):
+        """Show cached peaks at once, or compute them in the background"""
+        self.peak_token += 1
+        self.waveform.clear()
+        with self.decoded_lock:
+            if self.decoded is not None and self.decoded[0] != file_path:
+                self.decoded = None
+        if np is None or is_stream_url(file_path):
+            return
             
-    def next_track(self):
-        """Play next track"""
-        if self.playlist:
-            self.current_index = (self.current_index + 1) % len(self.playlist)
-            self.play_current()
+        try:
+            peak_dir = os.path.join(get_app_dir(), PEAK_DIR)
+            os.makedirs(peak_dir, exist_ok=True)
+            peak_path = os.path.join(peak_dir, file_cache_key(file_path) + ".peaks")
+            peaks = PeakFile.load(peak_path) if os.path.exists(peak_path) else None
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Error reading peaks: {e}")
+            return
             
-    def rewind(self):
-        """Rewind 5 seconds"""
-        if self.is_playing and self.current_file:
-            current_pos = pygame.mixer.music.get_pos() / 1000
-            new_pos = max(0, current_pos - 5)
-            pygame.mixer.music.play(start=new_pos)
+        if peaks is not None:
+            self.waveform.set_peaks(*peaks.columns(self.waveform.width))
+            return
             
-    def forward(self):
-        """Forward 5 seconds"""
-        if self.is_playing and self.current_file:
-            current_pos = pygame.mixer.music.get_pos() / 1000
-            new_pos = min(self.current_duration, current_pos + 5)
-            if new_pos < self.current_duration:
-                pygame.mixer.music.play(start=new_pos)
+        self.peak_executor.submit(self.peak_worker, file_path, peak_path, self.peak_token)
+        if not self.peak_job_active:
+            self.peak_job_active = True
+            self.engine.timers.after(PROBE_BATCH_INTERVAL, self.flush_peak_results)
+        
+    def peak_worker(self, file_path, peak_path, token):
+        """Decode a track and reduce it to peaks, publishing partial results"""
+        if token != self.peak_token:
+            return
+        try:
+            samples, sample_rate = self.shared_pcm(file_path, keep=self.spectrum_on)
+            total = -(-len(samples) // PEAK_BLOCK)
+            mins = np.empty(total, dtype=np.int16)
+            maxs = np.empty(total, dtype=np.int16)
+            
+            chunk = PEAK_CHUNK_BLOCKS * PEAK_BLOCK
+            for start in range(0, len(samples), chunk):
+                if token != self.peak_token:
+                    return
+                block_mins, block_maxs = block_peaks(samples[start:start + chunk], PEAK_BLOCK)
+                first = start // PEAK_BLOCK
+                mins[first:first + len(block_mins)] = block_mins
+                maxs[first:first + len(block_maxs)] = block_maxs
+                self.peak_results.put((token, mins, maxs, first + len(block_mins)))
+                
+            peaks = PeakFile.from_level0(sample_rate, mins, maxs)
+            peaks.save(peak_path)
+            self.peak_results.put((token, peaks, None, None))
+        except Exception as e:
+            print(f"Error computing waveform: {e}")
+        finally:
+            self.peak_results.put((token, None, None, None))
+        
+    def shared_pcm(self, file_path, keep):
+        """Decode a track once for the waveform and the spectrum, on the peak worker
+        
+        keep: hold on to the samples for the other one; otherwise they are
+        freed once the caller is done with them.
+        """
+        with self.decoded_lock:
+            decoded = self.decoded
+        if decoded is not None and decoded[0] == file_path:
+            return decoded[1], decoded[2]
+        samples, sample_rate = decode_pcm(file_path)
+        if keep:
+            with self.decoded_lock:
+                self.decoded = (file_path, samples, sample_rate)
+        return samples, sample_rate
+        
+    def flush_peak_results(self):
+        """Draw the newest partial or final peaks on the Tk thread"""
+        latest = None
+        done = False
+        while True:
+            try:
+                result = self.peak_results.get_nowait()
+            except queue.Empty:
+                break
+            if result[0] != self.peak_token:
+                continue
+            if result[1] is None:
+                done = True
             else:
-                self.next_track()
+                latest = result
+                
+        if latest is not None:
+            _, peaks, maxs, filled = latest
+            width = self.waveform.width
+            if maxs is None:
+                self.waveform.set_peaks(*peaks.columns(width))
+            else:
+                self.waveform.set_peaks(*reduce_columns(peaks, maxs, width, len(peaks), filled))
+                
+        if done and self.peak_results.empty():
+            self.peak_job_active = False
+        else:
+            self.engine.timers.after(PROBE_BATCH_INTERVAL, self.flush_peak_results)
+        
+    def seek_fraction(self, fraction):
+        """Seek to a fraction of the current track, from a waveform click"""
+        engine = self.engine
+        if engine.is_playing and engine.current_file and engine.current_duration > 0:
+            engine.seek(fraction * engine.current_duration)
             
-    def check_music_end(self):
-        """Check if current track ended and play next"""
-        if self.is_playing and not self.is_paused:
-            if not pygame.mixer.music.get_busy():
-                # Music ended, play next
-                if self.current_index < len(self.playlist) - 1:
-                    self.current_index += 1
-                    self.play_current()
-                else:
-                    # End of playlist
-                    self.is_playing = False
-                    self.btn_play.config(text="▶")
-                    self.status_label.config(text="⏹ Finished", fg='#0f3460')
-                    self.progress_bar['value'] = 100
-                    self.time_label.config(
-                        text=f"{self.format_time(self.current_duration)} / {self.format_time(self.current_duration)}"
-                    )
-                        
-        self.root.after(500, self.check_music_end)
+    def play_selected(self, event=None):
+        """Play selected track from playlist"""
+        selection = self.playlist_box.curselection()
+        if selection:
+            index = self.playlist_index(selection[0])
+            if index is not None:
+                self.engine.play(index)
             
     def play_pause(self):
         """Toggle play/pause"""
-        if not self.playlist:
+        if not self.engine.playlist:
             messagebox.showinfo("Info", "Please select files first!")
             return
+        self.engine.play_pause()
+        
+    def play_selected_next(self):
+        """Queue the selected track to play after the current one"""
+        selection = self.playlist_box.curselection()
+        if selection:
+            index = self.playlist_index(selection[0])
+            if index is not None:
+                self.engine.play_next([index])
+                
+    def find_duplicates(self, full):
+        """Look for duplicate tracks in the background and report them"""
+        if not self.engine.playlist:
+            messagebox.showinfo("Info", "The playlist is empty")
+            return
+        self.status_label.config(text="🔎 Looking for duplicates...", fg='#ffc107')
+        self.engine.find_duplicates(self.on_duplicates_found, full)
+        
+    def on_duplicates_found(self, groups):
+        """Show duplicate groups, with a button that keeps the first of each"""
+        self.on_state_changed(self.engine_state())
+        if not groups:
+            messagebox.showinfo("Info", "No duplicates found")
+            return
             
-        if self.is_playing and not self.is_paused:
-            pygame.mixer.music.pause()
-            self.is_paused = True
-            self.btn_play.config(text="▶")
-            self.status_label.config(text="⏸ Paused", fg='#ffc107')
-        elif self.is_paused:
-            pygame.mixer.music.unpause()
-            self.is_paused = False
-            self.btn_play.config(text="⏸")
-            self.status_label.config(text="▶ Playing", fg='#00d25b')
-        else:
-            self.play_current()
+        report = tk.Toplevel(self.root)
+        report.title("Duplicates")
+        report.configure(bg='#1a1a2e')
+        text = tk.Text(
+            report,
+            width=80,
+            height=20,
+            font=("Courier", 9),
+            bg='#16213e',
+            fg='white',
+            relief='flat',
+            wrap='none'
+        )
+        text.pack(fill='both', expand=True, padx=5, pady=5)
+        extra = 0
+        for reason, paths in groups:
+            text.insert('end', f"{reason}:\n")
+            for path in paths:
+                text.insert('end', f"  {path}\n")
+            extra += len(paths) - 1
+        text.config(state='disabled')
+        
+        def remove():
+            self.engine.remove_paths([path for _, paths in groups for path in paths[1:]])
+            report.destroy()
             
-    def stop(self):
-        """Stop playback"""
-        pygame.mixer.music.stop()
-        self.is_playing = False
-        self.is_paused = False
-        self.btn_play.config(text="▶")
-        self.status_label.config(text="⏹ Stopped", fg='#0f3460')
-        self.progress_bar['value'] = 0
-        self.time_label.config(text="00:00 / 00:00")
+        tk.Button(report, text=f"Remove {extra} duplicates, keep the first of each", command=remove,
+                  bg='#0f3460', fg='white', relief='flat', cursor='hand2').pack(pady=5)
         
-    def clear_playlist(self):
-        """Clear playlist"""
-        self.stop()
-        self.playlist.clear()
-        self.playlist_box.delete(0, tk.END)
-        self.current_index = 0
-        self.current_file = None
-        self.current_duration = 0
-        self.file_label.config(text="No file selected")
-        self.update_track_label()
+    def on_smart_playlist(self, kind, paths):
+        """Add most or recently played tracks, or keep only never played ones"""
+        if kind == 'never_played':
+            if not self.engine.playlist:
+                messagebox.showinfo("Info", "The playlist is empty")
+                return
+            never_played = set(paths)
+            played = [track.path for track in self.engine.playlist if track.path not in never_played]
+            if not played:
+                messagebox.showinfo("Info", "No track in the playlist has been played")
+            elif messagebox.askyesno("Never played", f"Remove {len(played)} played tracks from the playlist?"):
+                self.engine.remove_paths(played)
+            return
+        if not paths:
+            messagebox.showinfo("Info", "No play history yet")
+            return
+        self.engine.add_files(paths)
+        
+    def engine_state(self):
+        """The engine's state as named in 'state_changed' events"""
+        if self.engine.is_paused:
+            return 'paused'
+        return 'playing' if self.engine.is_playing else 'stopped'
+        
+    def on_order_changed(self):
+        """Show shuffle and repeat, also when changed over the control API"""
+        self.shuffle_var.set(self.engine.shuffle)
+        self.repeat_var.set(self.engine.repeat)
         
     def remove_selected(self):
         """Remove selected track"""
         selection = self.playlist_box.curselection()
         if selection:
-            index = selection[0]
-            
-            if index == self.current_index and self.is_playing:
-                self.stop()
-                
-            del self.playlist[index]
-            self.playlist_box.delete(index)
-            
-            if index < self.current_index:
-                self.current_index -= 1
-            elif index == self.current_index and self.playlist:
-                if self.current_index >= len(self.playlist):
-                    self.current_index = len(self.playlist) - 1
-                    
-            self.update_track_label()
+            index = self.playlist_index(selection[0])
+            if index is not None:
+                self.engine.remove_range(index, index + 1)
             
     def update_track_label(self):
         """Update track counter"""
-        total = len(self.playlist)
-        current = self.current_index + 1 if total > 0 else 0
+        total = len(self.engine.playlist)
+        current = self.engine.current_index + 1 if total > 0 else 0
         self.track_label.config(text=f"Track: {current} / {total}")
-            
+        
     def change_volume(self, value):
         """Change volume"""
-        self.volume = float(value) / 100
-        pygame.mixer.music.set_volume(self.volume)
-        
-        volume_percent = int(float(value))
+        self.engine.set_volume(float(value) / 100)
         
+    def on_volume_changed(self, volume):
+        """Show the volume, also when it was changed from the tray"""
+        volume_percent = int(round(volume * 100))
+        if abs(self.volume_slider.get() - volume * 100) > 0.5:
+            self.volume_slider.set(volume * 100)
+            
         if hasattr(self, 'volume_label'):
             self.volume_label.config(text=f"{volume_percent}%")
         
@@ -555,34 +6530,239 @@ class AudioPlayer:
                 self.volume_icon.config(text="🔉")
             else:
                 self.volume_icon.config(text="🔊")
+                
+    def change_gain_mode(self):
+        """Switch between no normalization, track gain and album gain"""
+        self.engine.set_gain_mode(self.gain_mode_var.get())
+        
+    def analyze_playlist_loudness(self):
+        """Measure every playlist track without ReplayGain data"""
+        if np is None:
+            messagebox.showinfo("Info", "Loudness analysis needs NumPy (pip install numpy)")
+            return
+        self.engine.analyze_playlist_loudness(self.on_analysis_queued)
+        
+    def on_analysis_queued(self, count):
+        """Tell the user when no track was left to measure"""
+        if not count:
+            messagebox.showinfo("Info", "All tracks already have loudness data")
             
-    def update_progress(self):
-        """Update progress bar with actual duration"""
-        if self.is_playing and not self.is_paused:
+    def change_gapless(self):
+        """Toggle gapless playback"""
+        self.engine.set_gapless(self.gapless_var.get())
+        
+    def change_crossfade(self):
+        """Set crossfade length in seconds"""
+        self.engine.set_crossfade(self.crossfade_var.get())
+        
+    def open_equalizer(self):
+        """Window with the band, preamp and on/off controls of the equalizer"""
+        if np is None:
+            messagebox.showinfo("Info", "The equalizer needs NumPy (pip install numpy)")
+            return
+        if self.equalizer_panel is not None and self.equalizer_panel.winfo_exists():
+            self.equalizer_panel.lift()
+            return
+            
+        self.equalizer_panel = tk.Toplevel(self.root)
+        self.equalizer_panel.title("Equalizer")
+        self.equalizer_panel.configure(bg='#1a1a2e')
+        self.equalizer_panel.resizable(False, False)
+        
+        enabled_var = tk.BooleanVar(value=self.engine.dsp is not None)
+        tk.Checkbutton(
+            self.equalizer_panel,
+            text="Enable equalizer",
+            variable=enabled_var,
+            command=lambda: self.engine.set_equalizer(enabled_var.get()),
+            bg='#1a1a2e',
+            fg='white',
+            selectcolor='#16213e',
+            activebackground='#1a1a2e',
+            activeforeground='white'
+        ).pack(anchor='w', padx=10, pady=5)
+        
+        bands_frame = tk.Frame(self.equalizer_panel, bg='#1a1a2e')
+        bands_frame.pack(padx=10)
+        
+        def apply(value=None):
+            self.engine.set_equalizer_gains([var.get() for var in band_vars], preamp_var.get())
+            
+        def add_scale(label, variable, column):
+            tk.Scale(
+                bands_frame,
+                from_=EQ_MAX_DB,
+                to=-EQ_MAX_DB,
+                resolution=0.5,
+                variable=variable,
+                command=apply,
+                length=160,
+                width=12,
+                showvalue=False,
+                bg='#1a1a2e',
+                fg='white',
+                troughcolor='#16213e',
+                highlightthickness=0
+            ).grid(row=0, column=column)
+            tk.Label(bands_frame, text=label, font=("Arial", 8), bg='#1a1a2e', fg='white').grid(row=1, column=column)
+            
+        preamp_var = tk.DoubleVar(value=self.engine.eq_preamp)
+        add_scale("Pre", preamp_var, 0)
+        band_vars = []
+        for column, (freq, gain) in enumerate(zip(EQ_BANDS, self.engine.eq_gains), 1):
+            var = tk.DoubleVar(value=gain)
+            band_vars.append(var)
+            add_scale(f"{freq // 1000}k" if freq >= 1000 else str(freq), var, column)
+            
+        def reset():
+            for var in band_vars:
+                var.set(0.0)
+            preamp_var.set(0.0)
+            apply()
+            
+        tk.Button(self.equalizer_panel, text="Reset", command=reset, bg='#0f3460', fg='white',
+                  relief='flat', cursor='hand2').pack(pady=5)
+        
+    def toggle_spectrum(self):
+        """Show or hide the spectrum visualizer"""
+        if self.spectrum_var.get() and np is None:
+            messagebox.showinfo("Info", "The spectrum visualizer needs NumPy (pip install numpy)")
+            self.spectrum_var.set(False)
+            return
+        self.spectrum_on = self.spectrum_var.get()
+        if self.spectrum_on:
+            self.spectrum.pack(pady=(0, 5), before=self.time_label)
+        else:
+            self.spectrum.pack_forget()
+            # Don't hold on to a decoded track nobody looks at
+            self.spectrum_file = None
+            self.spectrum_pcm = None
+            with self.decoded_lock:
+                self.decoded = None
+        self.update_spectrum_running()
+        
+    def update_spectrum_running(self):
+        """Run spectrum frames only while the visualizer is on, visible and playing"""
+        running = (
+            self.spectrum_var.get()
+            and not self.hidden
+            and self.engine.is_playing
+            and not self.engine.is_paused
+        )
+        if running and self.spectrum_job is None:
+            self.spectrum_job = self.engine.timers.after(0, self.spectrum_frame)
+        elif not running and self.spectrum_job is not None:
+            self.engine.timers.after_cancel(self.spectrum_job)
+            self.spectrum_job = None
+            self.spectrum.clear()
+            
+    def spectrum_samples(self):
+        """(samples, sample rate) of the playing track, or None until decoded"""
+        pcm = self.engine.playing_pcm()
+        if pcm is not None:
+            return pcm
+        if is_stream_url(self.engine.current_file or ''):
+            return None
+        if self.spectrum_file != self.engine.current_file:
+            self.spectrum_file = self.engine.current_file
+            self.spectrum_pcm = None
+            self.peak_executor.submit(self.spectrum_worker, self.spectrum_file)
+        return self.spectrum_pcm
+        
+    def spectrum_worker(self, file_path):
+        """Decode a track for the visualizer in the background"""
+        if file_path != self.spectrum_file:
+            return
+        try:
+            samples, sample_rate = self.shared_pcm(file_path, keep=self.spectrum_on)
+        except Exception as e:
+            print(f"Error decoding for the spectrum: {e}")
+            return
+        self.engine.timers.after(0, self.set_spectrum_pcm, file_path, samples, sample_rate)
+        
+    def set_spectrum_pcm(self, file_path, samples, sample_rate):
+        if file_path == self.spectrum_file:
+            self.spectrum_pcm = (samples, sample_rate)
+            
+    def spectrum_frame(self):
+        """Draw one visualizer frame, then wait long enough to stay within budget"""
+        started = time.perf_counter()
+        pcm = self.spectrum_samples()
+        if pcm is not None:
+            samples, sample_rate = pcm
+            if self.spectrum_analyzer is None or self.spectrum_analyzer.sample_rate != sample_rate:
+                self.spectrum_analyzer = SpectrumAnalyzer(sample_rate)
+            position = int(self.engine.get_position() * sample_rate)
+            self.spectrum.set_levels(*self.spectrum_analyzer.levels(samples, position))
+        PERF.record('spectrum frame', started)
+        
+        # A slow frame pushes the next one back, so position ticks always get through
+        cost = int((time.perf_counter() - started) * 1000 * SPECTRUM_BUDGET)
+        if cost > SPECTRUM_FRAME_MS:
+            PERF.count('spectrum frames slowed')
+        self.spectrum_job = self.engine.timers.after(max(SPECTRUM_FRAME_MS, cost), self.spectrum_frame)
+        
+    def on_position(self, position, duration):
+        """Show position / duration, touching widgets only when the text or bar changes"""
+        time_text = f"{self.format_time(position)} / {self.format_time(duration)}"
+        if time_text != self.shown_time:
+            self.time_label.config(text=time_text)
+            self.shown_time = time_text
+            
+        # The waveform only recolours columns that crossed the playhead
+        fraction = min(position / duration, 1) if duration > 0 else 0
+        self.waveform.set_progress(fraction)
+        
+    def open_debug_panel(self):
+        """Window with live hot-path timings; opening it turns instrumentation on"""
+        PERF.enable(self.root)
+        if self.debug_panel is not None and self.debug_panel.winfo_exists():
+            self.debug_panel.lift()
+            return
+            
+        self.debug_panel = tk.Toplevel(self.root)
+        self.debug_panel.title("Performance stats")
+        self.debug_panel.configure(bg='#1a1a2e')
+        
+        text = tk.Text(
+            self.debug_panel,
+            width=70,
+            height=24,
+            font=("Courier", 9),
+            bg='#16213e',
+            fg='white',
+            relief='flat'
+        )
+        text.pack(fill='both', expand=True, padx=5, pady=5)
+        
+        button_frame = tk.Frame(self.debug_panel, bg='#1a1a2e')
+        button_frame.pack(pady=5)
+        tk.Button(button_frame, text="Reset", command=PERF.reset, bg='#0f3460', fg='white',
+                  relief='flat', cursor='hand2').pack(side='left', padx=5)
+        tk.Button(button_frame, text="Save JSON", command=self.save_perf_stats, bg='#0f3460', fg='white',
+                  relief='flat', cursor='hand2').pack(side='left', padx=5)
+        
+        def refresh():
+            if not text.winfo_exists():
+                return
+            text.delete('1.0', 'end')
+            text.insert('1.0', PERF.report())
+            self.root.after(DEBUG_REFRESH_MS, refresh)
+            
+        refresh()
+        
+    def save_perf_stats(self):
+        path = filedialog.asksaveasfilename(
+            title="Save performance stats",
+            defaultextension=".json",
+            filetypes=[("JSON files", "*.json")]
+        )
+        if path:
             try:
-                # Get current position in milliseconds
-                current_pos_ms = pygame.mixer.music.get_pos()
-                
-                if current_pos_ms > 0 and self.current_duration > 0:
-                    # Convert to seconds
-                    current_sec = current_pos_ms / 1000
-                    
-                    # Calculate progress percentage
-                    progress = (current_sec / self.current_duration) * 100
-                    progress = min(progress, 100)  # Cap at 100%
-                    
-                    self.progress_bar['value'] = progress
-                    
-                    # Update time display
-                    self.time_label.config(
-                        text=f"{self.format_time(current_sec)} / {self.format_time(self.current_duration)}"
-                    )
-                    
-            except Exception:
-                pass
+                PERF.dump(path)
+            except OSError as e:
+                messagebox.showerror("Error", f"Failed to save stats:\n{e}")
                 
-        self.root.after(50, self.update_progress)  # Update more frequently for smoother progress
-        
     def create_tray_icon(self):
         """Create tray icon"""
         icon_size = 64
@@ -600,8 +6780,11 @@ class AudioPlayer:
         """Minimize to tray"""
         self.root.withdraw()
         self.hidden = True
+        self.engine.set_progress_ticks(None)
+        self.update_spectrum_running()
         
         if self.tray_icon is None:
+            item = pystray.MenuItem
             menu = (
                 item('▶ Play/Pause', self.tray_play_pause),
                 item('⏹ Stop', self.tray_stop),
@@ -632,31 +6815,43 @@ class AudioPlayer:
         self.root.lift()
         self.root.focus_force()
         self.hidden = False
+        self.root.after(0, self.engine.set_progress_ticks, self.waveform.winfo_width())
+        self.root.after(0, self.update_spectrum_running)
         
     def tray_play_pause(self, icon=None, item=None):
-        self.root.after(0, self.play_pause)
+        self.root.after(0, self.engine.play_pause)
         
     def tray_stop(self, icon=None, item=None):
-        self.root.after(0, self.stop)
+        self.root.after(0, self.engine.stop)
         
     def tray_prev(self, icon=None, item=None):
-        self.root.after(0, self.prev_track)
+        self.root.after(0, self.engine.prev_track)
         
     def tray_next(self, icon=None, item=None):
-        self.root.after(0, self.next_track)
+        self.root.after(0, self.engine.next_track)
         
     def tray_volume_up(self, icon=None, item=None):
-        new_volume = min(100, self.volume * 100 + 10)
-        self.root.after(0, lambda: self.volume_slider.set(new_volume))
+        self.root.after(0, lambda: self.engine.set_volume(self.engine.volume + VOLUME_STEP))
         
     def tray_volume_down(self, icon=None, item=None):
-        new_volume = max(0, self.volume * 100 - 10)
-        self.root.after(0, lambda: self.volume_slider.set(new_volume))
+        self.root.after(0, lambda: self.engine.set_volume(self.engine.volume - VOLUME_STEP))
         
     def quit_app(self, icon=None, item=None):
         """Exit app"""
-        pygame.mixer.music.stop()
-        pygame.mixer.quit()
+        self.peak_token += 1
+        self.peak_executor.shutdown(wait=False, cancel_futures=True)
+        self.art_token += 1
+        self.art_executor.shutdown(wait=False, cancel_futures=True)
+        self.engine.shutdown()
+        if self.perf_stats_path:
+            try:
+                PERF.dump(self.perf_stats_path)
+            except OSError as e:
+                print(f"Error saving performance stats: {e}")
+        if self.control is not None:
+            self.control.close()
+        if self.instance is not None:
+            self.instance.close()
         
         if self.tray_icon:
             self.tray_icon.stop()
@@ -670,6 +6865,78 @@ class AudioPlayer:
         self.root.mainloop()
 
 
+def run_headless(paths, perf_stats=None):
+    """Play paths without a window, printing engine events with timestamps"""
+    timers = HeadlessTimers()
+    engine = PlayerEngine(timers)
+    if perf_stats:
+        PERF.enable(timers)
+    started = time.perf_counter()
+    
+    def log(event, *args):
+        if event == 'position':
+            return
+        if event == 'track_changed':
+            args = (engine.current_file,)
+        details = ' '.join(str(arg) for arg in args)
+        print(f"{time.perf_counter() - started:9.3f}  {event} {details}", flush=True)
+        if event == 'error' or (event == 'state_changed' and args[0] == 'finished'):
+            timers.quit()
+            
+    engine.subscribe(log)
+    timers.after(0, engine.open_paths, paths)
+    try:
+        timers.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.shutdown()
+        if perf_stats:
+            PERF.dump(perf_stats)
+
+
 if __name__ == "__main__":
-    player = AudioPlayer()
-    player.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Simple audio player")
+    parser.add_argument("paths", nargs="*", help="audio files or folders to add")
+    parser.add_argument("--play", action="store_true",
+                        help="play the first file now instead of appending it to the playlist")
+    parser.add_argument("--new-instance", action="store_true",
+                        help="start another player instead of handing the files to a running one")
+    parser.add_argument("--headless", action="store_true",
+                        help="play the paths without a window and print playback events")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="print how long each import and init phase took")
+    parser.add_argument("--perf-stats", metavar="FILE",
+                        help="collect hot-path timings and write them to FILE as JSON on exit")
+    args = parser.parse_args()
+    STARTUP.mark("module loaded")
+    if args.startup_profile:
+        STARTUP.enable()
+    
+    if args.headless:
+        if not args.paths:
+            parser.error("--headless needs files or folders to play")
+        run_headless(args.paths, args.perf_stats)
+        sys.exit()
+        
+    # A player is already running: give it the files and exit
+    instance = None
+    if not args.new_instance:
+        instance = SingleInstance(get_app_dir())
+        if not instance.acquire():
+            message = {
+                'action': 'play' if args.play else 'append',
+                'paths': [path if is_stream_url(path) else os.path.abspath(path) for path in args.paths],
+            }
+            if instance.send(message):
+                sys.exit()
+            print("The running player did not answer, starting another one")
+            instance = None
+            
+    player = AudioPlayer(instance)
+    if args.perf_stats:
+        PERF.enable(player.root)
+        player.perf_stats_path = args.perf_stats
+    if args.paths:
+        player.root.after(0, player.engine.open_paths, args.paths, args.play)
+    player.run()
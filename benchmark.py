@@ -0,0 +1,654 @@
+"""Benchmarks for the audio player's hot paths
+
+Runs headless with SDL's dummy audio driver on a synthetic library
+generated in a temporary folder, writes the results as JSON and flags
+regressions against a saved baseline:
+
+    python benchmark.py --output results.json
+    python benchmark.py --baseline baseline.json
+    python benchmark.py --baseline baseline.json --update-baseline
+"""
+import os
+import sys
+
+# Must be set before pygame is imported
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import argparse
+import json
+import math
+import platform
+import queue
+import re
+import shutil
+import statistics
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+import audioplayer
+
+# Synthetic library
+SAMPLE_RATE = 44100
+TONE_HZ = 440
+FILE_SECONDS = 1.0  # length of the probed files
+LONG_SECONDS = 30.0  # length of the track played during the CPU benchmark
+FILES_PER_FORMAT = 200
+FLAC_BLOCK_SIZE = 4096
+ADD_SIZES = (1000, 10000, 100000)
+
+# Measurement
+IMPORT_RUNS = 5
+SWITCH_RUNS = 50
+IDLE_SECONDS = 5.0
+DSP_SECONDS = 60.0  # audio run through the equalizer
+DSP_RATE = 48000
+STREAM_RUNS = 20  # tracks played one after another over HTTP
+STREAM_SLOW_SECONDS = 5.0  # playback from a server only a little faster than the track
+STREAM_SLOW_RATE = 1.25  # that server's speed relative to the track's byte rate
+STREAM_WAIT = 10.0  # seconds to wait for a stream to start
+REGRESSION_THRESHOLD = 0.2  # relative change that counts as a regression
+
+# name -> (unit, higher is better, changes smaller than this are noise)
+METRICS = {
+    'import_ms': ("ms", False, 5.0),
+    'first_frame_ms': ("ms", False, 10.0),
+    'probe_wav_files_per_s': ("files/s", True, 0.0),
+    'probe_flac_files_per_s': ("files/s", True, 0.0),
+    'probe_ogg_files_per_s': ("files/s", True, 0.0),
+    'probe_cached_files_per_s': ("files/s", True, 0.0),
+    'add_1000_ms': ("ms", False, 2.0),
+    'add_10000_ms': ("ms", False, 5.0),
+    'add_100000_ms': ("ms", False, 20.0),
+    'bytes_per_track': ("bytes", False, 8.0),
+    'switch_median_ms': ("ms", False, 1.0),
+    'switch_p95_ms': ("ms", False, 2.0),
+    'cpu_stopped_percent': ("%", False, 0.5),
+    'cpu_playing_hidden_percent': ("%", False, 0.5),
+    'cpu_playing_visible_percent': ("%", False, 0.5),
+    'wakeups_visible_per_s': ("1/s", False, 2.0),
+    'dsp_cpu_percent': ("%", False, 0.5),
+    'stream_start_ms': ("ms", False, 5.0),
+    'stream_seek_ms': ("ms", False, 5.0),
+    'stream_connections_per_track': ("conn", False, 0.5),
+    'stream_underruns': ("reads", False, 1.0),
+}
+
+
+def tone(seconds, channels=2):
+    """Deterministic 16-bit sine samples, interleaved"""
+    frames = int(seconds * SAMPLE_RATE)
+    step = 2 * math.pi * TONE_HZ / SAMPLE_RATE
+    samples = []
+    for i in range(frames):
+        value = int(8000 * math.sin(i * step))
+        samples.extend([value] * channels)
+    return samples
+
+
+def write_wav(path, samples, channels=2):
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(struct.pack(f'<{len(samples)}h', *samples))
+
+
+def crc8(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+CRC16_TABLE = []
+for _byte in range(256):
+    _crc = _byte << 8
+    for _ in range(8):
+        _crc = ((_crc << 1) ^ 0x8005) & 0xFFFF if _crc & 0x8000 else (_crc << 1) & 0xFFFF
+    CRC16_TABLE.append(_crc)
+
+
+def crc16(data):
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC16_TABLE[(crc >> 8) ^ byte]
+    return crc
+
+
+def utf8_number(value):
+    """FLAC's UTF-8 style coding of the frame number"""
+    if value < 0x80:
+        return bytes([value])
+    length = 2
+    while value >= 1 << (5 * length + 1):
+        length += 1
+    out = []
+    for _ in range(length - 1):
+        out.append(0x80 | (value & 0x3F))
+        value >>= 6
+    lead = (0xFF << (8 - length)) & 0xFF
+    out.append(lead | value)
+    return bytes(reversed(out))
+
+
+def write_flac(path, samples, channels=2):
+    """Uncompressed FLAC: fixed-size frames of VERBATIM subframes
+    
+    Good enough for the decoders and mutagen, and needs no encoder to be
+    installed.
+    """
+    frames = len(samples) // channels
+    info = struct.pack('>HH', FLAC_BLOCK_SIZE, FLAC_BLOCK_SIZE) + b'\0' * 6
+    packed = (SAMPLE_RATE << 44) | ((channels - 1) << 41) | (15 << 36) | frames
+    info += packed.to_bytes(8, 'big') + b'\0' * 16
+    
+    with open(path, 'wb') as f:
+        f.write(b'fLaC')
+        f.write(bytes([0x80]) + len(info).to_bytes(3, 'big') + info)
+        
+        for number, start in enumerate(range(0, frames, FLAC_BLOCK_SIZE)):
+            count = min(FLAC_BLOCK_SIZE, frames - start)
+            # Sync, fixed blocking, 16-bit block size at end of header,
+            # 44.1 kHz, independent channels, 16 bits per sample
+            header = bytes([0xFF, 0xF8, 0x79, ((channels - 1) << 4) | 0x08])
+            header += utf8_number(number) + struct.pack('>H', count - 1)
+            header += bytes([crc8(header)])
+            
+            body = bytearray()
+            block = samples[start * channels:(start + count) * channels]
+            for channel in range(channels):
+                body.append(0x02)  # VERBATIM subframe, no wasted bits
+                channel_samples = block[channel::channels]
+                body += struct.pack(f'>{len(channel_samples)}h', *channel_samples)
+            frame = header + bytes(body)
+            f.write(frame + struct.pack('>H', crc16(frame)))
+
+
+def ogg_encoder():
+    """Command line that turns a WAV into Ogg Vorbis, or None"""
+    if shutil.which('oggenc'):
+        return lambda src, dst: ['oggenc', '-Q', '-o', dst, src]
+    if shutil.which('ffmpeg'):
+        return lambda src, dst: ['ffmpeg', '-v', 'quiet', '-y', '-i', src, '-c:a', 'libvorbis', dst]
+    return None
+
+
+def make_library(root):
+    """Create FILES_PER_FORMAT short files per format, return {format: [paths]}"""
+    samples = tone(FILE_SECONDS)
+    library = {}
+    
+    wav_dir = os.path.join(root, 'wav')
+    os.makedirs(wav_dir)
+    source = os.path.join(root, 'tone.wav')
+    write_wav(source, samples)
+    library['wav'] = []
+    for i in range(FILES_PER_FORMAT):
+        path = os.path.join(wav_dir, f'{i:05d}.wav')
+        shutil.copyfile(source, path)
+        library['wav'].append(path)
+        
+    flac_dir = os.path.join(root, 'flac')
+    os.makedirs(flac_dir)
+    flac_source = os.path.join(root, 'tone.flac')
+    write_flac(flac_source, samples)
+    library['flac'] = []
+    for i in range(FILES_PER_FORMAT):
+        path = os.path.join(flac_dir, f'{i:05d}.flac')
+        shutil.copyfile(flac_source, path)
+        library['flac'].append(path)
+        
+    encoder = ogg_encoder()
+    if encoder is not None:
+        ogg_source = os.path.join(root, 'tone.ogg')
+        result = subprocess.run(encoder(source, ogg_source))
+        if result.returncode == 0:
+            ogg_dir = os.path.join(root, 'ogg')
+            os.makedirs(ogg_dir)
+            library['ogg'] = []
+            for i in range(FILES_PER_FORMAT):
+                path = os.path.join(ogg_dir, f'{i:05d}.ogg')
+                shutil.copyfile(ogg_source, path)
+                library['ogg'].append(path)
+    return library
+
+
+def link_many(source, folder, count):
+    """count paths to the same file, hard links where the filesystem allows"""
+    os.makedirs(folder)
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f'{i:06d}.wav')
+        try:
+            os.link(source, path)
+        except OSError:
+            shutil.copyfile(source, path)
+        paths.append(path)
+    return paths
+
+
+def subprocess_env(app_home):
+    env = dict(os.environ)
+    env['HOME'] = env['USERPROFILE'] = app_home
+    env['SDL_AUDIODRIVER'] = 'dummy'
+    env['PYTHONPATH'] = REPO_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+
+def bench_import(env):
+    """Median time of a cold import of the module, in a fresh interpreter"""
+    code = (
+        "import time; started = time.perf_counter(); import audioplayer; "
+        "print((time.perf_counter() - started) * 1000)"
+    )
+    runs = []
+    for _ in range(IMPORT_RUNS):
+        output = subprocess.run([sys.executable, '-c', code], env=env,
+                                capture_output=True, text=True, check=True).stdout
+        runs.append(float(output.strip().splitlines()[-1]))
+    return statistics.median(runs)
+
+
+def bench_first_frame(env):
+    """Milliseconds from the first line of the module to the first drawn frame, or None"""
+    code = (
+        "import audioplayer\n"
+        "player = audioplayer.AudioPlayer()\n"
+        "def report():\n"
+        "    for name, started, finished in audioplayer.STARTUP.phases:\n"
+        "        if name == 'first frame':\n"
+        "            print((finished - audioplayer.STARTUP_STARTED) * 1000)\n"
+        "    player.quit_app()\n"
+        "player.root.after(0, report)\n"
+        "player.run()\n"
+    )
+    result = subprocess.run([sys.executable, '-c', code], env=env,
+                            capture_output=True, text=True)
+    lines = result.stdout.strip().splitlines()
+    try:
+        return float(lines[-1])
+    except (IndexError, ValueError):
+        # No display to open a window on
+        return None
+
+
+def new_engine():
+    timers = audioplayer.HeadlessTimers()
+    engine = audioplayer.PlayerEngine(timers)
+    engine.mixer_ready.wait()
+    return timers, engine
+
+
+def bench_probe(library):
+    """get_audio_duration throughput per format without cache, then from the cache"""
+    results = {}
+    _, engine = new_engine()
+    cache = engine.metadata_cache
+    
+    engine.metadata_cache = None
+    for fmt in ('wav', 'flac', 'ogg'):
+        paths = library.get(fmt)
+        if not paths:
+            results[f'probe_{fmt}_files_per_s'] = None
+            continue
+        started = time.perf_counter()
+        for path in paths:
+            engine.get_audio_duration(path)
+        results[f'probe_{fmt}_files_per_s'] = len(paths) / (time.perf_counter() - started)
+        
+    engine.metadata_cache = cache
+    paths = library['wav']
+    for path in paths:
+        engine.get_audio_duration(path)
+    cache.flush()
+    started = time.perf_counter()
+    for path in paths:
+        engine.get_audio_duration(path)
+    results['probe_cached_files_per_s'] = len(paths) / (time.perf_counter() - started)
+    
+    engine.shutdown()
+    return results
+
+
+def bench_add(root, source):
+    """Latency of adding a batch of tracks, as open_files does"""
+    results = {}
+    for size in ADD_SIZES:
+        paths = link_many(source, os.path.join(root, f'add{size}'), size)
+        _, engine = new_engine()
+        engine.is_playing = True  # measure the add, not starting playback
+        started = time.perf_counter()
+        engine.add_files(paths)
+        results[f'add_{size}_ms'] = (time.perf_counter() - started) * 1000
+        engine.is_playing = False
+        engine.clear_playlist()
+        engine.shutdown()
+    return results
+
+
+def bench_memory():
+    """Bytes a playlist entry costs on top of its path string"""
+    count = 100000
+    paths = [f'/music/artist {i // 100}/track {i:06d}.mp3' for i in range(count)]
+    playlist = audioplayer.Playlist()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    playlist.extend(paths)
+    for i in range(0, count, 1000):
+        playlist.index_of(paths[i])
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {'bytes_per_track': (after - before) / count}
+
+
+def bench_switch(library):
+    """play_current latency when changing tracks"""
+    _, engine = new_engine()
+    paths = library['wav'][:10] + library['flac'][:10]
+    engine.add_files(paths)
+    
+    runs = []
+    for i in range(SWITCH_RUNS + 1):
+        engine.current_index = i % len(paths)
+        started = time.perf_counter()
+        engine.play_current()
+        runs.append((time.perf_counter() - started) * 1000)
+    runs = sorted(runs[1:])  # the first switch also warms up the decoder
+    engine.stop()
+    engine.shutdown()
+    return {
+        'switch_median_ms': statistics.median(runs),
+        'switch_p95_ms': runs[int(len(runs) * 0.95) - 1],
+    }
+
+
+def cpu_while(timers, engine, seconds):
+    """CPU share of the timer thread and its wakeups per second over seconds"""
+    wakeups = [0]
+    engine.subscribe(lambda event, *args: wakeups.__setitem__(0, wakeups[0] + 1))
+    timers.after(int(seconds * 1000), timers.quit)
+    started = time.thread_time()
+    timers.run()
+    cpu = time.thread_time() - started
+    return cpu / seconds * 100, wakeups[0] / seconds
+
+
+def bench_idle_cpu(long_track):
+    """Cost of the after() loops: stopped, playing hidden and playing visible"""
+    results = {}
+    timers, engine = new_engine()
+    results['cpu_stopped_percent'], _ = cpu_while(timers, engine, IDLE_SECONDS)
+    
+    engine.add_files([long_track])
+    results['cpu_playing_hidden_percent'], _ = cpu_while(timers, engine, IDLE_SECONDS)
+    
+    engine.set_progress_ticks(audioplayer.WAVEFORM_WIDTH)
+    cpu, wakeups = cpu_while(timers, engine, IDLE_SECONDS)
+    results['cpu_playing_visible_percent'] = cpu
+    results['wakeups_visible_per_s'] = wakeups
+    
+    engine.stop()
+    engine.shutdown()
+    return results
+
+
+def bench_dsp():
+    """CPU share of one core the equalizer needs for 48 kHz stereo"""
+    np = audioplayer.np
+    if np is None:
+        return {'dsp_cpu_percent': None}
+    block = audioplayer.DSP_BLOCK
+    chain = audioplayer.DspChain(DSP_RATE, 2)
+    samples = (np.random.default_rng(0).standard_normal((DSP_RATE, 2)) * 3000).astype(np.int16)
+    out = np.empty((block, 2), dtype=np.int16)
+    blocks = int(DSP_SECONDS * DSP_RATE / block)
+    
+    started = time.process_time()
+    for i in range(blocks):
+        if i % 50 == 0:
+            # Move the sliders now and then, so crossfades are part of the cost
+            chain.set_gains([(i // 50 + band) % 7 - 3 for band in range(10)], -2)
+        start = i * block % (DSP_RATE - block)
+        chain.process(samples[start:start + block], out)
+    cpu = time.process_time() - started
+    return {'dsp_cpu_percent': cpu / (blocks * block / DSP_RATE) * 100}
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """Local stand-in for a media server: files under root, with ranges and keep-alive
+    
+    rate limits the bytes per second sent, None sends as fast as possible.
+    """
+    
+    protocol_version = "HTTP/1.1"
+    root = None
+    rate = None
+    connections = 0
+    
+    def setup(self):
+        type(self).connections += 1
+        super().setup()
+        
+    def log_message(self, format, *args):
+        pass
+        
+    def do_GET(self):
+        path = os.path.join(self.root, *self.path.lstrip('/').split('/'))
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.send_error(404)
+            return
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+        start, end = 0, len(data)
+        if match and match.group(1):
+            start = int(match.group(1))
+            end = int(match.group(2)) + 1 if match.group(2) else len(data)
+        elif match and match.group(2):
+            start = max(0, len(data) - int(match.group(2)))
+        if match:
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end - 1}/{len(data)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'audio/wav')
+        self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+        try:
+            if self.rate is None:
+                self.wfile.write(data[start:end])
+                return
+            step = max(1, int(self.rate / 20))
+            for offset in range(start, end, step):
+                self.wfile.write(data[offset:min(offset + step, end)])
+                time.sleep(0.05)
+        except OSError:
+            pass  # the player moved on
+
+
+class QuietServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        pass  # connections the player drops mid-response
+
+
+def on_timer_thread(timers, function, *args):
+    """Run function on the engine's timer thread and return its result"""
+    done = threading.Event()
+    result = []
+    timers.after(0, lambda: (result.append(function(*args)), done.set()))
+    done.wait()
+    return result[0]
+
+
+def wait_for_state(states, wanted):
+    """Seconds until the engine reports state wanted"""
+    started = time.perf_counter()
+    while True:
+        if states.get(timeout=STREAM_WAIT) == wanted:
+            return time.perf_counter() - started
+
+
+def bench_stream(root, library, long_track):
+    """HTTP playback from a local server: start and seek latency, connection reuse, underruns"""
+    RangeRequestHandler.root = root
+    RangeRequestHandler.rate = None
+    server = QuietServer(('127.0.0.1', 0), RangeRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}/"
+    url_of = lambda path: base + os.path.relpath(path, root).replace(os.sep, '/')
+    
+    timers, engine = new_engine()
+    threading.Thread(target=timers.run, daemon=True).start()
+    states = queue.Queue()
+    engine.subscribe(lambda event, *args: states.put(args[0]) if event == 'state_changed' else None)
+    results = {}
+    try:
+        engine.is_playing = True  # keep add_files from starting playback
+        on_timer_thread(timers, engine.add_files, [url_of(path) for path in library['wav'][:STREAM_RUNS]])
+        engine.is_playing = False
+        while any(track.duration is None for track in engine.playlist):
+            time.sleep(0.05)  # let the background probes finish before counting connections
+        runs = []
+        connections = None
+        for i in range(STREAM_RUNS):
+            on_timer_thread(timers, engine.play, i)
+            wait_for_state(states, 'buffering')
+            runs.append(wait_for_state(states, 'playing') * 1000)
+            if i == 0:
+                connections = RangeRequestHandler.connections
+        results['stream_start_ms'] = statistics.median(runs)
+        results['stream_connections_per_track'] = (
+            (RangeRequestHandler.connections - connections) / (STREAM_RUNS - 1)
+        )
+        
+        on_timer_thread(timers, engine.add_files, [url_of(long_track)])
+        on_timer_thread(timers, engine.play, STREAM_RUNS)
+        wait_for_state(states, 'playing')
+        while not engine.current_duration:
+            time.sleep(0.05)  # the probe with the duration arrives after the start
+        seeks = []
+        for i in range(SWITCH_RUNS):
+            position = (i * 7919 % 1000) / 1000 * (engine.current_duration - 1)
+            started = time.perf_counter()
+            on_timer_thread(timers, engine.seek, position)
+            seeks.append((time.perf_counter() - started) * 1000)
+        results['stream_seek_ms'] = statistics.median(seeks)
+        
+        # A slow link: the read-ahead has to keep up on its own
+        with wave.open(long_track) as f:
+            byte_rate = f.getframerate() * f.getnchannels() * f.getsampwidth()
+        RangeRequestHandler.rate = byte_rate * STREAM_SLOW_RATE
+        on_timer_thread(timers, engine.stop)
+        underruns = engine.buffer_underruns()
+        on_timer_thread(timers, engine.play, STREAM_RUNS)
+        wait_for_state(states, 'playing')
+        time.sleep(STREAM_SLOW_SECONDS)
+        results['stream_underruns'] = engine.buffer_underruns() - underruns
+    finally:
+        on_timer_thread(timers, engine.shutdown)
+        timers.quit()
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the change of every metric, return the names that regressed"""
+    regressions = []
+    print(f"{'metric':32} {'baseline':>12} {'now':>12} {'change':>8}")
+    for name, (unit, higher_is_better, noise) in METRICS.items():
+        old, new = baseline.get(name), results.get(name)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        flag = ""
+        if worse > threshold and abs(new - old) > noise:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:32} {old:12.2f} {new:12.2f} {change * 100:7.1f}%{flag}")
+    return regressions
+
+
+def run(skip_first_frame=False):
+    results = {}
+    work = tempfile.mkdtemp(prefix="audioplayer-bench-")
+    try:
+        # Keep the player's caches out of the real app dir
+        app_home = os.path.join(work, 'home')
+        os.makedirs(app_home)
+        audioplayer.APP_DIR = os.path.join(app_home, '.audioplayer')
+        env = subprocess_env(app_home)
+        
+        results['import_ms'] = bench_import(env)
+        results['first_frame_ms'] = None if skip_first_frame else bench_first_frame(env)
+        
+        library = make_library(os.path.join(work, 'library'))
+        long_track = os.path.join(work, 'long.wav')
+        write_wav(long_track, tone(LONG_SECONDS, channels=1), channels=1)
+        
+        results.update(bench_probe(library))
+        results.update(bench_add(work, library['wav'][0]))
+        results.update(bench_memory())
+        results.update(bench_switch(library))
+        results.update(bench_idle_cpu(long_track))
+        results.update(bench_dsp())
+        results.update(bench_stream(work, library, long_track))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the audio player headless")
+    parser.add_argument("--output", default="benchmark-results.json",
+                        help="where to write the results (default: %(default)s)")
+    parser.add_argument("--baseline", help="results to compare against")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="save the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="relative change that counts as a regression (default: %(default)s)")
+    parser.add_argument("--skip-first-frame", action="store_true",
+                        help="don't open a window to time the first frame")
+    args = parser.parse_args()
+    
+    results = run(args.skip_first_frame)
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+        
+    for name, value in results.items():
+        unit = METRICS[name][0]
+        print(f"{name:32} {'-' if value is None else f'{value:.2f}':>12} {unit}")
+    print(f"Results written to {args.output}")
+    
+    failed = False
+    if args.baseline and os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        print()
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            failed = True
+    if args.baseline and args.update_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"Baseline updated: {args.baseline}")
+        
+    sys.exit(1 if failed else 0)